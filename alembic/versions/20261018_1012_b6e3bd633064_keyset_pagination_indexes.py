@@ -0,0 +1,48 @@
+"""Keyset pagination indexes
+
+Revision ID: b6e3bd633064
+Revises: dd801a9ff90c
+Create Date: 2026-10-18 10:12:31.418203
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b6e3bd633064"
+down_revision: Union[str, None] = "dd801a9ff90c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = {
+    "ix_user_created_at_id": ["created_at", "id"],
+    "ix_user_modified_at_id": ["modified_at", "id"],
+    "ix_user_name_id": ["name", "id"],
+    "ix_user_surname_id": ["surname", "id"],
+    "ix_user_group_id_created_at_id": ["group_id", "created_at", "id"],
+}
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the user table writable while large indexes build.
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(
+                name,
+                "user",
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(
+                name,
+                table_name="user",
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,43 @@
+"""Trigram search indexes
+
+Revision ID: fbcaedc4643b
+Revises: b6e3bd633064
+Create Date: 2026-10-18 14:47:05.902317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "fbcaedc4643b"
+down_revision: Union[str, None] = "b6e3bd633064"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ("username", "name", "surname", "email")
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        for column in COLUMNS:
+            op.create_index(
+                f"ix_user_{column}_trgm",
+                "user",
+                [column],
+                unique=False,
+                postgresql_using="gin",
+                postgresql_ops={column: "gin_trgm_ops"},
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for column in COLUMNS:
+            op.drop_index(
+                f"ix_user_{column}_trgm",
+                table_name="user",
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,60 @@
+"""User search vector
+
+Revision ID: f19d6bf4b4fc
+Revises: fbcaedc4643b
+Create Date: 2026-10-18 16:39:52.117046
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f19d6bf4b4fc"
+down_revision: Union[str, None] = "fbcaedc4643b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', username), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(name, '') || ' ' || "
+    "coalesce(surname, '')), 'B') || "
+    "setweight(to_tsvector('simple', translate(email, '@.', '  ')), 'C')"
+)
+
+
+def upgrade() -> None:
+    # Adding a stored generated column rewrites the table under an exclusive
+    # lock; run this in a maintenance window on large installations.
+    op.add_column(
+        "user",
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed(SEARCH_VECTOR, persisted=True),
+            nullable=True,
+        ),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_user_search_vector",
+            "user",
+            ["search_vector"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_search_vector",
+            table_name="user",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("user", "search_vector")
@@ -0,0 +1,29 @@
+"""User image hash
+
+Revision ID: 587255ee9596
+Revises: f19d6bf4b4fc
+Create Date: 2026-10-18 18:21:07.480315
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "587255ee9596"
+down_revision: Union[str, None] = "f19d6bf4b4fc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Avatars uploaded before this revision have no hash; they are served with
+    # S3's ETag and bypass the avatar cache until they are replaced.
+    op.add_column("user", sa.Column("image_hash", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("user", "image_hash")
@@ -0,0 +1,39 @@
+"""User image_s3_path index
+
+Revision ID: ad52ac9ace22
+Revises: 587255ee9596
+Create Date: 2026-10-18 22:14:36.902117
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "ad52ac9ace22"
+down_revision: Union[str, None] = "587255ee9596"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Content-addressed avatars are shared between users and deleted once the
+    # last user pointing at them is gone; this index backs that count.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_user_image_s3_path",
+            "user",
+            ["image_s3_path"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_image_s3_path",
+            table_name="user",
+            postgresql_concurrently=True,
+        )
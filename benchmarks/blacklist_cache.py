@@ -0,0 +1,73 @@
+"""Compare auth dependency latency with and without the blacklist Bloom filter.
+
+Needs the Postgres and Redis from docker-compose:
+
+    python -m benchmarks.blacklist_cache --iterations 2000
+
+Populates the blacklist with revoked tokens, then resolves a valid access
+token through get_user_from_token, first with the cache disabled (every lookup
+reads the blacklist and the token epoch from Redis) and then with the cache
+warmed up, when only the first lookup has to read the epoch.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from src.auth.blacklist import blacklist_cache
+from src.auth.repository import create_auth_repository
+from src.auth.schemas import UserSignup
+from src.auth.service import AuthService
+from src.repository import create_base_user_repository
+from src.utils import get_user_from_token
+
+
+async def measure(token, iterations):
+    samples = []
+    async with create_base_user_repository() as user_repo:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await get_user_from_token(token, user_repo)
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(label, samples):
+    ordered = sorted(samples)
+    print(
+        f"{label:>14}: p50={statistics.median(ordered):.3f}ms "
+        f"p99={ordered[int(len(ordered) * 0.99) - 1]:.3f}ms"
+    )
+
+
+async def main(iterations, revoked):
+    name = f"bench_{uuid.uuid4().hex[:8]}"
+    async with create_auth_repository() as user_repo:
+        user = await user_repo.create_user(
+            UserSignup(username=name, email=f"{name}@example.com", password="x")
+        )
+        service = AuthService(user_repo)
+        token = (await service.create_tokens(user)).access_token
+        for _ in range(revoked):
+            await user_repo.blacklist_refresh_token(
+                (await service.create_tokens(user)).refresh_token, 1
+            )
+
+    report("without cache", await measure(token, iterations))
+
+    blacklist_cache.start()
+    while not blacklist_cache.ready:
+        await asyncio.sleep(0.05)
+    report("with cache", await measure(token, iterations))
+    print(blacklist_cache.stats())
+    await blacklist_cache.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--revoked", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.revoked))
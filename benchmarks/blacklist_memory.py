@@ -0,0 +1,56 @@
+"""Report Redis memory per million revocations for both blacklist formats.
+
+    python -m benchmarks.blacklist_memory --samples 10000
+
+Writes ``--samples`` entries in the legacy format (the full refresh JWT as key
+and value) and in the digest format (``bl:`` + 16 character digest, value
+``1``), measures them with MEMORY USAGE and extrapolates to one million.
+"""
+
+import argparse
+import asyncio
+import uuid
+
+from src.auth.blacklist import blacklist_key
+from src.auth.schemas import JwtRequest
+from src.auth.service import create_refresh_token
+from src.database import get_redis
+
+
+async def measure(redis, entries):
+    total = 0
+    async with redis.pipeline(transaction=False) as pipe:
+        for key, value in entries:
+            pipe.setex(key, 600, value)
+        await pipe.execute()
+    for key, _ in entries:
+        total += await redis.memory_usage(key)
+    await redis.delete(*(key for key, _ in entries))
+    return total / len(entries)
+
+
+async def main(samples):
+    claims = JwtRequest(
+        username="benchmark_user",
+        user_id=str(uuid.uuid4()),
+        role="USER",
+        is_blocked=False,
+        group_id=1,
+    ).model_dump()
+    tokens = [create_refresh_token(claims) for _ in range(samples)]
+    async with get_redis() as redis:
+        legacy = await measure(redis, [(token, token) for token in tokens])
+        compact = await measure(
+            redis, [(blacklist_key(str(uuid.uuid4())), 1) for _ in tokens]
+        )
+    million = 1_000_000 / 2**20
+    print(f"token length: {len(tokens[0])} bytes")
+    print(f"legacy:  {legacy:.0f} B/entry, {legacy * million:.0f} MiB per million")
+    print(f"digest:  {compact:.0f} B/entry, {compact * million:.0f} MiB per million")
+    print(f"saved:   {(legacy - compact) * million:.0f} MiB per million revocations")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=10000)
+    asyncio.run(main(parser.parse_args().samples))
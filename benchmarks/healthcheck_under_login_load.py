@@ -0,0 +1,92 @@
+"""Measure /healthcheck/ latency while concurrent logins hammer bcrypt.
+
+Run against a live server (e.g. the docker-compose stack):
+
+    python -m benchmarks.healthcheck_under_login_load --base-url http://localhost:8000
+
+Before password hashing moved to the bounded executor every login blocked the
+event loop for the full bcrypt cost, so health check p99 tracked the login
+queue length. With the executor it should stay in the low milliseconds.
+
+Rate-limited logins (429) never reach bcrypt, so start the server with
+LOGIN_RATE_LIMIT_ENABLED=false; the login statuses are printed to check it.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def login_worker(client, credentials, stop, statuses):
+    while not stop.is_set():
+        response = await client.post("/auth/login/", data=credentials)
+        statuses[response.status_code] += 1
+
+
+async def probe_health(client, duration, interval):
+    samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get("/healthcheck/")
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return samples
+
+
+async def main(base_url, logins, duration, interval):
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    credentials = {"username": username, "password": "benchmark-password"}
+    limits = httpx.Limits(max_connections=logins + 10)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        await client.post(
+            "/auth/signup/",
+            json={**credentials, "email": f"{username}@example.com"},
+        )
+        idle = await probe_health(client, duration / 2, interval)
+        stop = asyncio.Event()
+        statuses = Counter()
+        workers = [
+            asyncio.create_task(login_worker(client, credentials, stop, statuses))
+            for _ in range(logins)
+        ]
+        loaded = await probe_health(client, duration, interval)
+        stop.set()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    for label, samples in (("idle", idle), (f"{logins} logins", loaded)):
+        print(
+            f"{label:>12}: n={len(samples)} "
+            f"p50={statistics.median(samples):.1f}ms "
+            f"p99={percentile(samples, 99):.1f}ms "
+            f"max={max(samples):.1f}ms"
+        )
+    print(f"login statuses: {dict(sorted(statuses.items()))}")
+    if statuses[429]:
+        print(
+            "WARNING: logins were rate limited and skipped bcrypt; restart the "
+            "server with LOGIN_RATE_LIMIT_ENABLED=false"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--interval", type=float, default=0.01)
+    args = parser.parse_args()
+    asyncio.run(main(args.base_url, args.logins, args.duration, args.interval))
@@ -0,0 +1,93 @@
+"""Time resolving the avatars of one page of users, sequentially vs concurrently.
+
+Needs the localstack S3 from docker-compose:
+
+    python -m benchmarks.users_avatars --users 100
+
+Uploads an avatar for the generated users (no database involved), then times
+UserService.get_users_data_with_avatars against the old one-by-one loop. The
+avatars are inlined so that every user costs an S3 round trip.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime
+
+from starlette.datastructures import Headers, UploadFile
+
+from src.aws.user_image_service import S3UserImageService
+from src.models import User
+from src.users import service as users_service
+from src.users.service import UserService
+
+AVATAR_FILE = "tests/test_files/test_avatar.jpg"
+
+
+async def seed(users):
+    with open(AVATAR_FILE, "rb") as avatar:
+        path, _ = await S3UserImageService().upload_avatar(
+            UploadFile(
+                avatar,
+                filename="avatar.jpg",
+                headers=Headers({"content-type": "image/jpeg"}),
+            )
+        )
+    # Identical avatars share one object, but every user still costs a GET.
+    return [
+        User(
+            id=uuid.uuid4(),
+            username=f"bench_avatar_{i}",
+            email=f"bench_avatar_{i}@example.com",
+            role="USER",
+            is_blocked=False,
+            created_at=datetime.now(),
+            modified_at=None,
+            image_s3_path=path,
+        )
+        for i in range(users)
+    ]
+
+
+async def timed(coroutine_factory, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await coroutine_factory()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+async def main(users, repeat, concurrency):
+    users_service.settings.AVATAR_RESPONSE_MODE = "inline"
+    users_service.settings.AVATAR_FETCH_CONCURRENCY = concurrency
+    page = await seed(users)
+    service = UserService(None)
+    try:
+
+        async def sequential():
+            return [await service.get_user_data_with_avatar(user) for user in page]
+
+        sequential_ms, _ = await timed(sequential, repeat)
+        concurrent_ms, result = await timed(
+            lambda: service.get_users_data_with_avatars(page), repeat
+        )
+        missing = sum(user_data.image is None for user_data in result)
+        print(
+            f"users={users}  sequential={sequential_ms:9.2f}ms  "
+            f"concurrent={concurrent_ms:9.2f}ms  (concurrency={concurrency}, "
+            f"{missing} avatars over budget)"
+        )
+    finally:
+        await S3UserImageService().delete_avatar(page[0].image_s3_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.repeat, args.concurrency))
@@ -0,0 +1,100 @@
+"""Compare OFFSET and keyset (cursor) pagination of GET /users/ by page depth.
+
+Needs the Postgres from docker-compose with migrations applied:
+
+    python -m benchmarks.users_pagination --users 1000000
+
+Seeds the user table with generated rows (skipped if they are already there),
+then times UserRepository.get_users for pages at increasing depths, once with
+page/OFFSET and once starting after the previous page's last row.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import func, select, text
+
+from src.database import async_session_maker
+from src.models import User
+from src.users.repository import UserRepository
+
+SEED_PREFIX = "bench_page_"
+
+SEED_SQL = text(
+    f"""
+    INSERT INTO "user" (id, username, hashed_password, email, role, is_blocked,
+                        created_at, name)
+    SELECT gen_random_uuid(), '{SEED_PREFIX}' || g, 'x',
+           '{SEED_PREFIX}' || g || '@example.com', 'USER', false,
+           now() - g * interval '1 second',
+           CASE WHEN g % 10 = 0 THEN NULL ELSE md5(g::text) END
+    FROM generate_series(:start, :stop) AS g
+    """
+)
+
+
+async def seed(users):
+    async with async_session_maker() as session:
+        existing = await session.scalar(
+            select(func.count()).where(User.username.like(f"{SEED_PREFIX}%"))
+        )
+        if existing < users:
+            await session.execute(SEED_SQL, {"start": existing + 1, "stop": users})
+            await session.execute(text('ANALYZE "user"'))
+            await session.commit()
+            print(f"Seeded {users - existing} users")
+
+
+async def timed(coroutine_factory, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await coroutine_factory()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+async def main(users, limit, repeat, sort_by, order_by):
+    await seed(users)
+    depths = [
+        d for d in (0, 1_000, 10_000, 100_000, 500_000, users - limit) if d < users
+    ]
+    async with async_session_maker() as session:
+        user_repo = UserRepository(session)
+        for depth in depths:
+            page = depth // limit + 1
+            offset_ms = await timed(
+                lambda: user_repo.get_users(page, limit, None, sort_by, order_by),
+                repeat,
+            )
+            previous = []
+            if depth:
+                previous = await user_repo.get_users(
+                    page - 1, limit, None, sort_by, order_by
+                )
+            after = (
+                (getattr(previous[-1], sort_by), previous[-1].id) if previous else None
+            )
+            keyset_ms = await timed(
+                lambda: user_repo.get_users(
+                    1, limit, None, sort_by, order_by, after=after
+                ),
+                repeat,
+            )
+            print(
+                f"depth={depth:>9}  offset={offset_ms:9.2f}ms  "
+                f"cursor={keyset_ms:7.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sort-by", default="created_at")
+    parser.add_argument("--order-by", default="desc")
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.limit, args.repeat, args.sort_by, args.order_by))
@@ -0,0 +1,214 @@
+import asyncio
+import base64
+import hashlib
+from typing import Dict, List, Optional
+
+from logs.logs import configure_logger
+from src.bloom import BloomFilter
+from src.database import get_redis
+from src.settings import Settings
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+BLACKLIST_CHANNEL = "token_blacklist"
+BLACKLIST_KEY_PREFIX = "bl:"
+# Before tokens carried a jti, entries were stored under the raw JWT, so every
+# legacy key starts with the base64url-encoded '{"' of the JWT header.
+LEGACY_BLACKLIST_KEY_PATTERN = "eyJ*"
+# Token epoch bumps share the channel; blacklist keys never start with this.
+TOKEN_EPOCH_MESSAGE_PREFIX = "epoch:"
+
+
+def get_token_id(token: str, payload: dict) -> str:
+    return payload.get("jti") or token
+
+
+def blacklist_key(token_id: str) -> str:
+    digest = hashlib.blake2b(token_id.encode("utf-8"), digest_size=12).digest()
+    return BLACKLIST_KEY_PREFIX + base64.urlsafe_b64encode(digest).decode("ascii")
+
+
+def blacklist_lookup_keys(token: str, payload: dict) -> List[str]:
+    keys = [blacklist_key(get_token_id(token, payload))]
+    if settings.BLACKLIST_LEGACY_KEYS:
+        keys.append(token)
+    return keys
+
+
+class BlacklistCache:
+    """In-process Bloom filter of blacklist keys.
+
+    A negative answer means the token is definitely not blacklisted, so the
+    Redis lookup can be skipped. The filter is rebuilt from Redis on startup
+    and periodically (Bloom filters cannot forget expired tokens) and is kept
+    current through the ``token_blacklist`` pub/sub channel. Until the first
+    rebuild finishes, or while the subscription is down, every lookup goes to
+    Redis.
+
+    Token epochs read from Redis are kept as well, and bumps published on the
+    same channel overwrite them, so checking a token that is not blacklisted
+    needs no Redis call at all. Epochs only grow, so the highest value seen
+    wins over a read that raced a bump. They are forgotten whenever the
+    subscription drops, as bumps may have been missed meanwhile.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._bloom = self._new_filter()
+        self._rebuilding: Optional[BloomFilter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._epochs: Dict[str, int] = {}
+        self.generation = 0
+        self.lookups = 0
+        self.skipped = 0
+        self.redis_checks = 0
+        self.false_positives = 0
+        self.epoch_hits = 0
+
+    @staticmethod
+    def _new_filter() -> BloomFilter:
+        return BloomFilter(
+            settings.BLACKLIST_CACHE_CAPACITY, settings.BLACKLIST_CACHE_ERROR_RATE
+        )
+
+    def might_contain(self, keys: List[str]) -> bool:
+        self.lookups += 1
+        if self.ready and not any(key in self._bloom for key in keys):
+            self.skipped += 1
+            return False
+        self.redis_checks += 1
+        return True
+
+    def record_miss(self):
+        if self.ready:
+            self.false_positives += 1
+
+    def add(self, key: str):
+        self._bloom.add(key)
+        if self._rebuilding is not None:
+            self._rebuilding.add(key)
+
+    def token_epoch(self, user_id) -> Optional[int]:
+        if not self.ready:
+            return None
+        epoch = self._epochs.get(str(user_id))
+        if epoch is not None:
+            self.epoch_hits += 1
+        return epoch
+
+    def remember_epoch(self, user_id, epoch: int, generation: Optional[int] = None):
+        """Keep an epoch; pass the generation read before fetching it from Redis."""
+        if not self.ready or generation not in (None, self.generation):
+            return
+        user_id = str(user_id)
+        if user_id not in self._epochs:
+            if len(self._epochs) >= settings.TOKEN_EPOCH_CACHE_SIZE:
+                self._epochs.pop(next(iter(self._epochs)))
+            self._epochs[user_id] = epoch
+        else:
+            self._epochs[user_id] = max(self._epochs[user_id], epoch)
+
+    def _forget_epochs(self):
+        self.generation += 1
+        self._epochs.clear()
+
+    def _handle(self, data: str):
+        if data.startswith(TOKEN_EPOCH_MESSAGE_PREFIX):
+            user_id, _, epoch = data[len(TOKEN_EPOCH_MESSAGE_PREFIX) :].rpartition(":")
+            self.remember_epoch(user_id, int(epoch))
+        else:
+            self.add(data)
+
+    async def rebuild(self):
+        self._rebuilding = self._new_filter()
+        try:
+            patterns = [f"{BLACKLIST_KEY_PREFIX}*"]
+            if settings.BLACKLIST_LEGACY_KEYS:
+                patterns.append(LEGACY_BLACKLIST_KEY_PATTERN)
+            async with get_redis() as redis:
+                for pattern in patterns:
+                    async for key in redis.scan_iter(match=pattern, count=1000):
+                        self._rebuilding.add(key)
+            self._bloom = self._rebuilding
+        finally:
+            self._rebuilding = None
+        logger.info(f"Token blacklist cache rebuilt with {self._bloom.count} entries")
+
+    async def _run(self):
+        while True:
+            try:
+                async with get_redis() as redis:
+                    pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                    await pubsub.subscribe(BLACKLIST_CHANNEL)
+                    self._forget_epochs()
+                    try:
+                        await self.rebuild()
+                        await self._drain(pubsub)
+                        self.ready = True
+                        await self._listen(pubsub)
+                    finally:
+                        self.ready = False
+                        self._forget_epochs()
+                        await pubsub.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Token blacklist cache error: {e} ({type(e)})")
+                await asyncio.sleep(settings.BLACKLIST_CACHE_RETRY_SECONDS)
+
+    async def _drain(self, pubsub):
+        while (message := await pubsub.get_message(timeout=0)) is not None:
+            self._handle(message["data"])
+
+    async def _listen(self, pubsub):
+        loop = asyncio.get_running_loop()
+        rebuild_at = loop.time() + settings.BLACKLIST_CACHE_REBUILD_SECONDS
+        rebuild: Optional[asyncio.Task] = None
+        try:
+            while True:
+                message = await pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    self._handle(message["data"])
+                if rebuild is not None and rebuild.done():
+                    # A failed rebuild raises here and resubscribes.
+                    rebuild.result()
+                    rebuild = None
+                if rebuild is None and loop.time() >= rebuild_at:
+                    # Messages keep being consumed during the SCAN; add() puts
+                    # them in the filter being rebuilt as well.
+                    rebuild = asyncio.create_task(self.rebuild())
+                    rebuild_at = loop.time() + settings.BLACKLIST_CACHE_REBUILD_SECONDS
+        finally:
+            if rebuild is not None:
+                rebuild.cancel()
+                await asyncio.gather(rebuild, return_exceptions=True)
+
+    def start(self):
+        if settings.BLACKLIST_CACHE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "entries": self._bloom.count,
+            "lookups": self.lookups,
+            "skipped_redis": self.skipped,
+            "redis_checks": self.redis_checks,
+            "false_positives": self.false_positives,
+            "epochs": len(self._epochs),
+            "epoch_hits": self.epoch_hits,
+            "hit_rate": self.skipped / self.lookups if self.lookups else 0.0,
+        }
+
+
+blacklist_cache = BlacklistCache()
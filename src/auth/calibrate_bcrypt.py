@@ -0,0 +1,49 @@
+"""Benchmark bcrypt on this machine and recommend BCRYPT_ROUNDS.
+
+    python -m src.auth.calibrate_bcrypt --target-ms 250
+
+Each extra round doubles the hashing time, so the recommendation is the
+highest cost whose median hash time stays within the target.
+"""
+import argparse
+import statistics
+import time
+
+import bcrypt
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 20
+
+
+def time_hash(rounds: int, samples: int) -> float:
+    durations = []
+    for _ in range(samples):
+        salt = bcrypt.gensalt(rounds)
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", salt)
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def calibrate(target_ms: float, samples: int) -> int:
+    recommended = MIN_ROUNDS
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        duration = time_hash(rounds, samples)
+        print(f"rounds={rounds:>2}  median={duration:9.1f}ms")
+        if duration > target_ms:
+            break
+        recommended = rounds
+    return recommended
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args()
+    recommended = calibrate(args.target_ms, args.samples)
+    print(f"Recommended: BCRYPT_ROUNDS={recommended}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import math
+import time
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+from logs.logs import configure_logger
+from src.database import get_redis
+from src.settings import Settings
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+LOGIN_RATE_LIMIT_KEY_PREFIX = "login_rl:"
+
+# Token buckets for every key are refilled and checked together; a token is
+# only taken from each bucket when all of them allow the attempt, otherwise
+# the script returns the milliseconds until the emptiest bucket refills.
+# KEYS: bucket keys
+# ARGV: now in ms, then capacity and refill rate (tokens per ms) per key
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local retry_after = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    if tokens < 1 then
+        retry_after = math.max(retry_after, math.ceil((1 - tokens) / rate))
+    end
+    levels[i] = tokens
+end
+if retry_after > 0 then
+    return retry_after
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', key, 'tokens', levels[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate))
+end
+return 0
+"""
+
+
+async def get_rate_limit_redis():
+    async with get_redis() as redis:
+        yield redis
+
+
+async def check_rate_limit(redis, limits: dict) -> int:
+    """Consume one attempt from each ``{key: (attempts, period_seconds)}``.
+
+    Returns 0 when the attempt is allowed, otherwise the number of
+    milliseconds until it would be.
+    """
+    args = [int(time.time() * 1000)]
+    for attempts, period_seconds in limits.values():
+        args.extend([attempts, attempts / (period_seconds * 1000)])
+    script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+    return int(await script(keys=list(limits), args=args))
+
+
+async def login_rate_limit(
+    request: Request,
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    redis=Depends(get_rate_limit_redis),
+):
+    if not settings.LOGIN_RATE_LIMIT_ENABLED:
+        return
+    client_ip = request.client.host if request.client else "unknown"
+    limits = {
+        f"{LOGIN_RATE_LIMIT_KEY_PREFIX}user:{form_data.username}": (
+            settings.LOGIN_RATE_LIMIT_USERNAME_ATTEMPTS,
+            settings.LOGIN_RATE_LIMIT_USERNAME_PERIOD_SECONDS,
+        ),
+        f"{LOGIN_RATE_LIMIT_KEY_PREFIX}ip:{client_ip}": (
+            settings.LOGIN_RATE_LIMIT_IP_ATTEMPTS,
+            settings.LOGIN_RATE_LIMIT_IP_PERIOD_SECONDS,
+        ),
+    }
+    retry_after_ms = await check_rate_limit(redis, limits)
+    if retry_after_ms:
+        logger.debug(f"Login throttled for {form_data.username} from {client_ip}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, please try again later",
+            headers={"Retry-After": str(math.ceil(retry_after_ms / 1000))},
+        )
@@ -1,12 +1,65 @@
+import enum
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional, Tuple
 
+from fastapi import Depends
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.auth.blacklist import BLACKLIST_CHANNEL, blacklist_cache, blacklist_key
 from src.auth.schemas import UserSignup
-from src.database import create_async_session, get_redis
+from src.aws.email_outbox import enqueue_email
+from src.database import (
+    create_async_session,
+    get_redis,
+    get_request_redis,
+    get_request_session,
+)
 from src.models import User
-from src.repository import BaseUserRepository
+from src.repository import (
+    TOKEN_EPOCHS_KEY,
+    BaseUserRepository,
+    UserAlreadyExistsError,
+    get_violated_unique_field,
+)
+from src.settings import Settings
+
+settings = Settings()
+
+REVOKED_FAMILY_KEY_PREFIX = "fam:"
+
+# Checks and revokes a refresh token in one round trip. Using a token twice
+# (a replay) revokes its whole family, so the token issued by the first
+# rotation stops working as well.
+# KEYS: blacklist key, revoked family key, token epochs hash[, legacy key]
+# ARGV: ttl, user id, epoch claim ('' if absent), pub/sub channel
+ROTATE_REFRESH_TOKEN_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return {-1, 0}
+end
+local epoch = tonumber(redis.call('HGET', KEYS[3], ARGV[2]) or '0')
+if ARGV[3] ~= '' and tonumber(ARGV[3]) ~= epoch then
+    return {-2, epoch}
+end
+if KEYS[4] and redis.call('EXISTS', KEYS[4]) == 1 then
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[1])
+    return {0, epoch}
+end
+if not redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[1]) then
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[1])
+    return {0, epoch}
+end
+redis.call('PUBLISH', ARGV[4], KEYS[1])
+return {1, epoch}
+"""
+
+
+class RotationStatus(int, enum.Enum):
+    ROTATED = 1
+    REPLAYED = 0
+    FAMILY_REVOKED = -1
+    EPOCH_STALE = -2
 
 
 class AuthRepository(BaseUserRepository):
@@ -21,7 +74,17 @@ class AuthRepository(BaseUserRepository):
         )
         async with self.db_session as conn:
             conn.add(user)
-            await conn.commit()
+            try:
+                await conn.commit()
+            except IntegrityError as e:
+                await conn.rollback()
+                field = get_violated_unique_field(e)
+                if field is None:
+                    raise
+                raise UserAlreadyExistsError(field) from e
+        await self.remember_taken_values(
+            {"username": user.username, "email": user.email}
+        )
         return user
 
     async def update_password(self, user_id: int, new_password: str):
@@ -29,16 +92,67 @@ class AuthRepository(BaseUserRepository):
             user = await conn.get(User, user_id)
             user.hashed_password = new_password
             await conn.commit()
+        await self.bump_token_epoch(user_id)
+
+    async def replace_password_hash(
+        self, user_id, old_hashed_password: str, new_hashed_password: str
+    ):
+        # Only swaps the hash if the password was not changed in the meantime,
+        # and leaves the token epoch alone since the password is the same.
+        async with self.db_session as conn:
+            await conn.execute(
+                update(User)
+                .where(User.id == user_id, User.hashed_password == old_hashed_password)
+                .values(hashed_password=new_hashed_password)
+            )
+            await conn.commit()
+
+    async def blacklist_refresh_token(self, token_id: str, expire_time_in_days: int):
+        await self._blacklist_token(token_id, expire_time_in_days * 86400)
+
+    async def blacklist_reset_token(self, token_id: str, expire_time_in_minutes: int):
+        await self._blacklist_token(token_id, expire_time_in_minutes * 60)
 
-    async def blacklist_refresh_token(self, token: str, expire_time_in_days: int):
-        expire_time_in_seconds = expire_time_in_days * 86400
+    async def enqueue_email(self, subject: str, body: str, sender: str, recipient: str):
         async with self.redis_session as conn:
-            await conn.setex(token, expire_time_in_seconds, token)
+            await enqueue_email(conn, subject, body, sender, recipient)
 
-    async def blacklist_reset_token(self, token: str, expire_time_in_minutes: int):
-        expire_time_in_seconds = expire_time_in_minutes * 60
+    async def rotate_refresh_token(
+        self,
+        token: str,
+        token_id: str,
+        family_id: str,
+        user_id: str,
+        token_epoch: Optional[int],
+        expire_time_in_days: int,
+    ) -> Tuple[RotationStatus, int]:
+        key = blacklist_key(token_id)
+        keys = [key, REVOKED_FAMILY_KEY_PREFIX + family_id, TOKEN_EPOCHS_KEY]
+        if settings.BLACKLIST_LEGACY_KEYS:
+            keys.append(token)
+        args = [
+            expire_time_in_days * 86400,
+            user_id,
+            "" if token_epoch is None else token_epoch,
+            BLACKLIST_CHANNEL,
+        ]
+        generation = blacklist_cache.generation
         async with self.redis_session as conn:
-            await conn.setex(token, expire_time_in_seconds, token)
+            rotate = conn.register_script(ROTATE_REFRESH_TOKEN_SCRIPT)
+            status, epoch = await rotate(keys=keys, args=args)
+        blacklist_cache.remember_epoch(user_id, epoch, generation)
+        if status == RotationStatus.ROTATED:
+            blacklist_cache.add(key)
+        return RotationStatus(status), int(epoch)
+
+    async def _blacklist_token(self, token_id: str, expire_time_in_seconds: int):
+        key = blacklist_key(token_id)
+        blacklist_cache.add(key)
+        async with self.redis_session as conn:
+            async with conn.pipeline(transaction=False) as pipe:
+                pipe.setex(key, expire_time_in_seconds, 1)
+                pipe.publish(BLACKLIST_CHANNEL, key)
+                await pipe.execute()
 
 
 @asynccontextmanager
@@ -46,3 +160,10 @@ async def create_auth_repository() -> AsyncGenerator[AuthRepository, None]:
     async with create_async_session() as db_session:
         async with get_redis() as redis_session:
             yield AuthRepository(db_session, redis_session)
+
+
+async def get_auth_repository(
+    db_session: AsyncSession = Depends(get_request_session),
+    redis_session=Depends(get_request_redis),
+) -> AuthRepository:
+    return AuthRepository(db_session, redis_session)
@@ -1,11 +1,13 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
 from fastapi import APIRouter, Depends, Header
 from fastapi.security import OAuth2PasswordRequestForm
 
 from logs.logs import configure_logger
-from src.auth.repository import AuthRepository, create_auth_repository
+from src.auth.rate_limit import login_rate_limit
+from src.auth.repository import AuthRepository, get_auth_repository
 from src.auth.schemas import (
+    AvailabilityResponse,
     JwtResponse,
     UserEmail,
     UserLogin,
@@ -13,6 +15,9 @@ from src.auth.schemas import (
     UserSignup,
 )
 from src.auth.service import AuthService
+from src.models import User
+from src.users.schemas import UserUUIDList
+from src.utils import admin_permission, get_current_user, has_any_permission
 
 router = APIRouter()
 logger = configure_logger(__name__)
@@ -20,54 +25,87 @@ logger = configure_logger(__name__)
 
 @router.post("/signup/", response_model=JwtResponse)
 async def signup(
-    user: UserSignup, user_repo: AuthRepository = Depends(create_auth_repository)
+    user: UserSignup, user_repo: AuthRepository = Depends(get_auth_repository)
 ):
     logger.info("Signup endpoint accessed")
-    async with user_repo as user_repository:
-        result = await AuthService(user_repository).signup(user)
-        return result
+    result = await AuthService(user_repo).signup(user)
+    return result
+
+
+@router.get(
+    "/availability/",
+    response_model=AvailabilityResponse,
+    response_model_exclude_none=True,
+)
+async def availability(
+    username: Optional[str] = None,
+    email: Optional[str] = None,
+    phone_number: Optional[str] = None,
+    user_repo: AuthRepository = Depends(get_auth_repository),
+):
+    logger.info("Availability endpoint accessed")
+    values = {"username": username, "email": email, "phone_number": phone_number}
+    return await AuthService(user_repo).check_availability(values)
 
 
-@router.post("/login/", response_model=JwtResponse)
+@router.post(
+    "/login/", response_model=JwtResponse, dependencies=[Depends(login_rate_limit)]
+)
 async def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    user_repo: AuthRepository = Depends(create_auth_repository),
+    user_repo: AuthRepository = Depends(get_auth_repository),
 ):
     logger.info("Login endpoint accessed")
     user = UserLogin(username=form_data.username, password=form_data.password)
-    async with user_repo as user_repository:
-        return await AuthService(user_repository).login(user)
+    return await AuthService(user_repo).login(user)
 
 
 @router.post("/refresh-token/", response_model=JwtResponse)
 async def refresh_token(
     token: str = Header(),
-    user_repo: AuthRepository = Depends(create_auth_repository),
+    user_repo: AuthRepository = Depends(get_auth_repository),
 ):
     logger.info("Refresh endpoint accessed")
-    async with user_repo as user_repository:
-        result = await AuthService(user_repository).get_new_tokens(token)
+    result = await AuthService(user_repo).get_new_tokens(token)
     return result
 
 
 @router.post("/reset-password-request/")
 async def reset_password_request(
     reset_request: UserEmail,
-    user_repo: AuthRepository = Depends(create_auth_repository),
+    user_repo: AuthRepository = Depends(get_auth_repository),
 ):
     logger.info("Reset password (send email stage) endpoint accessed")
-    async with user_repo as user_repository:
-        link = await AuthService(user_repository).send_reset_password_email(
-            reset_request.email
-        )
+    link = await AuthService(user_repo).send_reset_password_email(reset_request.email)
     return {"message": "Password reset email sent", "reset_link": link}
 
 
 @router.post("/reset-password/")
 async def reset_password(
-    data: UserResetPassword, user_repo: AuthRepository = Depends(create_auth_repository)
+    data: UserResetPassword, user_repo: AuthRepository = Depends(get_auth_repository)
 ):
     logger.info("Reset password (set new password stage) endpoint accessed")
-    async with user_repo as user_repository:
-        await AuthService(user_repository).reset_password(data)
+    await AuthService(user_repo).reset_password(data)
     return {"message": "Password reset successful"}
+
+
+@router.post("/logout-all/")
+async def logout_all(
+    user: User = Depends(get_current_user),
+    user_repo: AuthRepository = Depends(get_auth_repository),
+):
+    logger.info("Logout from all sessions endpoint accessed")
+    await AuthService(user_repo).revoke_sessions([user.id])
+    return {"message": "All sessions revoked"}
+
+
+@router.post("/revoke-sessions/")
+@has_any_permission([admin_permission])
+async def revoke_sessions(
+    user_uuid_list: UserUUIDList,
+    user: User = Depends(get_current_user),
+    user_repo: AuthRepository = Depends(get_auth_repository),
+):
+    logger.info("Revoke sessions endpoint accessed")
+    await AuthService(user_repo).revoke_sessions(user_uuid_list.uuid_list)
+    return {"message": f"Sessions of {len(user_uuid_list.uuid_list)} users revoked"}
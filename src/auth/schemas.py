@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel, EmailStr
 
 
@@ -11,6 +13,9 @@ class JwtRequest(BaseModel):
     user_id: str
     role: str
     is_blocked: bool
+    group_id: Optional[int] = None
+    token_epoch: int = 0
+    family_id: Optional[str] = None
 
 
 class UserLogin(BaseModel):
@@ -31,3 +36,9 @@ class UserResetPassword(BaseModel):
 
 class UserEmail(BaseModel):
     email: EmailStr
+
+
+class AvailabilityResponse(BaseModel):
+    username: Optional[bool] = None
+    email: Optional[bool] = None
+    phone_number: Optional[bool] = None
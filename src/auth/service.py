@@ -1,23 +1,28 @@
+import asyncio
+import uuid
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
 
 import bcrypt
 import jwt
 from fastapi import HTTPException, status
 
 from logs.logs import configure_logger
-from src.auth.repository import AuthRepository
+from src.auth.blacklist import get_token_id
+from src.auth.repository import AuthRepository, RotationStatus, create_auth_repository
 from src.auth.schemas import (
+    AvailabilityResponse,
     JwtRequest,
     JwtResponse,
     UserLogin,
     UserResetPassword,
     UserSignup,
 )
-from src.aws.email_service import SESEmailService
+from src.executors import hashing_executor
 from src.models import User
+from src.repository import UserAlreadyExistsError
 from src.settings import Settings
-from src.utils import get_current_user
+from src.utils import decode_token, get_user_from_token
 
 logger = configure_logger(__name__)
 settings = Settings()
@@ -33,52 +38,48 @@ class AuthService:
         if not user:
             logger.debug("User authentication failed: invalid username")
             return None
-        if not verify_password(password, user.hashed_password):
+        if not await verify_password(password, user.hashed_password):
             logger.debug(f"User {username} authentication failed: invalid password")
             return None
+        if needs_rehash(user.hashed_password):
+            schedule_password_rehash(user.id, user.hashed_password, password)
         logger.debug(f"Successful authentication: user {username} found")
         return user
 
     async def signup(self, user: UserSignup) -> JwtResponse:
         logger.debug("Starting signup")
-        existing_user_with_username = await self.user_repo.get_user_by_username(
-            user.username
+        # Rejecting taken identifiers up front skips the bcrypt hash; the
+        # unique constraints still decide races between concurrent signups.
+        taken_fields = await self.user_repo.find_taken_fields(
+            {"username": user.username, "email": user.email}
         )
-        existing_user_with_email = await self.user_repo.get_user_by_email(user.email)
-        if existing_user_with_username:
-            logger.debug(
-                f"Signup failed: user with username {user.username} is already exists"
-            )
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"User with username '{user.username}' already exists",
-            )
-        if existing_user_with_email:
-            logger.debug(
-                f"Signup failed: user with email {user.email} is already exists"
-            )
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"User with email '{user.email}' already exists",
-            )
-        hashed_password = get_password_hash(user.password)
+        if taken_fields:
+            raise user_already_exists(taken_fields[0], getattr(user, taken_fields[0]))
+        hashed_password = await get_password_hash(user.password)
         user_data = {
             "email": user.email,
             "password": hashed_password,
             "username": user.username,
         }
-        user = await self.user_repo.create_user(UserSignup(**user_data))
-        jwt_request = JwtRequest(
-            username=user.username,
-            user_id=str(user.id),
-            role=user.role,
-            is_blocked=user.is_blocked,
-        ).model_dump()
-        access_token, refresh_token = create_access_token(
-            jwt_request
-        ), create_refresh_token(jwt_request)
+        try:
+            user = await self.user_repo.create_user(UserSignup(**user_data))
+        except UserAlreadyExistsError as e:
+            raise user_already_exists(e.field, getattr(user, e.field, None))
+        tokens = await self.create_tokens(user, token_epoch=0)
         logger.debug(f"Successful signup: user {user.username} created")
-        return JwtResponse(access_token=access_token, refresh_token=refresh_token)
+        return tokens
+
+    async def check_availability(self, values: dict) -> AvailabilityResponse:
+        values = {field: value for field, value in values.items() if value}
+        if not values:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Provide a username, email or phone number to check",
+            )
+        taken_fields = await self.user_repo.find_taken_fields(values)
+        return AvailabilityResponse(
+            **{field: field not in taken_fields for field in values}
+        )
 
     async def login(self, user: UserLogin) -> JwtResponse:
         logger.debug(f"Starting user {user.username} login")
@@ -90,18 +91,9 @@ class AuthService:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
             )
-        jwt_request = JwtRequest(
-            username=user.username,
-            user_id=str(user.id),
-            role=user.role,
-            is_blocked=user.is_blocked,
-        ).model_dump()
-        access_token, refresh_token = (
-            create_access_token(jwt_request),
-            create_refresh_token(jwt_request),
-        )
+        tokens = await self.create_tokens(user)
         logger.debug(f"Successful {user.username} login")
-        return JwtResponse(access_token=access_token, refresh_token=refresh_token)
+        return tokens
 
     async def send_reset_password_email(self, email: str) -> str:
         logger.debug(f"Sending reset password email for {email}")
@@ -114,66 +106,150 @@ class AuthService:
             )
         reset_token = create_reset_password_token(email)
         link = f"localhost:4200/reset-password?reset_password_token={reset_token}"
-        email_service = SESEmailService()
-        await email_service.verify_email("sender@example.com")
-        await email_service.send_email(
+        await self.user_repo.enqueue_email(
             subject="Reset password email",
             body=link,
-            sender="sender@example.com",
+            sender=settings.EMAIL_SENDER,
             recipient=email,
         )
-        logger.debug(f"Sending reset password email to: {email} with link: {link}")
+        logger.debug(f"Queued reset password email to: {email} with link: {link}")
         return link
 
     async def reset_password(self, data: UserResetPassword):
-        user = await get_current_user(data.reset_token, by="email")
+        user = await get_user_from_token(data.reset_token, self.user_repo, by="email")
         logger.debug(f"Starting user {user.username} resetting password")
         await self.user_repo.blacklist_reset_token(
-            data.reset_token, settings.RESET_TOKEN_EXPIRE_MINUTES
+            get_token_id(data.reset_token, decode_token(data.reset_token)),
+            settings.RESET_TOKEN_EXPIRE_MINUTES,
         )
-        hashed_password = get_password_hash(data.new_password)
+        hashed_password = await get_password_hash(data.new_password)
         await self.user_repo.update_password(
             user_id=user.id, new_password=hashed_password
         )
         logger.debug(f"{user.email} reset password successfully")
 
     async def get_new_tokens(self, refresh_token: str) -> JwtResponse:
-        user = await get_current_user(refresh_token)
-        logger.debug(f"Starting user {user.username} refreshing tokens")
-        await self.user_repo.blacklist_refresh_token(
-            refresh_token, settings.REFRESH_TOKEN_EXPIRE_DAYS
+        payload = decode_token(refresh_token)
+        user_id = payload.get("user_id")
+        if user_id is None:
+            logger.debug("Refresh failed: token has no user id")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
+            )
+        token_id = get_token_id(refresh_token, payload)
+        family_id = payload.get("family_id") or token_id
+        rotation_status, token_epoch = await self.user_repo.rotate_refresh_token(
+            token=refresh_token,
+            token_id=token_id,
+            family_id=family_id,
+            user_id=user_id,
+            token_epoch=payload.get("token_epoch"),
+            expire_time_in_days=settings.REFRESH_TOKEN_EXPIRE_DAYS,
         )
+        if rotation_status == RotationStatus.REPLAYED:
+            logger.warning(
+                f"Refresh token replay for user {user_id}: family {family_id} revoked"
+            )
+            raise HTTPException(status_code=401, detail="Token is blacklisted")
+        if rotation_status != RotationStatus.ROTATED:
+            logger.debug(f"Refresh failed: tokens of user {user_id} revoked")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked",
+            )
+        user = await self.user_repo.get_user_by_id(user_id)
+        if user is None:
+            logger.debug("Refresh failed: user not found")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
+            )
+        logger.debug(f"Starting user {user.username} refreshing tokens")
+        tokens = await self.create_tokens(user, token_epoch, family_id)
+        logger.debug(f"{user.email} refreshed tokens successfully")
+        return tokens
+
+    async def revoke_sessions(self, user_ids: List[str]):
+        logger.debug(f"Revoking sessions of {len(user_ids)} users")
+        await self.user_repo.bump_token_epochs(user_ids)
+
+    async def create_tokens(
+        self,
+        user: User,
+        token_epoch: Optional[int] = None,
+        family_id: Optional[str] = None,
+    ) -> JwtResponse:
+        if token_epoch is None:
+            token_epoch = await self.user_repo.get_token_epoch(user.id)
         jwt_request = JwtRequest(
             username=user.username,
             user_id=str(user.id),
             role=user.role,
             is_blocked=user.is_blocked,
+            group_id=user.group_id,
+            token_epoch=token_epoch,
+            family_id=family_id or uuid.uuid4().hex,
         ).model_dump()
         access_token, refresh_token = (
             create_access_token(jwt_request),
             create_refresh_token(jwt_request),
         )
-        logger.debug(f"{user.email} refreshed tokens successfully")
         return JwtResponse(access_token=access_token, refresh_token=refresh_token)
 
 
-def verify_password(password, hashed_password) -> bool:
+def _check_password(password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
 
 
-def get_password_hash(password) -> str:
-    salt = bcrypt.gensalt()
+def _hash_password(password: str, rounds: int) -> str:
+    salt = bcrypt.gensalt(rounds)
     hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed_password.decode("utf-8")
 
 
+async def verify_password(password, hashed_password) -> bool:
+    return await hashing_executor.run(_check_password, password, hashed_password)
+
+
+async def get_password_hash(password) -> str:
+    return await hashing_executor.run(_hash_password, password, settings.BCRYPT_ROUNDS)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    # bcrypt hashes look like $2b$<rounds>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+_background_tasks = set()
+
+
+def schedule_password_rehash(user_id, hashed_password: str, password: str):
+    task = asyncio.create_task(_rehash_password(user_id, hashed_password, password))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _rehash_password(user_id, hashed_password: str, password: str):
+    try:
+        new_hashed_password = await get_password_hash(password)
+        async with create_auth_repository() as user_repo:
+            await user_repo.replace_password_hash(
+                user_id, hashed_password, new_hashed_password
+            )
+        logger.debug(f"Rehashed password of user {user_id}")
+    except Exception as e:
+        logger.warning(f"Password rehash for user {user_id} skipped: {e}")
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(
         to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
     )
@@ -183,7 +259,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
 def create_refresh_token(data: dict) -> str:
     to_encode = data.copy()
     expiration = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expiration})
+    to_encode.update({"exp": expiration, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(
         to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
     )
@@ -196,6 +272,15 @@ def create_reset_password_token(email: str) -> str:
         "exp": datetime.utcnow()
         + timedelta(minutes=settings.RESET_TOKEN_EXPIRE_MINUTES),
         "type": "reset",
+        "jti": uuid.uuid4().hex,
     }
     reset_token = jwt.encode(payload, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return reset_token
+
+
+def user_already_exists(field: str, value) -> HTTPException:
+    logger.debug(f"Signup failed: user with {field} {value} is already exists")
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"User with {field} '{value}' already exists",
+    )
@@ -0,0 +1,138 @@
+"""Redis Bloom filters of taken usernames, emails and phone numbers.
+
+A negative answer from a filter means the value is definitely free, so the
+database is only queried for possible matches. Bloom filters cannot forget,
+so values of deleted or renamed users keep answering "maybe" until the
+filters are rebuilt:
+
+    python -m src.availability
+"""
+
+import asyncio
+from typing import Dict, Iterable
+
+from sqlalchemy import select
+
+from logs.logs import configure_logger
+from src.bloom import RedisBloomFilter
+from src.database import async_session_maker, close_redis_pool, get_redis
+from src.models import User
+from src.settings import Settings
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+AVAILABILITY_FIELDS = ("username", "email", "phone_number")
+AVAILABILITY_KEY_PREFIX = "avail_bloom:"
+# Hash of field -> "1" for filters that have been fully built at least once.
+# Until then every lookup falls through to the database.
+AVAILABILITY_READY_KEY = f"{AVAILABILITY_KEY_PREFIX}ready"
+BUILD_BATCH_SIZE = 5000
+# Leftover temporary bitmaps of an interrupted rebuild expire on their own.
+BUILD_KEY_TTL_SECONDS = 3600
+
+availability_filters = {
+    field: RedisBloomFilter(
+        f"{AVAILABILITY_KEY_PREFIX}{field}",
+        settings.AVAILABILITY_FILTER_CAPACITY,
+        settings.AVAILABILITY_FILTER_ERROR_RATE,
+    )
+    for field in AVAILABILITY_FIELDS
+}
+
+
+def building_key(field: str) -> str:
+    return f"{availability_filters[field].key}:building"
+
+
+async def might_be_taken(redis, values: Dict[str, str]) -> Dict[str, bool]:
+    """Return, per field, whether the value may already belong to a user."""
+    values = {field: value for field, value in values.items() if value}
+    if not settings.AVAILABILITY_FILTER_ENABLED or not values:
+        return {field: True for field in values}
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hmget(AVAILABILITY_READY_KEY, list(values))
+        for field, value in values.items():
+            await availability_filters[field].contains(pipe, value)
+        ready, *matches = await pipe.execute()
+    return {
+        field: not is_ready or bool(match)
+        for field, is_ready, match in zip(values, ready, matches)
+    }
+
+
+async def mark_taken(redis, values: Dict[str, str]):
+    await mark_all_taken(redis, [values])
+
+
+async def mark_all_taken(redis, rows: Iterable[Dict[str, str]]):
+    rows = [
+        {field: value for field, value in values.items() if value} for values in rows
+    ]
+    if not settings.AVAILABILITY_FILTER_ENABLED or not any(rows):
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        for values in rows:
+            for field, value in values.items():
+                # While a rebuild is running the value also goes into the
+                # bitmap being built, so it survives the swap.
+                await availability_filters[field].add(
+                    pipe, value, also_to=[building_key(field)]
+                )
+        await pipe.execute()
+
+
+async def rebuild_availability_filters(fields: Iterable[str] = AVAILABILITY_FIELDS):
+    """Rebuild the filters from the ``user`` table.
+
+    Each filter is written to a temporary key that is swapped in atomically
+    once the scan is done, which also drops the bits of freed values.
+    """
+    fields = list(fields)
+    columns = [getattr(User, field) for field in fields]
+    total = 0
+    async with get_redis() as redis:
+        async with redis.pipeline(transaction=True) as pipe:
+            for field in fields:
+                # Clearing the last bit allocates the whole bitmap, and the key
+                # existing is what makes mark_taken write to it as well.
+                pipe.delete(building_key(field))
+                pipe.setbit(
+                    building_key(field), availability_filters[field].size - 1, 0
+                )
+                pipe.expire(building_key(field), BUILD_KEY_TTL_SECONDS)
+            await pipe.execute()
+        async with async_session_maker() as session:
+            result = await session.stream(
+                select(*columns).execution_options(yield_per=BUILD_BATCH_SIZE)
+            )
+            async for rows in result.partitions():
+                async with redis.pipeline(transaction=False) as pipe:
+                    for row in rows:
+                        for field, value in zip(fields, row):
+                            if value:
+                                await availability_filters[field].add(
+                                    pipe, value, key=building_key(field)
+                                )
+                    await pipe.execute()
+                total += len(rows)
+        async with redis.pipeline(transaction=True) as pipe:
+            for field in fields:
+                pipe.rename(building_key(field), availability_filters[field].key)
+                pipe.persist(availability_filters[field].key)
+                pipe.hset(AVAILABILITY_READY_KEY, field, 1)
+            await pipe.execute()
+    logger.info(f"Availability filters rebuilt from {total} users")
+    return total
+
+
+async def main():
+    try:
+        total = await rebuild_availability_filters()
+    finally:
+        await close_redis_pool()
+    print(f"Rebuilt availability filters for {total} users")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""Bulk maintenance of the avatar bucket.
+
+Remove objects no user references any more (avatars of deleted users,
+uploads whose transaction failed):
+
+    python -m src.avatar_purge sweep [--dry-run] [--grace-seconds 3600]
+
+Remove every object in the bucket:
+
+    python -m src.avatar_purge purge --yes
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Set
+
+from sqlalchemy import select
+
+from logs.logs import configure_logger
+from src.aws.user_image_service import PurgeStats, S3UserImageService, s3_client
+from src.database import async_session_maker
+from src.images import avatar_base_path
+from src.models import User
+
+logger = configure_logger(__name__)
+
+REFERENCE_BATCH_SIZE = 10000
+
+
+async def referenced_avatars() -> Set[str]:
+    """Base paths of every avatar a user points at."""
+    references = set()
+    async with async_session_maker() as session:
+        result = await session.stream(
+            select(User.image_s3_path)
+            .where(User.image_s3_path.is_not(None))
+            .execution_options(yield_per=REFERENCE_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            references.update(avatar_base_path(path) for path, in rows)
+    return references
+
+
+async def sweep_orphan_avatars(
+    grace_seconds: int, dry_run: bool = False, progress=None
+) -> PurgeStats:
+    """Delete objects whose avatar no ``User.image_s3_path`` references.
+
+    Avatars are uploaded before the user row points at them, so objects newer
+    than ``grace_seconds`` are left alone.
+    """
+    references = await referenced_avatars()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+
+    def keep(obj: dict) -> bool:
+        return (
+            avatar_base_path(obj["Key"]) in references or obj["LastModified"] > cutoff
+        )
+
+    return await S3UserImageService().purge_avatars(keep, progress, dry_run)
+
+
+class ProgressReporter:
+    def __init__(self):
+        self.started = time.perf_counter()
+
+    def __call__(self, stats: PurgeStats):
+        elapsed = time.perf_counter() - self.started
+        print(
+            f"listed={stats.listed} deleted={stats.deleted} kept={stats.kept} "
+            f"failed={stats.failed} would_delete={stats.would_delete} "
+            f"({stats.listed / elapsed if elapsed else 0:.0f} objects/s)",
+            flush=True,
+        )
+
+
+async def main(args):
+    reporter = ProgressReporter()
+    try:
+        if args.command == "sweep":
+            stats = await sweep_orphan_avatars(
+                args.grace_seconds, args.dry_run, reporter
+            )
+        else:
+            stats = await S3UserImageService().purge_avatars(
+                progress=reporter, dry_run=args.dry_run
+            )
+    finally:
+        await s3_client.close()
+    reporter(stats)
+    logger.info(f"Avatar {args.command} finished: {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sweep_parser = subparsers.add_parser(
+        "sweep", help="delete objects no user references"
+    )
+    sweep_parser.add_argument("--grace-seconds", type=int, default=3600)
+    sweep_parser.add_argument("--dry-run", action="store_true")
+    purge_parser = subparsers.add_parser("purge", help="delete every object")
+    purge_parser.add_argument("--dry-run", action="store_true")
+    purge_parser.add_argument("--yes", action="store_true", required=True)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,159 @@
+import base64
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from logs.logs import configure_logger
+from src.database import get_redis
+from src.images import AvatarSize
+from src.settings import Settings
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+AVATAR_CACHE_KEY_PREFIX = "avatar:"
+
+CachedAvatar = Tuple[bytes, Optional[str]]
+
+
+def avatar_etag(image_hash: str) -> str:
+    return f'"{image_hash}"'
+
+
+def avatar_cache_key(image_hash: str, size: AvatarSize) -> str:
+    if size == AvatarSize.ORIGINAL:
+        return image_hash
+    return f"{image_hash}-{size.value}"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (
+        candidate.removeprefix("W/") for candidate in candidates
+    )
+
+
+class AvatarLRUCache:
+    """In-process LRU of avatar bytes bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, CachedAvatar]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, image_hash: str) -> Optional[CachedAvatar]:
+        entry = self._entries.get(image_hash)
+        if entry is not None:
+            self._entries.move_to_end(image_hash)
+        return entry
+
+    def put(self, image_hash: str, content: bytes, content_type: Optional[str]):
+        if len(content) > self.max_bytes:
+            return
+        self.discard(image_hash)
+        self._entries[image_hash] = (content, content_type)
+        self.size += len(content)
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, image_hash: str):
+        entry = self._entries.pop(image_hash, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AvatarCache:
+    """Avatar bytes keyed by their SHA-256, in process memory and in Redis.
+
+    Entries are content-addressed, so they never go stale: a new upload gets a
+    new hash. Avatars no user references any more are still dropped explicitly
+    to free the memory. Redis failures only turn lookups into misses.
+    """
+
+    def __init__(self):
+        self.local = AvatarLRUCache(settings.AVATAR_CACHE_MAX_BYTES)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(image_hash: str) -> str:
+        return AVATAR_CACHE_KEY_PREFIX + image_hash
+
+    async def get(self, image_hash: str) -> Optional[CachedAvatar]:
+        entry = self.local.get(image_hash)
+        if entry is not None:
+            self.local_hits += 1
+            return entry
+        try:
+            async with get_redis() as redis:
+                data, content_type = await redis.hmget(
+                    self._key(image_hash), ["data", "content_type"]
+                )
+        except Exception as e:
+            logger.warning(f"Avatar cache lookup failed: {e} ({type(e)})")
+            data = None
+        if data is None:
+            self.misses += 1
+            return None
+        self.redis_hits += 1
+        entry = (base64.b64decode(data), content_type or None)
+        self.local.put(image_hash, *entry)
+        return entry
+
+    async def put(self, image_hash: str, content: bytes, content_type: Optional[str]):
+        if len(content) > settings.AVATAR_CACHE_MAX_ITEM_BYTES:
+            return
+        self.local.put(image_hash, content, content_type)
+        try:
+            async with get_redis() as redis:
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.hset(
+                        self._key(image_hash),
+                        mapping={
+                            # The shared pool decodes responses, so the bytes
+                            # are stored as base64 text.
+                            "data": base64.b64encode(content).decode("ascii"),
+                            "content_type": content_type or "",
+                        },
+                    )
+                    pipe.expire(
+                        self._key(image_hash), settings.AVATAR_CACHE_REDIS_TTL_SECONDS
+                    )
+                    await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Avatar cache store failed: {e} ({type(e)})")
+
+    async def invalidate(self, image_hash: Optional[str]):
+        """Drop every size of an avatar."""
+        if not image_hash:
+            return
+        keys = [avatar_cache_key(image_hash, size) for size in AvatarSize]
+        for key in keys:
+            self.local.discard(key)
+        try:
+            async with get_redis() as redis:
+                await redis.delete(*(self._key(key) for key in keys))
+        except Exception as e:
+            logger.warning(f"Avatar cache invalidation failed: {e} ({type(e)})")
+
+    def stats(self) -> dict:
+        return {
+            "local_entries": len(self.local),
+            "local_bytes": self.local.size,
+            "local_max_bytes": self.local.max_bytes,
+            "local_evictions": self.local.evictions,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
+
+
+avatar_cache = AvatarCache()
@@ -0,0 +1,254 @@
+import asyncio
+import os
+import socket
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aioredis.exceptions import ResponseError
+
+from logs.logs import configure_logger
+from src.aws.email_service import SESEmailService
+from src.database import get_redis
+from src.settings import Settings
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+EMAIL_OUTBOX_STREAM = "email_outbox"
+EMAIL_OUTBOX_GROUP = "email_senders"
+EMAIL_DEAD_LETTER_STREAM = "email_outbox:dead"
+
+Message = Tuple[str, Dict[str, str]]
+
+
+async def enqueue_email(redis, subject: str, body: str, sender: str, recipient: str):
+    return await redis.xadd(
+        EMAIL_OUTBOX_STREAM,
+        {"subject": subject, "body": body, "sender": sender, "recipient": recipient},
+        maxlen=settings.EMAIL_OUTBOX_MAX_LENGTH,
+    )
+
+
+def retry_delay_ms(attempts: int) -> int:
+    delay = settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    return int(min(delay, settings.EMAIL_OUTBOX_RETRY_MAX_SECONDS) * 1000)
+
+
+def claim_idle_ms(attempts: int) -> int:
+    """How long a delivery must be idle before another worker may take it.
+
+    A batch spends at most the send timeout in SES, so by then the previous
+    attempt has either been acknowledged or failed.
+    """
+    timeout_ms = int(settings.EMAIL_OUTBOX_SEND_TIMEOUT_SECONDS * 1000)
+    return retry_delay_ms(attempts) + timeout_ms
+
+
+class EmailOutboxWorker:
+    """Sends the emails queued in the ``email_outbox`` Redis stream.
+
+    Messages are read through a consumer group, so several app instances can
+    share the work. A message is acknowledged once SES accepts it; failed
+    messages stay pending and are reclaimed with exponential backoff once
+    their last attempt has surely ended (which also recovers messages of a
+    crashed instance) until
+    ``EMAIL_OUTBOX_MAX_ATTEMPTS`` is reached, after which they are moved to
+    the dead-letter stream. One SES client is kept open for the worker's
+    lifetime and each sender address is verified only once.
+    """
+
+    def __init__(
+        self,
+        email_service_factory: Callable = SESEmailService,
+        consumer_name: Optional[str] = None,
+    ):
+        self.email_service_factory = email_service_factory
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self._verified_senders = set()
+        self._pending_cursor = "-"
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+        self.dead_lettered = 0
+
+    async def ensure_group(self, redis):
+        try:
+            await redis.xgroup_create(
+                EMAIL_OUTBOX_STREAM, EMAIL_OUTBOX_GROUP, id="0", mkstream=True
+            )
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def process(self, redis, email_service, block_ms: Optional[int] = None):
+        """Send one batch of due retries and new messages; return its size."""
+        messages = await self._claim_due_retries(redis)
+        response = await redis.xreadgroup(
+            EMAIL_OUTBOX_GROUP,
+            self.consumer_name,
+            {EMAIL_OUTBOX_STREAM: ">"},
+            count=settings.EMAIL_OUTBOX_BATCH_SIZE,
+            # Keep paging through the pending entries before waiting.
+            block=None if messages or self._pending_cursor != "-" else block_ms,
+        )
+        if response:
+            messages.extend(response[0][1])
+        if messages:
+            await self._send_batch(redis, email_service, messages)
+        return len(messages)
+
+    async def _claim_due_retries(self, redis) -> List[Message]:
+        # One page per call; the cursor walks the whole pending list across
+        # calls, so due entries behind the first page are reached as well.
+        pending = await redis.xpending_range(
+            EMAIL_OUTBOX_STREAM,
+            EMAIL_OUTBOX_GROUP,
+            min=self._pending_cursor,
+            max="+",
+            count=settings.EMAIL_OUTBOX_BATCH_SIZE,
+        )
+        if len(pending) < settings.EMAIL_OUTBOX_BATCH_SIZE:
+            self._pending_cursor = "-"
+        else:
+            self._pending_cursor = "(" + pending[-1]["message_id"]
+        exhausted, due = [], []
+        for entry in pending:
+            if entry["time_since_delivered"] < claim_idle_ms(entry["times_delivered"]):
+                continue
+            if entry["times_delivered"] >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                exhausted.append(entry)
+            else:
+                due.append(entry)
+        if exhausted:
+            await self._dead_letter(redis, exhausted)
+        claimed = await self._claim(redis, due)
+        return [(message_id, fields) for message_id, fields in claimed if fields]
+
+    async def _claim(self, redis, entries: List[dict]) -> List[Message]:
+        # Every entry is claimed with its own idle time. XCLAIM re-checks it,
+        # so a message another instance has just claimed is not sent twice.
+        message_ids = defaultdict(list)
+        for entry in entries:
+            idle_ms = claim_idle_ms(entry["times_delivered"])
+            message_ids[idle_ms].append(entry["message_id"])
+        claimed = []
+        for min_idle_time, ids in message_ids.items():
+            claimed.extend(
+                await redis.xclaim(
+                    EMAIL_OUTBOX_STREAM,
+                    EMAIL_OUTBOX_GROUP,
+                    self.consumer_name,
+                    min_idle_time=min_idle_time,
+                    message_ids=ids,
+                )
+            )
+        return claimed
+
+    async def _dead_letter(self, redis, entries: List[dict]):
+        messages = await self._claim(redis, entries)
+        if not messages:
+            return
+        message_ids = [message_id for message_id, _ in messages]
+        async with redis.pipeline(transaction=True) as pipe:
+            for message_id, fields in messages:
+                if not fields:
+                    continue
+                pipe.xadd(EMAIL_DEAD_LETTER_STREAM, {**fields, "id": message_id})
+            pipe.xack(EMAIL_OUTBOX_STREAM, EMAIL_OUTBOX_GROUP, *message_ids)
+            pipe.xdel(EMAIL_OUTBOX_STREAM, *message_ids)
+            await pipe.execute()
+        self.dead_lettered += len(messages)
+        logger.error(f"Moved {len(messages)} undeliverable emails to dead letters")
+
+    async def _send_batch(self, redis, email_service, messages: List[Message]):
+        senders = {fields["sender"] for _, fields in messages}
+        # Every SES call of the batch ends by one deadline, which is what lets
+        # claim_idle_ms tell when an attempt is over.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.EMAIL_OUTBOX_SEND_TIMEOUT_SECONDS
+        for sender in senders - self._verified_senders:
+            try:
+                await asyncio.wait_for(
+                    self._verify_sender(email_service, sender), deadline - loop.time()
+                )
+            except Exception as e:
+                logger.warning(f"Verifying sender {sender} failed: {e} ({type(e)})")
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(
+                    self._send(email_service, fields), deadline - loop.time()
+                )
+                for _, fields in messages
+            ),
+            return_exceptions=True,
+        )
+        sent_ids = []
+        for (message_id, fields), result in zip(messages, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                logger.warning(
+                    f"Sending email {message_id} to {fields.get('recipient')} "
+                    f"failed: {result} ({type(result)})"
+                )
+            else:
+                sent_ids.append(message_id)
+        if sent_ids:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.xack(EMAIL_OUTBOX_STREAM, EMAIL_OUTBOX_GROUP, *sent_ids)
+                pipe.xdel(EMAIL_OUTBOX_STREAM, *sent_ids)
+                await pipe.execute()
+            self.sent += len(sent_ids)
+
+    async def _send(self, email_service, fields: Dict[str, str]):
+        sender = fields["sender"]
+        if sender not in self._verified_senders:
+            await self._verify_sender(email_service, sender)
+        await email_service.send_email(
+            subject=fields["subject"],
+            body=fields["body"],
+            sender=sender,
+            recipient=fields["recipient"],
+        )
+
+    async def _verify_sender(self, email_service, sender: str):
+        await email_service.verify_email(sender)
+        self._verified_senders.add(sender)
+
+    async def _run(self):
+        while True:
+            try:
+                async with get_redis() as redis:
+                    async with self.email_service_factory().connect() as service:
+                        await self.ensure_group(redis)
+                        while True:
+                            await self.process(redis, service, block_ms=1000)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {e} ({type(e)})")
+                await asyncio.sleep(settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS)
+
+    def start(self):
+        if settings.EMAIL_OUTBOX_WORKER_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "verified_senders": len(self._verified_senders),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+        }
+
+
+email_outbox_worker = EmailOutboxWorker()
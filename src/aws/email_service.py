@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import HTTPException
 
 from logs.logs import configure_logger
@@ -13,21 +15,39 @@ class SESEmailService:
         self.aws_access_key_id = settings.AWS_ACCESS_KEY_ID
         self.aws_secret_access_key = settings.AWS_SECRET_ACCESS_KEY
         self.region_name = "us-east-1"
+        self._ses = None
 
-    async def _perform_ses_action(self, action_callback):
+    def _client(self):
         session = SessionSingleton().get_instance(
             self.aws_access_key_id, self.aws_secret_access_key
         )
-        async with session.client(
+        return session.client(
             "ses", endpoint_url=settings.ENDPOINT_URL, region_name=self.region_name
-        ) as ses:
+        )
+
+    @asynccontextmanager
+    async def connect(self):
+        """Route this service's calls through one SES client until exit."""
+        async with self._client() as ses:
+            self._ses = ses
             try:
-                return await action_callback(ses)
-            except Exception as e:
-                logger.error(f"SES action error: {e} ({type(e)})")
-                raise HTTPException(
-                    status_code=500, detail="Error interacting with SES"
-                )
+                yield self
+            finally:
+                self._ses = None
+
+    async def _perform_ses_action(self, action_callback):
+        if self._ses is not None:
+            return await self._call_ses(self._ses, action_callback)
+        async with self._client() as ses:
+            return await self._call_ses(ses, action_callback)
+
+    @staticmethod
+    async def _call_ses(ses, action_callback):
+        try:
+            return await action_callback(ses)
+        except Exception as e:
+            logger.error(f"SES action error: {e} ({type(e)})")
+            raise HTTPException(status_code=500, detail="Error interacting with SES")
 
     async def send_email(self, subject, body, sender, recipient):
         async def send_email_action(ses):
@@ -1,14 +1,36 @@
+import asyncio
 import base64
+import hashlib
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import IO, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 import aioboto3
-from fastapi import HTTPException, UploadFile
+from aiobotocore.config import AioConfig
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
 
 from logs.logs import configure_logger
+from src.aws.avatar_cache import (
+    avatar_cache,
+    avatar_cache_key,
+    avatar_etag,
+    etag_matches,
+)
+from src.executors import image_executor
+from src.images import AvatarSize, InvalidImageError, render_avatar, sized_avatar_path
 from src.settings import Settings
 
 logger = configure_logger(__name__)
 settings = Settings()
 
+# The most keys one DeleteObjects call (and one listing page) can hold.
+S3_DELETE_BATCH_SIZE = 1000
+
 
 class SessionSingleton:
     _instance = None
@@ -24,69 +46,506 @@ class SessionSingleton:
         return cls._instance
 
 
-class S3UserImageService:
-    BUCKET = "user-avatars"
-    CONTENTS_KEY = "Contents"
+class S3Metrics:
+    """Per-operation call counts and latencies, fed by botocore call events."""
+
+    STARTED_AT = "s3_metrics_started_at"
 
     def __init__(self):
-        self.aws_access_key_id = settings.AWS_ACCESS_KEY_ID
-        self.aws_secret_access_key = settings.AWS_SECRET_ACCESS_KEY
-        self.endpoint_url = settings.ENDPOINT_URL
+        self.operations: Dict[str, dict] = defaultdict(
+            lambda: {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        )
 
-    async def _perform_s3_action(self, action_callback):
+    def register(self, client):
+        client.meta.events.register("before-call.s3", self._before_call)
+        client.meta.events.register("after-call.s3", self._after_call)
+        client.meta.events.register("after-call-error.s3", self._after_call_error)
+
+    def _before_call(self, context, **kwargs):
+        context[self.STARTED_AT] = time.perf_counter()
+
+    def _after_call(self, model, context, http_response, **kwargs):
+        self._record(model.name, context, http_response.status_code >= 300)
+
+    def _after_call_error(self, event_name, context, **kwargs):
+        self._record(event_name.rsplit(".", 1)[-1], context, True)
+
+    def _record(self, operation: str, context: dict, failed: bool):
+        started_at = context.pop(self.STARTED_AT, None)
+        if started_at is None:
+            return
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        stats = self.operations[operation]
+        stats["calls"] += 1
+        stats["errors"] += failed
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def stats(self) -> dict:
+        return {
+            operation: {
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 2),
+                "max_ms": round(stats["max_ms"], 2),
+            }
+            for operation, stats in self.operations.items()
+        }
+
+
+class S3Client:
+    """One S3 client for the whole process.
+
+    The client, and with it the aiohttp connection pool, is opened in the app
+    lifespan (or lazily on first use) and reused by every S3UserImageService
+    call. The avatar bucket is checked, and created if needed, only once when
+    the client is opened.
+    """
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+        self.metrics = S3Metrics()
+        self._client = None
+        self._stack: Optional[AsyncExitStack] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def get(self):
+        if self._client is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._client is None:
+                    await self._open()
+        return self._client
+
+    async def start(self):
+        try:
+            await self.get()
+        except Exception as e:
+            # The app still starts; the next S3 call retries opening the client.
+            logger.error(f"Opening S3 client failed: {e} ({type(e)})")
+
+    async def close(self):
+        if self._stack is not None:
+            await self._stack.aclose()
+        self._client = None
+        self._stack = None
+
+    async def _open(self):
         session = SessionSingleton().get_instance(
-            self.aws_access_key_id, self.aws_secret_access_key
+            settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY
+        )
+        config = AioConfig(
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=settings.S3_CONNECT_TIMEOUT_SECONDS,
+            read_timeout=settings.S3_READ_TIMEOUT_SECONDS,
+            retries={"max_attempts": settings.S3_MAX_ATTEMPTS, "mode": "standard"},
+            connector_args={"keepalive_timeout": settings.S3_KEEPALIVE_TIMEOUT_SECONDS},
         )
-        async with session.client("s3", endpoint_url=self.endpoint_url) as s3:
+        stack = AsyncExitStack()
+        try:
+            client = await stack.enter_async_context(
+                session.client("s3", endpoint_url=settings.ENDPOINT_URL, config=config)
+            )
+            self.metrics.register(client)
+            await self._create_bucket_if_not_exists(client)
+        except BaseException:
+            await stack.aclose()
+            raise
+        self._client, self._stack = client, stack
+
+    async def _create_bucket_if_not_exists(self, s3):
+        try:
+            await s3.head_bucket(Bucket=self.bucket)
+        except s3.exceptions.ClientError:
             try:
-                await self._create_bucket_if_not_exists(s3)
-                return await action_callback(s3)
+                await s3.create_bucket(Bucket=self.bucket)
+                logger.info(f"Bucket '{self.bucket}' created successfully.")
             except Exception as e:
-                logger.error(f"S3 action error: {e} ({type(e)})")
-                raise HTTPException(status_code=500, detail="Error interacting with S3")
+                logger.error(f"Error creating bucket '{self.bucket}': {e} ({type(e)})")
+                raise
+        except Exception as e:
+            logger.error(f"Error checking bucket '{self.bucket}': {e} ({type(e)})")
+            raise
+
+
+@dataclass
+class AvatarObject:
+    etag: str
+    content_type: Optional[str] = None
+    content_length: Optional[int] = None
+    chunks: Optional[AsyncIterator[bytes]] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.chunks is None
+
+
+def avatar_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Avatar must not be larger than "
+        f"{settings.AVATAR_MAX_UPLOAD_BYTES} bytes",
+    )
+
+
+@dataclass
+class PurgeStats:
+    listed: int = 0
+    kept: int = 0
+    deleted: int = 0
+    failed: int = 0
+    # Keys left in place because of ``dry_run``.
+    would_delete: int = 0
+
+
+@dataclass
+class PreparedAvatar:
+    spool: IO[bytes]
+    image_hash: str
+    path: str
+
+
+class S3UserImageService:
+    BUCKET = "user-avatars"
+    CONTENTS_KEY = "Contents"
+
+    async def _perform_s3_action(self, action_callback):
+        try:
+            s3 = await s3_client.get()
+            return await action_callback(s3)
+        except Exception as e:
+            logger.error(f"S3 action error: {e} ({type(e)})")
+            raise HTTPException(status_code=500, detail="Error interacting with S3")
+
+    @staticmethod
+    def content_avatar_path(image_hash: str) -> str:
+        return f"avatars/sha256/{image_hash}/{AvatarSize.ORIGINAL.value}"
+
+    @asynccontextmanager
+    async def prepare_avatar(self, file: UploadFile) -> AsyncIterator[PreparedAvatar]:
+        """Spool an upload to a temporary file, hashing it on the way.
+
+        The upload is copied in chunks and rejected with 413 once it exceeds
+        ``AVATAR_MAX_UPLOAD_BYTES``. The file is removed on exit.
+        """
+        if file.size is not None and file.size > settings.AVATAR_MAX_UPLOAD_BYTES:
+            raise avatar_too_large()
+        with tempfile.NamedTemporaryFile(prefix="avatar-") as spool:
+            image_hash = await self._spool_upload(file, spool)
+            yield PreparedAvatar(
+                spool=spool,
+                image_hash=image_hash,
+                path=self.content_avatar_path(image_hash),
+            )
+
+    async def store_avatar(self, avatar: PreparedAvatar) -> bool:
+        """Store a prepared avatar with its thumbnails unless it already exists.
+
+        Avatars are content-addressed, so an identical upload by anyone skips
+        validation, thumbnailing and every PUT. New avatars are validated and
+        thumbnailed from the spooled file, and the original is sent to S3 part
+        by part, so it is never held in memory as a whole. Returns whether
+        anything was uploaded.
+        """
+        if await self.avatar_exists(avatar.path):
+            return False
+        try:
+            content_type, thumbnails = await image_executor.run(
+                render_avatar, avatar.spool.name
+            )
+        except InvalidImageError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-    async def upload_avatar(self, file: UploadFile, user_id: str):
         async def upload_to_s3(s3):
-            file_path = f"avatars/{user_id}"
-            await s3.upload_fileobj(file, self.BUCKET, file_path)
-            return file_path
+            # The original goes last: its key existing is what marks the
+            # avatar complete, so a failed thumbnail PUT is retried by the
+            # next identical upload instead of being skipped forever.
+            await asyncio.gather(
+                *(
+                    s3.put_object(
+                        Bucket=self.BUCKET,
+                        Key=sized_avatar_path(avatar.path, size),
+                        Body=data,
+                        ContentType=thumbnail_type,
+                    )
+                    for size, (data, thumbnail_type) in thumbnails.items()
+                )
+            )
+            await self._upload_file(s3, avatar.spool, avatar.path, content_type)
+            return True
 
         return await self._perform_s3_action(upload_to_s3)
 
-    async def get_avatar(self, avatar_s3_path: str):
+    async def upload_avatar(self, file: UploadFile) -> Tuple[str, str]:
+        """Store an avatar; return its S3 path and SHA-256 content hash."""
+        async with self.prepare_avatar(file) as avatar:
+            await self.store_avatar(avatar)
+        return avatar.path, avatar.image_hash
+
+    async def avatar_exists(self, avatar_s3_path: str) -> bool:
+        async def head(s3):
+            try:
+                await s3.head_object(Bucket=self.BUCKET, Key=avatar_s3_path)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    return False
+                raise
+            return True
+
+        return await self._perform_s3_action(head)
+
+    @staticmethod
+    async def _spool_upload(file: UploadFile, spool) -> str:
+        sha256 = hashlib.sha256()
+        size = 0
+        while chunk := await file.read(settings.AVATAR_UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > settings.AVATAR_MAX_UPLOAD_BYTES:
+                raise avatar_too_large()
+            sha256.update(chunk)
+            await run_in_threadpool(spool.write, chunk)
+        await run_in_threadpool(spool.flush)
+        return sha256.hexdigest()
+
+    async def _upload_file(self, s3, spool, key: str, content_type: str):
+        """Upload a file with a multipart upload, one part in memory at a time."""
+        part_size = settings.AVATAR_UPLOAD_PART_SIZE
+        await run_in_threadpool(spool.seek, 0)
+        part = await run_in_threadpool(spool.read, part_size)
+        if len(part) < part_size:
+            await s3.put_object(
+                Bucket=self.BUCKET, Key=key, Body=part, ContentType=content_type
+            )
+            return
+        upload = await s3.create_multipart_upload(
+            Bucket=self.BUCKET, Key=key, ContentType=content_type
+        )
+        parts = []
+        try:
+            while part:
+                response = await s3.upload_part(
+                    Bucket=self.BUCKET,
+                    Key=key,
+                    UploadId=upload["UploadId"],
+                    PartNumber=len(parts) + 1,
+                    Body=part,
+                )
+                parts.append({"PartNumber": len(parts) + 1, "ETag": response["ETag"]})
+                part = await run_in_threadpool(spool.read, part_size)
+            await s3.complete_multipart_upload(
+                Bucket=self.BUCKET,
+                Key=key,
+                UploadId=upload["UploadId"],
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            await s3.abort_multipart_upload(
+                Bucket=self.BUCKET, Key=key, UploadId=upload["UploadId"]
+            )
+            raise
+
+    @staticmethod
+    def _rendition(
+        avatar_s3_path: str, image_hash: Optional[str], size: AvatarSize
+    ) -> Tuple[str, Optional[str]]:
+        """S3 key and cache key (also the ETag) of one size of an avatar."""
+        key = sized_avatar_path(avatar_s3_path, size)
+        if not image_hash or key == avatar_s3_path:
+            return key, image_hash
+        return key, avatar_cache_key(image_hash, size)
+
+    async def get_avatar(
+        self,
+        avatar_s3_path: str,
+        image_hash: Optional[str] = None,
+        size: AvatarSize = AvatarSize.ORIGINAL,
+    ):
+        key, cache_key = self._rendition(avatar_s3_path, image_hash, size)
+        if cache_key:
+            cached = await avatar_cache.get(cache_key)
+            if cached is not None:
+                return base64.b64encode(cached[0]).decode("utf-8")
+
         async def get_from_s3(s3):
-            s3_ob = await s3.get_object(Bucket=self.BUCKET, Key=avatar_s3_path)
+            s3_ob = await s3.get_object(Bucket=self.BUCKET, Key=key)
             image_bytes = await s3_ob["Body"].read()
+            if cache_key:
+                await avatar_cache.put(cache_key, image_bytes, s3_ob.get("ContentType"))
             return base64.b64encode(image_bytes).decode("utf-8")
 
         return await self._perform_s3_action(get_from_s3)
 
+    async def get_avatar_url(
+        self, avatar_s3_path: str, size: AvatarSize = AvatarSize.ORIGINAL
+    ) -> str:
+        async def presign(s3):
+            return await s3.generate_presigned_url(
+                "get_object",
+                Params={
+                    "Bucket": self.BUCKET,
+                    "Key": sized_avatar_path(avatar_s3_path, size),
+                },
+                ExpiresIn=settings.AVATAR_PRESIGNED_URL_TTL_SECONDS,
+            )
+
+        return await self._perform_s3_action(presign)
+
+    async def open_avatar(
+        self,
+        avatar_s3_path: str,
+        if_none_match: Optional[str] = None,
+        image_hash: Optional[str] = None,
+        size: AvatarSize = AvatarSize.ORIGINAL,
+    ) -> AvatarObject:
+        """Start streaming an avatar.
+
+        With the ``image_hash`` recorded at upload the hash is the ETag, so a
+        matching ``if_none_match`` is answered without any lookup, and small
+        avatars are served from (and added to) the avatar cache. Otherwise
+        S3's own ETag is used. When ``if_none_match`` matches, the returned
+        object has ``not_modified`` set.
+        """
+        key, cache_key = self._rendition(avatar_s3_path, image_hash, size)
+        if not cache_key:
+            return await self._open_s3_avatar(key, if_none_match)
+        etag = avatar_etag(cache_key)
+        if etag_matches(if_none_match, etag):
+            return AvatarObject(etag=etag)
+        cached = await avatar_cache.get(cache_key)
+        if cached is None:
+            avatar = await self._open_s3_avatar(key)
+            avatar.etag = etag
+            if (
+                avatar.content_length is None
+                or avatar.content_length > settings.AVATAR_CACHE_MAX_ITEM_BYTES
+            ):
+                return avatar
+            content = b"".join([chunk async for chunk in avatar.chunks])
+            await avatar_cache.put(cache_key, content, avatar.content_type)
+            cached = (content, avatar.content_type)
+        content, content_type = cached
+
+        async def chunks():
+            yield content
+
+        return AvatarObject(
+            etag=etag,
+            content_type=content_type,
+            content_length=len(content),
+            chunks=chunks(),
+        )
+
+    async def _open_s3_avatar(
+        self, avatar_s3_path: str, if_none_match: Optional[str] = None
+    ) -> AvatarObject:
+        params = {"Bucket": self.BUCKET, "Key": avatar_s3_path}
+        if if_none_match:
+            params["IfNoneMatch"] = if_none_match
+        try:
+            s3 = await s3_client.get()
+            s3_object = await s3.get_object(**params)
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code")
+            if error_code in ("304", "NotModified"):
+                return AvatarObject(etag=if_none_match)
+            if error_code in ("404", "NoSuchKey"):
+                raise HTTPException(status_code=404, detail="Avatar not found")
+            logger.error(f"S3 action error: {e} ({type(e)})")
+            raise HTTPException(status_code=500, detail="Error interacting with S3")
+        except Exception as e:
+            logger.error(f"S3 action error: {e} ({type(e)})")
+            raise HTTPException(status_code=500, detail="Error interacting with S3")
+
+        async def chunks():
+            body = s3_object["Body"]
+            try:
+                async for chunk in body.iter_chunks(settings.AVATAR_STREAM_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                # Hands the connection back to the shared client's pool.
+                body.close()
+
+        return AvatarObject(
+            etag=s3_object["ETag"],
+            content_type=s3_object.get("ContentType"),
+            content_length=s3_object.get("ContentLength"),
+            chunks=chunks(),
+        )
+
     async def delete_avatar(self, avatar_s3_path: str):
+        keys = {sized_avatar_path(avatar_s3_path, size) for size in AvatarSize}
+
         async def delete_from_s3(s3):
-            await s3.delete_object(Bucket=self.BUCKET, Key=avatar_s3_path)
+            await s3.delete_objects(
+                Bucket=self.BUCKET,
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+            )
 
         await self._perform_s3_action(delete_from_s3)
 
-    async def delete_all_avatars(self):
-        async def delete_all_objects(s3):
-            objects = await s3.list_objects(Bucket=self.BUCKET)
-            if self.CONTENTS_KEY in objects:
-                for obj in objects[self.CONTENTS_KEY]:
-                    await s3.delete_object(Bucket=self.BUCKET, Key=obj["Key"])
+    async def delete_all_avatars(self) -> PurgeStats:
+        return await self.purge_avatars()
 
-        await self._perform_s3_action(delete_all_objects)
+    async def purge_avatars(
+        self,
+        keep: Optional[Callable[[dict], bool]] = None,
+        progress: Optional[Callable[[PurgeStats], None]] = None,
+        dry_run: bool = False,
+    ) -> PurgeStats:
+        """Delete every object in the bucket that ``keep`` does not claim.
 
-    async def _create_bucket_if_not_exists(self, s3):
-        try:
-            await s3.head_bucket(Bucket=self.BUCKET)
-            logger.info(f"Bucket '{self.BUCKET}' already exists.")
-        except s3.exceptions.ClientError:
+        Objects are listed page by page and each page is removed with one
+        ``delete_objects`` call; up to ``S3_PURGE_CONCURRENCY`` deletions run
+        while the next pages are listed. ``progress`` is called after every
+        page.
+        """
+        stats = PurgeStats()
+        semaphore = asyncio.Semaphore(settings.S3_PURGE_CONCURRENCY)
+
+        async def delete_batch(s3, keys: List[str]):
             try:
-                await s3.create_bucket(Bucket=self.BUCKET)
-                logger.info(f"Bucket '{self.BUCKET}' created successfully.")
+                response = await s3.delete_objects(
+                    Bucket=self.BUCKET,
+                    Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+                )
+                errors = response.get("Errors", [])
+                for error in errors:
+                    logger.error(
+                        f"Deleting '{error.get('Key')}' failed: {error.get('Message')}"
+                    )
+                stats.deleted += len(keys) - len(errors)
+                stats.failed += len(errors)
             except Exception as e:
-                logger.error(f"Error creating bucket '{self.BUCKET}': {e} ({type(e)})")
-                raise
-        except Exception as e:
-            logger.error(f"Error checking bucket '{self.BUCKET}': {e} ({type(e)})")
-            raise
+                logger.error(f"Deleting {len(keys)} objects failed: {e} ({type(e)})")
+                stats.failed += len(keys)
+            finally:
+                semaphore.release()
+            if progress:
+                progress(stats)
+
+        async def purge(s3):
+            paginator = s3.get_paginator("list_objects_v2")
+            deletions = []
+            async for page in paginator.paginate(
+                Bucket=self.BUCKET,
+                PaginationConfig={"PageSize": S3_DELETE_BATCH_SIZE},
+            ):
+                objects = page.get(self.CONTENTS_KEY, [])
+                stats.listed += len(objects)
+                keys = [obj["Key"] for obj in objects if not (keep and keep(obj))]
+                stats.kept += len(objects) - len(keys)
+                if dry_run or not keys:
+                    stats.would_delete += len(keys)
+                    if progress:
+                        progress(stats)
+                    continue
+                await semaphore.acquire()
+                deletions.append(asyncio.create_task(delete_batch(s3, keys)))
+            await asyncio.gather(*deletions)
+            return stats
+
+        return await self._perform_s3_action(purge)
+
+
+s3_client = S3Client(S3UserImageService.BUCKET)
@@ -0,0 +1,87 @@
+import hashlib
+import math
+from typing import List
+
+
+def bloom_parameters(capacity: int, error_rate: float) -> tuple[int, int]:
+    """Return the bit count and hash count for the given capacity and error rate."""
+    size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hash_count = max(1, round(size / capacity * math.log(2)))
+    return size, hash_count
+
+
+def bloom_positions(value: str, size: int, hash_count: int) -> List[int]:
+    # Kirsch-Mitzenmacher double hashing over a single 128-bit digest.
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], "little")
+    second = int.from_bytes(digest[8:], "little") | 1
+    return [(first + i * second) % size for i in range(hash_count)]
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size, self.hash_count = bloom_parameters(capacity, error_rate)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, value: str):
+        for position in bloom_positions(value, self.size, self.hash_count):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in bloom_positions(value, self.size, self.hash_count)
+        )
+
+
+# KEYS: the filter bitmap, then optional extra bitmaps that are only updated
+# if they already exist
+# ARGV: bit positions
+REDIS_BLOOM_ADD_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if i == 1 or redis.call('EXISTS', key) == 1 then
+        for _, position in ipairs(ARGV) do
+            redis.call('SETBIT', key, position, 1)
+        end
+    end
+end
+return 1
+"""
+
+# KEYS: the filter bitmap
+# ARGV: bit positions
+REDIS_BLOOM_CHECK_SCRIPT = """
+for _, position in ipairs(ARGV) do
+    if redis.call('GETBIT', KEYS[1], position) == 0 then
+        return 0
+    end
+end
+return 1
+"""
+
+
+class RedisBloomFilter:
+    """Bloom filter stored as a Redis bitmap.
+
+    Each add or lookup is a single script call; pass a pipeline as ``client``
+    to batch several of them into one round trip.
+    """
+
+    def __init__(self, key: str, capacity: int, error_rate: float):
+        self.key = key
+        self.size, self.hash_count = bloom_parameters(capacity, error_rate)
+
+    def positions(self, value: str) -> List[int]:
+        return bloom_positions(value, self.size, self.hash_count)
+
+    async def add(self, client, value: str, key: str = None, also_to: List[str] = ()):
+        script = client.register_script(REDIS_BLOOM_ADD_SCRIPT)
+        return await script(
+            keys=[key or self.key, *also_to], args=self.positions(value), client=client
+        )
+
+    async def contains(self, client, value: str):
+        script = client.register_script(REDIS_BLOOM_CHECK_SCRIPT)
+        return await script(keys=[self.key], args=self.positions(value), client=client)
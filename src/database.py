@@ -1,5 +1,5 @@
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 
 import aioredis
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
@@ -21,6 +21,14 @@ engine: AsyncEngine = create_async_engine(
 )
 
 
+# Sessions from this factory are bound to the engine rather than to an open
+# transaction, so a connection is only checked out while a statement or an
+# explicit commit is in progress.
+async_session_maker = sessionmaker(
+    bind=engine, class_=AsyncSession, expire_on_commit=False
+)
+
+
 @asynccontextmanager
 async def create_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with engine.begin() as transaction:
@@ -34,10 +42,74 @@ async def create_async_session() -> AsyncGenerator[AsyncSession, None]:
                 await session.close()
 
 
+async def get_request_session() -> AsyncGenerator[AsyncSession, None]:
+    # FastAPI caches dependencies per request, so the auth dependency, the
+    # permission checks and the endpoint repository all share this session.
+    async with async_session_maker() as session:
+        yield session
+
+
+class RedisConnectionPool(aioredis.BlockingConnectionPool):
+    """Blocking pool that also keeps track of callers waiting for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+
+    async def get_connection(self, command_name, *keys, **options):
+        self.waiting += 1
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> dict:
+        idle = sum(1 for connection in self.pool._queue if connection is not None)
+        created = len(self._connections)
+        return {
+            "max_connections": self.max_connections,
+            "created": created,
+            "in_use": created - idle,
+            "idle": idle,
+            "waiting": self.waiting,
+        }
+
+
+redis_pool: Optional[RedisConnectionPool] = None
+
+
+def get_redis_pool() -> RedisConnectionPool:
+    global redis_pool
+    if redis_pool is None:
+        redis_pool = RedisConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            encoding="utf-8",
+            decode_responses=True,
+        )
+    return redis_pool
+
+
+async def close_redis_pool():
+    global redis_pool
+    if redis_pool is not None:
+        await redis_pool.disconnect()
+        redis_pool = None
+
+
 @asynccontextmanager
 async def get_redis():
-    redis = await aioredis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+    redis = aioredis.Redis(connection_pool=get_redis_pool())
     try:
         yield redis
     finally:
         await redis.close()
+
+
+async def get_request_redis():
+    async with get_redis() as redis:
+        yield redis
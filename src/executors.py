@@ -0,0 +1,100 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+
+from logs.logs import configure_logger
+from src.settings import Settings
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+
+class BoundedExecutor:
+    """Runs blocking callables off the event loop with a cap on queued work.
+
+    Once ``max_workers + max_queue_size`` calls are in flight, new calls are
+    rejected with 503 immediately instead of piling up behind the pool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        max_queue_size: int,
+        use_processes: bool = False,
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_workers + max_queue_size
+        self.use_processes = use_processes
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name
+                )
+        return self._executor
+
+    async def run(self, func: Callable, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Executor '{self.name}' is saturated, rejecting call")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again later",
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hashing_executor = BoundedExecutor(
+    name="password-hashing",
+    max_workers=settings.HASHING_MAX_WORKERS,
+    max_queue_size=settings.HASHING_MAX_QUEUE_SIZE,
+    use_processes=settings.HASHING_USE_PROCESSES,
+)
+
+import_hashing_executor = BoundedExecutor(
+    name="import-password-hashing",
+    max_workers=settings.USER_IMPORT_HASHING_MAX_WORKERS,
+    max_queue_size=settings.USER_IMPORT_HASHING_MAX_QUEUE_SIZE,
+    use_processes=True,
+)
+
+image_executor = BoundedExecutor(
+    name="avatar-images",
+    max_workers=settings.AVATAR_IMAGE_MAX_WORKERS,
+    max_queue_size=settings.AVATAR_IMAGE_MAX_QUEUE_SIZE,
+    use_processes=True,
+)
+
+
+def shutdown_executors():
+    hashing_executor.shutdown()
+    import_hashing_executor.shutdown()
+    image_executor.shutdown()
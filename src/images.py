@@ -0,0 +1,88 @@
+"""Avatar image validation and thumbnail rendering.
+
+``render_avatar`` is CPU-bound and runs in ``image_executor``'s process pool,
+so it only takes and returns plain bytes.
+"""
+
+import enum
+import io
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from src.settings import Settings
+
+settings = Settings()
+
+ALLOWED_FORMATS = ("JPEG", "PNG", "WEBP", "GIF")
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_CONTENT_TYPE = "image/webp"
+
+
+class AvatarSize(str, enum.Enum):
+    SMALL = "64"
+    MEDIUM = "256"
+    ORIGINAL = "original"
+
+
+THUMBNAIL_PIXELS = {AvatarSize.MEDIUM: 256, AvatarSize.SMALL: 64}
+
+Rendition = Tuple[bytes, str]
+
+
+class InvalidImageError(Exception):
+    pass
+
+
+def render_avatar(path: str) -> Tuple[str, Dict[AvatarSize, Rendition]]:
+    """Validate an uploaded avatar and render its thumbnails.
+
+    Returns the content type of the detected format (not the one the client
+    claimed) and every size in ``THUMBNAIL_PIXELS`` rendered as WebP, each
+    from the previous, larger one. The image is decoded once, at no more than
+    the largest thumbnail's resolution where the format allows it. The
+    original itself is left in the file at ``path``.
+    """
+    try:
+        with Image.open(path) as source:
+            if source.format not in ALLOWED_FORMATS:
+                raise InvalidImageError(f"Unsupported image format {source.format}")
+            if source.width * source.height > settings.AVATAR_MAX_PIXELS:
+                raise InvalidImageError("Image dimensions are too large")
+            content_type = Image.MIME[source.format]
+            largest = max(THUMBNAIL_PIXELS.values())
+            source.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(source)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+        raise InvalidImageError("Invalid image") from e
+
+    mode = "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+    image = image.convert(mode)
+    thumbnails = {}
+    for size, pixels in sorted(THUMBNAIL_PIXELS.items(), key=lambda item: -item[1]):
+        image.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, THUMBNAIL_FORMAT, quality=settings.AVATAR_THUMBNAIL_QUALITY)
+        thumbnails[size] = (buffer.getvalue(), THUMBNAIL_CONTENT_TYPE)
+    return content_type, thumbnails
+
+
+def sized_avatar_path(avatar_s3_path: str, size: AvatarSize) -> str:
+    """S3 key of one size of an avatar.
+
+    Avatars are stored as ``.../original`` next to their thumbnails. Avatars
+    uploaded before thumbnails existed have no such suffix and only come in
+    their original size.
+    """
+    base, _, name = avatar_s3_path.rpartition("/")
+    if name != AvatarSize.ORIGINAL.value:
+        return avatar_s3_path
+    return f"{base}/{size.value}"
+
+
+def avatar_base_path(avatar_s3_key: str) -> str:
+    """The part of an avatar's S3 key shared by all of its sizes."""
+    base, _, name = avatar_s3_key.rpartition("/")
+    if base and name in {size.value for size in AvatarSize}:
+        return base
+    return avatar_s3_key
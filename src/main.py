@@ -1,26 +1,53 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException, RequestValidationError
 from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
 
+from src.auth.blacklist import blacklist_cache
 from src.auth.router import router as auth_router
+from src.aws.email_outbox import email_outbox_worker
+from src.aws.user_image_service import s3_client
+from src.database import close_redis_pool, get_redis_pool
+from src.executors import shutdown_executors
 from src.other.router import router as other_router
 from src.users.router import router as users_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_redis_pool()
+    blacklist_cache.start()
+    email_outbox_worker.start()
+    await s3_client.start()
+    yield
+    await s3_client.close()
+    await email_outbox_worker.stop()
+    await blacklist_cache.stop()
+    await close_redis_pool()
+    shutdown_executors()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
-    return JSONResponse(content={"message": exc.detail}, status_code=exc.status_code)
+    return JSONResponse(
+        content={"message": exc.detail},
+        status_code=exc.status_code,
+        headers=getattr(exc, "headers", None),
+    )
 
 
 @app.exception_handler(RequestValidationError)
@@ -2,7 +2,19 @@ import enum
 import uuid
 from datetime import datetime
 
-from sqlalchemy import DateTime, Enum, ForeignKey, Integer, Text, types
+from sqlalchemy import (
+    DDL,
+    Computed,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    Text,
+    event,
+    types,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -10,6 +22,16 @@ class Base(DeclarativeBase):
     pass
 
 
+# Username terms rank highest, then name and surname, then the words of the
+# email address ('@' and '.' are split so "acme" finds john@acme.com).
+USER_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', username), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(name, '') || ' ' || "
+    "coalesce(surname, '')), 'B') || "
+    "setweight(to_tsvector('simple', translate(email, '@.', '  ')), 'C')"
+)
+
+
 class RoleEnum(str, enum.Enum):
     USER = "USER"
     ADMIN = "ADMIN"
@@ -45,15 +67,52 @@ class User(Base):
         Integer, ForeignKey("group.id"), nullable=True
     )
     image_s3_path: Mapped[str] = mapped_column(Text, nullable=True)
+    # SHA-256 of the avatar, recorded at upload; keys the avatar cache and is
+    # the avatar's ETag.
+    image_hash: Mapped[str] = mapped_column(Text, nullable=True)
     is_blocked: Mapped[bool] = mapped_column(default=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     modified_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(USER_SEARCH_VECTOR, persisted=True),
+        nullable=True,
+        deferred=True,
+    )
 
     group = relationship(
         "Group", back_populates="users", order_by="Group.id", lazy="joined"
     )
 
+    # Composite (sort key, id) indexes back keyset pagination of GET /users/.
+    __table_args__ = (
+        Index("ix_user_created_at_id", "created_at", "id"),
+        Index("ix_user_modified_at_id", "modified_at", "id"),
+        Index("ix_user_name_id", "name", "id"),
+        Index("ix_user_surname_id", "surname", "id"),
+        Index("ix_user_group_id_created_at_id", "group_id", "created_at", "id"),
+        # Trigram indexes let substring (ILIKE '%term%') searches skip the
+        # sequential scan.
+        *(
+            Index(
+                f"ix_user_{column}_trgm",
+                column,
+                postgresql_using="gin",
+                postgresql_ops={column: "gin_trgm_ops"},
+            )
+            for column in ("username", "name", "surname", "email")
+        ),
+        Index("ix_user_search_vector", "search_vector", postgresql_using="gin"),
+        # Users sharing a content-addressed avatar are its reference count.
+        Index("ix_user_image_s3_path", "image_s3_path"),
+    )
+
     def to_dict(self):
         user_dict = self.__dict__
         user_dict["id"] = str(user_dict["id"])
         return user_dict
+
+
+event.listen(
+    Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+)
@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Depends, Header, HTTPException
 
 from logs.logs import configure_logger
+from src.auth.blacklist import blacklist_cache
+from src.aws.avatar_cache import avatar_cache
+from src.aws.email_outbox import email_outbox_worker
+from src.aws.user_image_service import s3_client
+from src.database import get_redis_pool
 from src.models import User
 from src.settings import Settings
-from src.users.repository import UserRepository, create_user_repository
+from src.users.repository import UserRepository, get_user_repository
 from src.users.schemas import CreateGroup, GroupInfo
 from src.users.service import UserService
 from src.utils import (
@@ -18,24 +23,50 @@ logger = configure_logger(__name__)
 settings = Settings()
 
 
+def verify_api_key(api_key: str = Header()):
+    if api_key is None:
+        raise HTTPException(status_code=401, detail="API key is missing")
+    if api_key != settings.INNOTTER_API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid API key")
+
+
 @router.get("/healthcheck/")
 async def health_check():
     logger.info("Health check endpoint accessed")
     return {"result": "You've successfully checked your health!"}
 
 
-@router.get("/users/secure_data/{user_id}/")
+@router.get("/metrics/redis-pool/", dependencies=[Depends(verify_api_key)])
+async def redis_pool_metrics():
+    return get_redis_pool().stats()
+
+
+@router.get("/metrics/blacklist-cache/", dependencies=[Depends(verify_api_key)])
+async def blacklist_cache_metrics():
+    return blacklist_cache.stats()
+
+
+@router.get("/metrics/email-outbox/", dependencies=[Depends(verify_api_key)])
+async def email_outbox_metrics():
+    return email_outbox_worker.stats()
+
+
+@router.get("/metrics/avatar-cache/", dependencies=[Depends(verify_api_key)])
+async def avatar_cache_metrics():
+    return avatar_cache.stats()
+
+
+@router.get("/metrics/s3/", dependencies=[Depends(verify_api_key)])
+async def s3_metrics():
+    return s3_client.metrics.stats()
+
+
+@router.get("/users/secure_data/{user_id}/", dependencies=[Depends(verify_api_key)])
 async def get_secure_data(
     user_id: str,
-    api_key: str = Header(),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    if api_key is None:
-        raise HTTPException(status_code=401, detail="API key is missing")
-    if api_key != settings.INNOTTER_API_KEY:
-        raise HTTPException(status_code=403, detail="Invalid API key")
-    async with user_repo as user_repository:
-        user = await UserService(user_repository).get_user(user_id=user_id)
+    user = await UserService(user_repo).get_user(user_id=user_id)
 
     return {"email": user.email}
 
@@ -44,10 +75,9 @@ async def get_secure_data(
 @has_any_permission([admin_permission])
 async def groups(
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).get_all_groups()
+    return await UserService(user_repo).get_all_groups()
 
 
 @router.delete("/groups/{group_id}")
@@ -55,10 +85,9 @@ async def groups(
 async def groups(
     group_id: int,
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).delete_group(group_id)
+    return await UserService(user_repo).delete_group(group_id)
 
 
 @router.post("/groups/", response_model=GroupInfo)
@@ -66,7 +95,6 @@ async def groups(
 async def create_group(
     create_group_data: CreateGroup,
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).create_group(create_group_data)
+    return await UserService(user_repo).create_group(create_group_data)
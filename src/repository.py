@@ -1,13 +1,71 @@
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator, Optional, Sequence
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Sequence, Tuple
 
-from sqlalchemy import select
+from fastapi import Depends
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database import create_async_session, get_redis
+from logs.logs import configure_logger
+from src.auth.blacklist import (
+    BLACKLIST_CHANNEL,
+    TOKEN_EPOCH_MESSAGE_PREFIX,
+    blacklist_cache,
+    blacklist_lookup_keys,
+)
+from src.availability import mark_taken, might_be_taken
+from src.database import (
+    create_async_session,
+    get_redis,
+    get_request_redis,
+    get_request_session,
+)
 from src.models import Group, User
 from src.users.schemas import CreateGroup, UserUUIDList
 
+logger = configure_logger(__name__)
+
+TOKEN_EPOCHS_KEY = "token_epochs"
+
+# Bumps the epochs and publishes the new values in one round trip, so every
+# instance can update its cached epochs.
+# KEYS: token epochs hash
+# ARGV: pub/sub channel, message prefix, user ids...
+BUMP_TOKEN_EPOCHS_SCRIPT = """
+local epochs = {}
+for i = 3, #ARGV do
+    local epoch = redis.call('HINCRBY', KEYS[1], ARGV[i], 1)
+    redis.call('PUBLISH', ARGV[1], ARGV[2] .. ARGV[i] .. ':' .. epoch)
+    epochs[#epochs + 1] = epoch
+end
+return epochs
+"""
+
+UNIQUE_CONSTRAINT_FIELDS = {
+    "ix_user_username": "username",
+    "ix_user_email": "email",
+    "user_phone_number_key": "phone_number",
+}
+
+
+class UserAlreadyExistsError(Exception):
+    def __init__(self, field: str):
+        super().__init__(f"User with this {field} already exists")
+        self.field = field
+
+
+def get_violated_unique_field(error: IntegrityError) -> Optional[str]:
+    # asyncpg reports the constraint on the driver error chained to e.orig.
+    cause = getattr(error.orig, "__cause__", None)
+    constraint = getattr(cause, "constraint_name", None)
+    if constraint in UNIQUE_CONSTRAINT_FIELDS:
+        return UNIQUE_CONSTRAINT_FIELDS[constraint]
+    message = str(error.orig)
+    for constraint, field in UNIQUE_CONSTRAINT_FIELDS.items():
+        if constraint in message:
+            return field
+    return None
+
 
 class BaseUserRepository:
     def __init__(self, db_session: AsyncSession, redis_session=None):
@@ -36,10 +94,108 @@ class BaseUserRepository:
             user = await conn.execute(select(User).filter(User.id == user_id))
         return user.scalar()
 
-    async def check_if_token_is_blacklisted(self, token: str) -> bool:
+    async def find_taken_fields(self, values: Dict[str, str]) -> List[str]:
+        """Return the fields whose value already belongs to a user.
+
+        Values the availability filters rule out never reach the database;
+        the rest are checked together in a single query.
+        """
+        try:
+            async with self.redis_session as conn:
+                maybe_taken = await might_be_taken(conn, values)
+        except Exception as e:
+            # The filters only save queries; without Redis every value is
+            # checked in the database.
+            logger.warning(f"Availability filter lookup failed: {e} ({type(e)})")
+            maybe_taken = {field: True for field, value in values.items() if value}
+        candidates = {
+            field: values[field] for field, maybe in maybe_taken.items() if maybe
+        }
+        if not candidates:
+            return []
+        columns = [getattr(User, field) for field in candidates]
+        query = select(*columns).filter(
+            or_(
+                *(
+                    column == value
+                    for column, value in zip(columns, candidates.values())
+                )
+            )
+        )
+        async with self.db_session as conn:
+            rows = (await conn.execute(query)).all()
+        return [
+            field
+            for index, (field, value) in enumerate(candidates.items())
+            if any(row[index] == value for row in rows)
+        ]
+
+    async def remember_taken_values(self, values: Dict[str, str]):
+        # Called after the user row is committed, so a Redis failure must not
+        # fail the request. The unique constraints still reject the values;
+        # the filters only miss them until the next rebuild.
+        try:
+            async with self.redis_session as conn:
+                await mark_taken(conn, values)
+        except Exception as e:
+            logger.warning(f"Could not mark {list(values)} as taken: {e} ({type(e)})")
+
+    async def check_if_token_is_blacklisted(self, token: str, payload: dict) -> bool:
+        keys = blacklist_lookup_keys(token, payload)
+        if not blacklist_cache.might_contain(keys):
+            return False
+        async with self.redis_session as conn:
+            values = await conn.mget(keys)
+        is_blacklisted = any(value is not None for value in values)
+        if not is_blacklisted:
+            blacklist_cache.record_miss()
+        return is_blacklisted
+
+    async def get_token_epoch(self, user_id) -> int:
+        epoch = blacklist_cache.token_epoch(user_id)
+        if epoch is not None:
+            return epoch
+        generation = blacklist_cache.generation
+        async with self.redis_session as conn:
+            epoch = int(await conn.hget(TOKEN_EPOCHS_KEY, str(user_id)) or 0)
+        blacklist_cache.remember_epoch(user_id, epoch, generation)
+        return epoch
+
+    async def bump_token_epoch(self, user_id) -> int:
+        return (await self.bump_token_epochs([user_id]))[0]
+
+    async def bump_token_epochs(self, user_ids: Iterable) -> List[int]:
+        # All epochs live in one hash, so revoking many users is a single
+        # round trip that touches one key.
+        user_ids = [str(user_id) for user_id in user_ids]
+        async with self.redis_session as conn:
+            bump = conn.register_script(BUMP_TOKEN_EPOCHS_SCRIPT)
+            epochs = await bump(
+                keys=[TOKEN_EPOCHS_KEY],
+                args=[BLACKLIST_CHANNEL, TOKEN_EPOCH_MESSAGE_PREFIX, *user_ids],
+            )
+        for user_id, epoch in zip(user_ids, epochs):
+            blacklist_cache.remember_epoch(user_id, epoch)
+        return epochs
+
+    async def get_token_status(
+        self, token: str, payload: dict, user_id
+    ) -> Tuple[bool, int]:
+        keys = blacklist_lookup_keys(token, payload)
+        if not blacklist_cache.might_contain(keys):
+            return False, await self.get_token_epoch(user_id)
+        generation = blacklist_cache.generation
         async with self.redis_session as conn:
-            token_value = await conn.get(token)
-        return token_value is not None
+            async with conn.pipeline(transaction=False) as pipe:
+                pipe.mget(keys)
+                pipe.hget(TOKEN_EPOCHS_KEY, str(user_id))
+                values, epoch = await pipe.execute()
+        epoch = int(epoch or 0)
+        blacklist_cache.remember_epoch(user_id, epoch, generation)
+        is_blacklisted = any(value is not None for value in values)
+        if not is_blacklisted:
+            blacklist_cache.record_miss()
+        return is_blacklisted, epoch
 
     async def get_users_by_uuid_list(self, uuid_list: UserUUIDList) -> Sequence[User]:
         async with self.db_session as conn:
@@ -85,3 +241,10 @@ async def create_base_user_repository() -> AsyncGenerator[BaseUserRepository, No
     async with create_async_session() as db_session:
         async with get_redis() as redis_session:
             yield BaseUserRepository(db_session, redis_session)
+
+
+async def get_base_user_repository(
+    db_session: AsyncSession = Depends(get_request_session),
+    redis_session=Depends(get_request_redis),
+) -> BaseUserRepository:
+    return BaseUserRepository(db_session, redis_session)
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -16,6 +18,73 @@ class Settings(BaseSettings):
     AWS_SECRET_ACCESS_KEY: str
     ENDPOINT_URL: str
     INNOTTER_API_KEY: str
+    AUTH_STATELESS_MODE: bool = False
+    BLACKLIST_LEGACY_KEYS: bool = True
+    BLACKLIST_CACHE_ENABLED: bool = True
+    BLACKLIST_CACHE_CAPACITY: int = 1_000_000
+    BLACKLIST_CACHE_ERROR_RATE: float = 0.001
+    BLACKLIST_CACHE_REBUILD_SECONDS: int = 3600
+    BLACKLIST_CACHE_RETRY_SECONDS: int = 5
+    TOKEN_EPOCH_CACHE_SIZE: int = 100_000
+    LOGIN_RATE_LIMIT_ENABLED: bool = True
+    LOGIN_RATE_LIMIT_USERNAME_ATTEMPTS: int = 5
+    LOGIN_RATE_LIMIT_USERNAME_PERIOD_SECONDS: int = 60
+    LOGIN_RATE_LIMIT_IP_ATTEMPTS: int = 20
+    LOGIN_RATE_LIMIT_IP_PERIOD_SECONDS: int = 60
+    BCRYPT_ROUNDS: int = 12
+    EMAIL_SENDER: str = "sender@example.com"
+    EMAIL_OUTBOX_WORKER_ENABLED: bool = True
+    EMAIL_OUTBOX_BATCH_SIZE: int = 20
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 5
+    EMAIL_OUTBOX_RETRY_BASE_SECONDS: float = 2.0
+    EMAIL_OUTBOX_RETRY_MAX_SECONDS: float = 300.0
+    EMAIL_OUTBOX_SEND_TIMEOUT_SECONDS: float = 10.0
+    EMAIL_OUTBOX_MAX_LENGTH: int = 100_000
+    USER_SEARCH_MIN_LENGTH: int = 3
+    USER_SEARCH_TIMEOUT_MS: int = 2000
+    # "endpoint": UserData.image_url points at GET /users/{id}/avatar/,
+    # "presigned": a presigned S3 URL, "inline": legacy base64 UserData.image.
+    AVATAR_RESPONSE_MODE: Literal["endpoint", "presigned", "inline"] = "endpoint"
+    AVATAR_PRESIGNED_URL_TTL_SECONDS: int = 3600
+    AVATAR_CACHE_MAX_AGE_SECONDS: int = 300
+    AVATAR_STREAM_CHUNK_SIZE: int = 64 * 1024
+    AVATAR_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    AVATAR_CACHE_MAX_ITEM_BYTES: int = 1024 * 1024
+    AVATAR_CACHE_REDIS_TTL_SECONDS: int = 24 * 3600
+    AVATAR_FETCH_CONCURRENCY: int = 10
+    # Avatar size list endpoints return unless the client asks for another.
+    AVATAR_LIST_DEFAULT_SIZE: Literal["64", "256", "original"] = "64"
+    AVATAR_MAX_PIXELS: int = 40_000_000
+    AVATAR_MAX_UPLOAD_BYTES: int = 10 * 1024 * 1024
+    AVATAR_UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    # S3 rejects multipart parts smaller than 5 MiB (except the last one).
+    AVATAR_UPLOAD_PART_SIZE: int = 8 * 1024 * 1024
+    AVATAR_THUMBNAIL_QUALITY: int = 85
+    AVATAR_IMAGE_MAX_WORKERS: int = 2
+    AVATAR_IMAGE_MAX_QUEUE_SIZE: int = 16
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_CONNECT_TIMEOUT_SECONDS: float = 2.0
+    S3_READ_TIMEOUT_SECONDS: float = 10.0
+    S3_KEEPALIVE_TIMEOUT_SECONDS: float = 30.0
+    S3_MAX_ATTEMPTS: int = 3
+    S3_PURGE_CONCURRENCY: int = 8
+    AVATAR_FETCH_BUDGET_SECONDS: float = 2.0
+    AVAILABILITY_FILTER_ENABLED: bool = True
+    AVAILABILITY_FILTER_CAPACITY: int = 1_000_000
+    AVAILABILITY_FILTER_ERROR_RATE: float = 0.001
+    HASHING_MAX_WORKERS: int = 4
+    HASHING_MAX_QUEUE_SIZE: int = 64
+    HASHING_USE_PROCESSES: bool = False
+    USER_IMPORT_BATCH_SIZE: int = 1000
+    USER_IMPORT_HASH_CHUNK_SIZE: int = 50
+    USER_IMPORT_HASHING_MAX_WORKERS: int = 4
+    USER_IMPORT_HASHING_MAX_QUEUE_SIZE: int = 4
+    USER_IMPORT_MAX_REPORTED_ERRORS: int = 1000
+    REDIS_POOL_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 5.0
 
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", extra="ignore"
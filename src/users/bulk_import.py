@@ -0,0 +1,387 @@
+"""Bulk import of users from CSV or JSON Lines.
+
+    python -m src.users.bulk_import users.csv [--group-id 3]
+
+Every row needs ``username``, ``email`` and ``password``; ``name``,
+``surname`` and ``phone_number`` are optional. Rows are read in batches,
+their passwords are hashed in a process pool, and each batch is COPYed into a
+temporary staging table and merged into ``user`` by a single statement.
+Invalid rows and rows colliding with an existing user or with an earlier row
+of the input are reported by line number instead of failing the import.
+Batches are committed one by one, so an import that fails half way keeps the
+users merged so far.
+"""
+
+import argparse
+import asyncio
+import csv
+import enum
+import io
+import itertools
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from starlette.concurrency import run_in_threadpool
+
+from logs.logs import configure_logger
+from src.auth.service import _hash_password
+from src.availability import mark_all_taken
+from src.database import close_redis_pool, engine, get_redis
+from src.executors import import_hashing_executor, shutdown_executors
+from src.models import Group, RoleEnum
+from src.settings import Settings
+from src.users.schemas import ImportedUser
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+REQUIRED_COLUMNS = ("username", "email", "password")
+STAGING_TABLE = "user_import_staging"
+STAGING_COLUMNS = (
+    "line",
+    "id",
+    "username",
+    "email",
+    "hashed_password",
+    "name",
+    "surname",
+    "phone_number",
+)
+
+CREATE_STAGING_TABLE = text(
+    f"""
+    CREATE TEMPORARY TABLE {STAGING_TABLE} (
+        line integer NOT NULL,
+        id uuid NOT NULL,
+        username text NOT NULL,
+        email text NOT NULL,
+        hashed_password text NOT NULL,
+        name text,
+        surname text,
+        phone_number text
+    ) ON COMMIT DROP
+    """
+)
+
+# A row conflicts on the first unique field that an existing user or an
+# earlier row of the batch already has; earlier batches are existing users by
+# the time a batch is merged. ON CONFLICT catches users created concurrently,
+# which then come back neither conflicting nor imported.
+MERGE_STAGING_TABLE = text(
+    f"""
+    WITH candidates AS (
+        SELECT
+            s.*,
+            CASE
+                WHEN row_number() OVER (PARTITION BY s.username ORDER BY s.line) > 1
+                    OR EXISTS (SELECT 1 FROM "user" u WHERE u.username = s.username)
+                    THEN 'username'
+                WHEN row_number() OVER (PARTITION BY s.email ORDER BY s.line) > 1
+                    OR EXISTS (SELECT 1 FROM "user" u WHERE u.email = s.email)
+                    THEN 'email'
+                WHEN s.phone_number IS NOT NULL AND (
+                    row_number() OVER (PARTITION BY s.phone_number ORDER BY s.line) > 1
+                    OR EXISTS (
+                        SELECT 1 FROM "user" u WHERE u.phone_number = s.phone_number
+                    )
+                )
+                    THEN 'phone_number'
+            END AS conflicting_field
+        FROM {STAGING_TABLE} s
+    ),
+    inserted AS (
+        INSERT INTO "user" (
+            id, username, email, hashed_password, name, surname, phone_number,
+            role, group_id, is_blocked, created_at
+        )
+        SELECT
+            id, username, email, hashed_password, name, surname, phone_number,
+            CAST(:role AS roleenum), CAST(:group_id AS integer), false,
+            CAST(:created_at AS timestamp)
+        FROM candidates
+        WHERE conflicting_field IS NULL
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    )
+    SELECT
+        c.line, c.username, c.email, c.phone_number, c.conflicting_field,
+        i.id IS NOT NULL AS imported
+    FROM candidates c
+    LEFT JOIN inserted i ON i.id = c.id
+    ORDER BY c.line
+    """
+)
+
+
+class ImportFormat(str, enum.Enum):
+    CSV = "csv"
+    JSONL = "jsonl"
+
+    @classmethod
+    def from_filename(cls, filename: Optional[str]) -> Optional["ImportFormat"]:
+        extension = (filename or "").rpartition(".")[2].lower()
+        return {"csv": cls.CSV, "jsonl": cls.JSONL, "ndjson": cls.JSONL}.get(extension)
+
+
+class UnknownGroupError(Exception):
+    pass
+
+
+class InvalidImportFileError(Exception):
+    pass
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    imported: int = 0
+    rejected: int = 0
+    errors: List[dict] = field(default_factory=list)
+    seconds: float = 0.0
+    started: float = field(default_factory=time.perf_counter, repr=False)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def reject(self, line: int, column: Optional[str], error: str):
+        self.rejected += 1
+        # Only the first errors are kept, a bad file must not grow the report
+        # without bound.
+        if len(self.errors) < settings.USER_IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "field": column, "error": error})
+
+    def report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def read_rows(
+    file: BinaryIO, import_format: ImportFormat
+) -> Iterator[Tuple[int, Optional[dict]]]:
+    """Yield ``(line number, row)`` pairs; rows that are not objects are None."""
+    lines = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if import_format == ImportFormat.CSV:
+            reader = csv.DictReader(lines)
+            missing = set(REQUIRED_COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise InvalidImportFileError(
+                    f"Missing columns: {', '.join(sorted(missing))}"
+                )
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(lines, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+    finally:
+        # Leave the caller's file open.
+        lines.detach()
+
+
+def validate_row(line: int, row: Optional[dict], stats: ImportStats):
+    if row is None:
+        stats.reject(line, None, "Not a JSON object")
+        return None
+    try:
+        # Empty CSV cells are missing values; DictReader puts surplus cells
+        # under the None key.
+        return ImportedUser.model_validate(
+            {key: value for key, value in row.items() if key and value != ""}
+        )
+    except ValidationError as e:
+        error = e.errors()[0]
+        column = str(error["loc"][0]) if error["loc"] else None
+        stats.reject(line, column, error["msg"])
+        return None
+
+
+def hash_passwords(passwords: List[str], rounds: int) -> List[str]:
+    return [_hash_password(password, rounds) for password in passwords]
+
+
+async def hash_passwords_in_pool(passwords: List[str]) -> List[str]:
+    """Hash in chunks, one per worker process at a time."""
+    chunk_size = settings.USER_IMPORT_HASH_CHUNK_SIZE
+    semaphore = asyncio.Semaphore(import_hashing_executor.max_workers)
+
+    async def hash_chunk(chunk: List[str]) -> List[str]:
+        async with semaphore:
+            return await import_hashing_executor.run(
+                hash_passwords, chunk, settings.BCRYPT_ROUNDS
+            )
+
+    chunks = await asyncio.gather(
+        *(
+            hash_chunk(passwords[start : start + chunk_size])
+            for start in range(0, len(passwords), chunk_size)
+        )
+    )
+    return [hashed for chunk in chunks for hashed in chunk]
+
+
+async def merge_batch(
+    conn: AsyncConnection, records: List[tuple], group_id: Optional[int]
+) -> list:
+    async with conn.begin():
+        # The first statement opens the transaction the COPY then runs in.
+        await conn.execute(CREATE_STAGING_TABLE)
+        raw_connection = await conn.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            STAGING_TABLE, records=records, columns=STAGING_COLUMNS
+        )
+        result = await conn.execute(
+            MERGE_STAGING_TABLE,
+            {
+                "role": RoleEnum.USER.name,
+                "group_id": group_id,
+                "created_at": datetime.utcnow(),
+            },
+        )
+        return result.all()
+
+
+async def remember_imported(rows: list):
+    try:
+        async with get_redis() as redis:
+            await mark_all_taken(
+                redis,
+                (
+                    {
+                        "username": row.username,
+                        "email": row.email,
+                        "phone_number": row.phone_number,
+                    }
+                    for row in rows
+                ),
+            )
+    except Exception as e:
+        # The unique constraints still reject these values; the filters only
+        # miss them until the next rebuild.
+        logger.warning(f"Could not mark imported users as taken: {e} ({type(e)})")
+
+
+def take(rows: Iterator, count: int) -> list:
+    try:
+        return list(itertools.islice(rows, count))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise InvalidImportFileError(f"Unreadable input: {e}") from e
+
+
+async def import_users(
+    file: BinaryIO,
+    import_format: ImportFormat,
+    group_id: Optional[int] = None,
+    progress: Optional[Callable[[ImportStats], None]] = None,
+) -> ImportStats:
+    stats = ImportStats()
+    rows = read_rows(file, import_format)
+    async with engine.connect() as conn:
+        if group_id is not None:
+            async with conn.begin():
+                found = await conn.scalar(select(Group.id).where(Group.id == group_id))
+            if found is None:
+                raise UnknownGroupError(group_id)
+        while True:
+            batch = await run_in_threadpool(take, rows, settings.USER_IMPORT_BATCH_SIZE)
+            if not batch:
+                break
+            stats.rows += len(batch)
+            users = [
+                (line, user)
+                for line, row in batch
+                if (user := validate_row(line, row, stats)) is not None
+            ]
+            if users:
+                hashed_passwords = await hash_passwords_in_pool(
+                    [user.password for _, user in users]
+                )
+                records = [
+                    (
+                        line,
+                        uuid.uuid4(),
+                        user.username,
+                        user.email,
+                        hashed_password,
+                        user.name,
+                        user.surname,
+                        user.phone_number,
+                    )
+                    for (line, user), hashed_password in zip(users, hashed_passwords)
+                ]
+                merged = await merge_batch(conn, records, group_id)
+                imported = [row for row in merged if row.imported]
+                for row in merged:
+                    if row.conflicting_field:
+                        stats.reject(
+                            row.line,
+                            row.conflicting_field,
+                            f"{row.conflicting_field} is already taken",
+                        )
+                    elif not row.imported:
+                        stats.reject(row.line, None, "Conflicts with a new user")
+                stats.imported += len(imported)
+                await remember_imported(imported)
+            stats.seconds = time.perf_counter() - stats.started
+            if progress is not None:
+                progress(stats)
+    stats.seconds = time.perf_counter() - stats.started
+    logger.info(
+        f"Imported {stats.imported} of {stats.rows} users "
+        f"({stats.rows_per_second:.0f} rows/s)"
+    )
+    return stats
+
+
+def print_progress(stats: ImportStats):
+    print(
+        f"rows={stats.rows} imported={stats.imported} rejected={stats.rejected} "
+        f"({stats.rows_per_second:.0f} rows/s)",
+        flush=True,
+    )
+
+
+async def main(path: str, import_format: ImportFormat, group_id: Optional[int]):
+    try:
+        with open(path, "rb") as file:
+            stats = await import_users(file, import_format, group_id, print_progress)
+    finally:
+        await engine.dispose()
+        await close_redis_pool()
+        shutdown_executors()
+    for error in stats.errors:
+        print(f"line {error['line']}: {error['field'] or 'row'}: {error['error']}")
+    if stats.rejected > len(stats.errors):
+        print(f"... and {stats.rejected - len(stats.errors)} more rejected rows")
+    print_progress(stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file")
+    parser.add_argument("--format", type=ImportFormat)
+    parser.add_argument("--group-id", type=int)
+    args = parser.parse_args()
+    import_format = args.format or ImportFormat.from_filename(args.file)
+    if import_format is None:
+        parser.error("cannot tell the format from the file name, pass --format")
+    asyncio.run(main(args.file, import_format, args.group_id))
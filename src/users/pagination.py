@@ -0,0 +1,130 @@
+import base64
+import enum
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import and_, or_, tuple_
+
+from src.models import User
+
+# Columns GET /users/ may sort by. Cursors carry the last row's sort value in
+# the clear, so nothing secret (hashed_password) or opaque (search_vector)
+# belongs here.
+SORTABLE_COLUMNS = (
+    "id",
+    "username",
+    "email",
+    "name",
+    "surname",
+    "created_at",
+    "modified_at",
+)
+
+
+def sort_column(sort_by: Optional[str]):
+    return User.__table__.columns[sort_by] if sort_by else User.id
+
+
+def keyset_order_by(column, descending: bool) -> list:
+    # Postgres' default NULL placement, spelled out so keyset_filter agrees
+    # with it; ``id`` breaks ties between equal sort values.
+    if descending:
+        return [column.desc().nulls_first(), User.id.desc()]
+    return [column.asc().nulls_last(), User.id.asc()]
+
+
+def keyset_filter(column, descending: bool, value: Any, last_id: uuid.UUID):
+    """Rows strictly after ``(value, last_id)`` in ``keyset_order_by`` order."""
+    if descending:
+        if value is None:
+            return or_(and_(column.is_(None), User.id < last_id), column.is_not(None))
+        return tuple_(column, User.id) < tuple_(value, last_id)
+    if value is None:
+        return and_(column.is_(None), User.id > last_id)
+    return or_(tuple_(column, User.id) > tuple_(value, last_id), column.is_(None))
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _load_value(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if issubclass(python_type, (enum.Enum, uuid.UUID)):
+        return python_type(value)
+    return value
+
+
+def _encode(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode(cursor: str) -> dict:
+    try:
+        payload = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except json.JSONDecodeError as e:
+        raise ValueError("Malformed cursor") from e
+    if not isinstance(payload, dict):
+        raise ValueError("Malformed cursor")
+    return payload
+
+
+def encode_cursor(sort_by: Optional[str], order_by: str, user: User) -> str:
+    return _encode(
+        {
+            "s": sort_by,
+            "o": order_by,
+            "v": _dump_value(getattr(user, sort_by or "id")),
+            "id": str(user.id),
+        }
+    )
+
+
+def decode_cursor(
+    cursor: str, sort_by: Optional[str], order_by: str
+) -> Tuple[Any, uuid.UUID]:
+    """Return the ``(sort value, id)`` of the last row of the previous page.
+
+    Raises ValueError for malformed cursors and for cursors issued for a
+    different ordering.
+    """
+    payload = _decode(cursor)
+    try:
+        if payload["s"] != sort_by or payload["o"] != order_by:
+            raise ValueError("Cursor was issued for a different ordering")
+        return (
+            _load_value(sort_column(sort_by), payload["v"]),
+            uuid.UUID(payload["id"]),
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError("Malformed cursor") from e
+
+
+def encode_rank_cursor(query: str, rank: float, user: User) -> str:
+    return _encode({"q": query, "r": rank, "id": str(user.id)})
+
+
+def decode_rank_cursor(cursor: str, query: str) -> Tuple[float, uuid.UUID]:
+    """Return the ``(rank, id)`` of the last search result of the previous page."""
+    payload = _decode(cursor)
+    try:
+        if payload["q"] != query:
+            raise ValueError("Cursor was issued for a different search")
+        return float(payload["r"]), uuid.UUID(payload["id"])
+    except (KeyError, TypeError) as e:
+        raise ValueError("Malformed cursor") from e
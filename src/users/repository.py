@@ -1,48 +1,164 @@
-from contextlib import asynccontextmanager
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
 from datetime import datetime
-from typing import AsyncGenerator, Optional, Sequence, Type
+from typing import Any, AsyncGenerator, Optional, Sequence, Tuple, Type
 
-from fastapi import File
-from sqlalchemy import select
+from fastapi import Depends, File, HTTPException
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from src.aws.user_image_service import S3UserImageService
-from src.database import create_async_session
+from logs.logs import configure_logger
+from src.availability import AVAILABILITY_FIELDS
+from src.aws.avatar_cache import avatar_cache
+from src.aws.user_image_service import PreparedAvatar, S3UserImageService
+from src.database import (
+    create_async_session,
+    get_redis,
+    get_request_redis,
+    get_request_session,
+)
 from src.models import User
 from src.repository import BaseUserRepository
+from src.settings import Settings
+from src.users.pagination import keyset_filter, keyset_order_by, sort_column
 from src.users.schemas import UserPatchDataAdvanced
 
+TOKEN_CLAIM_FIELDS = ("username", "role", "is_blocked", "group_id")
+USER_SEARCH_FIELDS = ("username", "name", "surname", "email")
+QUERY_CANCELED_SQLSTATE = "57014"
+
+logger = configure_logger(__name__)
+settings = Settings()
+
+
+class SearchTimeoutError(Exception):
+    pass
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def lock_avatar(conn: AsyncSession, avatar_s3_path: str):
+    """Take the transaction-level advisory lock of one avatar."""
+    return conn.execute(
+        select(func.pg_advisory_xact_lock(func.hashtextextended(avatar_s3_path, 0)))
+    )
+
 
 class UserRepository(BaseUserRepository):
-    def __init__(self, db_session: AsyncSession):
-        super().__init__(db_session)
+    def __init__(self, db_session: AsyncSession, redis_session=None):
+        super().__init__(db_session, redis_session)
 
     async def update_user(
         self, user_id, user_data: UserPatchDataAdvanced, avatar: File
     ) -> Type[User] | None:
-        async with self.db_session as conn:
-            user = await conn.get(User, user_id)
+        avatar_service = S3UserImageService()
+        async with AsyncExitStack() as stack:
+            new_avatar = None
             if avatar:
-                avatar_service = S3UserImageService()
-                if user.image_s3_path:
-                    await avatar_service.delete_avatar(str(user.image_s3_path))
-                new_avatar_s3_path = await avatar_service.upload_avatar(avatar, user.id)
-                user.image_s3_path = new_avatar_s3_path
-            for field, value in user_data.model_dump().items():
-                if value is not None:
-                    setattr(user, field, value)
-            user.modified_at = datetime.now()
-            await conn.commit()
+                # Stored before the user row is touched, so a slow upload does
+                # not hold a pooled connection; the transaction only swaps keys.
+                new_avatar = await stack.enter_async_context(
+                    avatar_service.prepare_avatar(avatar)
+                )
+                await avatar_service.store_avatar(new_avatar)
+            try:
+                async with self.db_session as conn:
+                    if new_avatar:
+                        # Serializes with release_avatar: once this commits,
+                        # the user references the avatar and it is kept.
+                        await lock_avatar(conn, new_avatar.path)
+                    user = await conn.get(User, user_id)
+                    replaced_avatar = (user.image_s3_path, user.image_hash)
+                    if new_avatar:
+                        user.image_s3_path = new_avatar.path
+                        user.image_hash = new_avatar.image_hash
+                    claims_changed = False
+                    taken_values = {}
+                    for field, value in user_data.model_dump().items():
+                        if value is not None:
+                            if (
+                                field in TOKEN_CLAIM_FIELDS
+                                and getattr(user, field) != value
+                            ):
+                                claims_changed = True
+                            if (
+                                field in AVAILABILITY_FIELDS
+                                and getattr(user, field) != value
+                            ):
+                                taken_values[field] = value
+                            setattr(user, field, value)
+                    user.modified_at = datetime.now()
+                    await conn.commit()
+            except BaseException:
+                if new_avatar:
+                    await self.release_avatar(new_avatar.path, new_avatar.image_hash)
+                raise
+            if new_avatar:
+                # The last other user of an identical avatar may have released
+                # it between the upload and the lock. Checked after the commit,
+                # so S3 is never called while a pooled connection is held.
+                await self.restore_avatar(avatar_service, new_avatar)
+        if claims_changed:
+            await self.bump_token_epoch(user.id)
+        if taken_values:
+            await self.remember_taken_values(taken_values)
+        replaced_path, replaced_hash = replaced_avatar
+        if new_avatar and replaced_path and replaced_path != user.image_s3_path:
+            await self.release_avatar(replaced_path, replaced_hash)
         return user
 
     async def delete_user(self, user_id):
         async with self.db_session as conn:
             user = await conn.get(User, user_id)
-            if user.image_s3_path:
-                await S3UserImageService().delete_avatar(str(user.image_s3_path))
             await conn.delete(user)
             await conn.commit()
+        if user.image_s3_path:
+            await self.release_avatar(user.image_s3_path, user.image_hash)
+        # The availability filters keep the freed values until the next
+        # rebuild; lookups for them fall back to the database until then.
+        try:
+            await self.bump_token_epoch(user_id)
+        except Exception as e:
+            # The user is already deleted, so the request still succeeds;
+            # tokens issued to them stay usable until they expire.
+            logger.error(
+                f"Could not revoke tokens of deleted user {user_id}: {e} ({type(e)})"
+            )
+
+    @staticmethod
+    async def restore_avatar(
+        avatar_service: S3UserImageService, avatar: PreparedAvatar
+    ):
+        try:
+            if await avatar_service.store_avatar(avatar):
+                logger.warning(f"Avatar {avatar.path} was released, stored it again")
+        except HTTPException as e:
+            # The user row is already committed; the avatar 404s until the
+            # user uploads it again.
+            logger.error(f"Could not store avatar {avatar.path} again: {e.detail}")
+
+    async def release_avatar(self, avatar_s3_path: str, image_hash: Optional[str]):
+        """Delete an avatar from S3 once no user references it any more.
+
+        Identical uploads share one content-addressed object, so the users
+        pointing at it are its reference count. The count and the deletion
+        happen under the avatar's advisory lock, which ``update_user`` also
+        takes before it points a user at an avatar.
+        """
+        async with self.db_session as conn:
+            await lock_avatar(conn, avatar_s3_path)
+            references = await conn.scalar(
+                select(func.count()).where(User.image_s3_path == avatar_s3_path)
+            )
+            if not references:
+                await S3UserImageService().delete_avatar(str(avatar_s3_path))
+            await conn.commit()
+        if not references:
+            await avatar_cache.invalidate(image_hash)
 
     async def get_users(
         self,
@@ -52,7 +168,14 @@ class UserRepository(BaseUserRepository):
         sort_by: Optional[str],
         order_by: Optional[str],
         group_id: int = None,
+        after: Optional[Tuple[Any, uuid.UUID]] = None,
     ) -> Sequence[User]:
+        """Return one page of users.
+
+        With ``after`` (the sort value and id of the previous page's last row)
+        the page starts right after that row instead of at an OFFSET, so deep
+        pages cost the same as the first one.
+        """
         query = select(User)
 
         if group_id:
@@ -61,14 +184,15 @@ class UserRepository(BaseUserRepository):
         if filter_by_name:
             query = query.filter(User.username.ilike(f"%{filter_by_name}%"))
 
-        if sort_by:
-            if order_by.lower() == "asc":
-                query = query.order_by(getattr(User, sort_by))
-            elif order_by.lower() == "desc":
-                query = query.order_by(getattr(User, sort_by).desc())
+        column = sort_column(sort_by)
+        descending = str(order_by).lower() == "desc"
+        query = query.order_by(*keyset_order_by(column, descending))
 
-        offset = (page - 1) * limit
-        query = query.offset(offset).limit(limit)
+        if after is not None:
+            query = query.filter(keyset_filter(column, descending, *after))
+        else:
+            query = query.offset((page - 1) * limit)
+        query = query.limit(limit)
 
         async with self.db_session as session:
             async with session.begin():
@@ -77,8 +201,84 @@ class UserRepository(BaseUserRepository):
 
         return users
 
+    async def search_users(
+        self, term: str, page: int, limit: int, group_id: int = None
+    ) -> Sequence[User]:
+        """Substring search over USER_SEARCH_FIELDS, best matches first.
+
+        Matching uses ILIKE, which the trigram indexes serve; the rank is the
+        best trigram similarity of any field. The statement is cancelled after
+        USER_SEARCH_TIMEOUT_MS.
+        """
+        pattern = f"%{escape_like(term)}%"
+        columns = [getattr(User, field) for field in USER_SEARCH_FIELDS]
+        rank = func.greatest(*(func.similarity(column, term) for column in columns))
+        query = select(User).filter(
+            or_(*(column.ilike(pattern, escape="\\") for column in columns))
+        )
+        if group_id:
+            query = query.filter(User.group_id == group_id)
+        query = (
+            query.order_by(rank.desc(), User.id).offset((page - 1) * limit).limit(limit)
+        )
+        result = await self._execute_search(query.options(selectinload(User.group)))
+        return result.scalars().all()
+
+    async def full_text_search(
+        self,
+        search: str,
+        limit: int,
+        group_id: int = None,
+        after: Optional[Tuple[float, uuid.UUID]] = None,
+    ) -> Sequence[Tuple[User, float]]:
+        """Return ``(user, rank)`` pairs matching every word of ``search``.
+
+        Results are ordered by rank and paginated by keyset: ``after`` is the
+        rank and id of the previous page's last result.
+        """
+        ts_query = func.websearch_to_tsquery("simple", search)
+        rank = func.ts_rank_cd(User.search_vector, ts_query)
+        query = select(User, rank).filter(User.search_vector.op("@@")(ts_query))
+        if group_id:
+            query = query.filter(User.group_id == group_id)
+        if after is not None:
+            query = query.filter(tuple_(rank, User.id) < tuple_(*after))
+        query = query.order_by(rank.desc(), User.id.desc()).limit(limit)
+        result = await self._execute_search(query.options(selectinload(User.group)))
+        return result.all()
+
+    async def _execute_search(self, query):
+        # The timeout is transaction-local, so it only applies to this query.
+        async with self.db_session as session:
+            try:
+                async with session.begin():
+                    await session.execute(
+                        select(
+                            func.set_config(
+                                "statement_timeout",
+                                str(settings.USER_SEARCH_TIMEOUT_MS),
+                                True,
+                            )
+                        )
+                    )
+                    result = (await session.execute(query)).unique()
+            except DBAPIError as e:
+                cause = getattr(e.orig, "__cause__", None)
+                if getattr(cause, "sqlstate", None) == QUERY_CANCELED_SQLSTATE:
+                    raise SearchTimeoutError() from e
+                raise
+        return result
+
 
 @asynccontextmanager
 async def create_user_repository() -> AsyncGenerator[UserRepository, None]:
     async with create_async_session() as db_session:
-        yield UserRepository(db_session)
+        async with get_redis() as redis_session:
+            yield UserRepository(db_session, redis_session)
+
+
+async def get_user_repository(
+    db_session: AsyncSession = Depends(get_request_session),
+    redis_session=Depends(get_request_redis),
+) -> UserRepository:
+    return UserRepository(db_session, redis_session)
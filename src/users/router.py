@@ -1,12 +1,26 @@
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, File, Query, UploadFile
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Header,
+    Query,
+    Response,
+    UploadFile,
+    status,
+)
+from fastapi.responses import StreamingResponse
 
 from logs.logs import configure_logger
+from src.images import AvatarSize
 from src.models import User
-from src.users.repository import UserRepository, create_user_repository
+from src.settings import Settings
+from src.users.bulk_import import ImportFormat
+from src.users.repository import UserRepository, get_user_repository
 from src.users.schemas import (
     UserData,
+    UserImportReport,
     UserPatchData,
     UserPatchDataAdvanced,
     UserUUIDList,
@@ -22,15 +36,20 @@ from src.utils import (
 
 router = APIRouter()
 logger = configure_logger(__name__)
+settings = Settings()
 
 
 @router.get("/me/", response_model=UserData)
 async def read_me(
+    avatar_size: AvatarSize = Query(
+        AvatarSize.ORIGINAL, description="Avatar size to return"
+    ),
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).get_user(user_id=user.id)
+    return await UserService(user_repo).get_user(
+        user_id=user.id, avatar_size=avatar_size
+    )
 
 
 @router.patch("/me/", response_model=UserData)
@@ -38,32 +57,97 @@ async def update_me(
     user_patch_data: UserPatchData = Depends(),
     avatar: UploadFile = File(None),
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).patch_user(
-            user_id=user.id, user_patch_data=user_patch_data, avatar=avatar
-        )
+    return await UserService(user_repo).patch_user(
+        user_id=user.id, user_patch_data=user_patch_data, avatar=avatar
+    )
 
 
 @router.delete("/me/")
 async def delete_me(
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).delete_user(user_id=user.id)
+    return await UserService(user_repo).delete_user(user_id=user.id)
+
+
+@router.get("/search/", response_model=List[UserData])
+@has_any_permission([admin_permission, moderator_permission])
+async def search_users(
+    response: Response,
+    q: str = Query(
+        ..., description="Words to find in name, surname, username or email"
+    ),
+    limit: Optional[int] = Query(
+        30, description="Number of items per page", gt=0, le=100
+    ),
+    cursor: Optional[str] = Query(
+        None, description="X-Next-Cursor of the previous page"
+    ),
+    avatar_size: Optional[AvatarSize] = Query(
+        None, description="Avatar size to return; defaults to a thumbnail"
+    ),
+    user: User = Depends(get_current_user),
+    user_repo: UserRepository = Depends(get_user_repository),
+):
+    users, next_cursor = await UserService(user_repo).full_text_search(
+        q, limit, cursor, user, avatar_size
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
+
+
+@router.post("/import/", response_model=UserImportReport)
+@has_any_permission([admin_permission])
+async def import_users(
+    file: UploadFile = File(..., description="CSV or JSON Lines of users"),
+    import_format: Optional[ImportFormat] = Query(
+        None, alias="format", description="Defaults to the file extension"
+    ),
+    group_id: Optional[int] = Query(None, description="Group of every imported user"),
+    user: User = Depends(get_current_user),
+    user_repo: UserRepository = Depends(get_user_repository),
+):
+    return await UserService(user_repo).import_users(file, import_format, group_id)
 
 
 @router.get("/{user_id}/", response_model=UserData)
 # @has_any_permission([moderator_group_permission, admin_permission])
 async def read_user(
     user_id: str,
+    avatar_size: AvatarSize = Query(
+        AvatarSize.ORIGINAL, description="Avatar size to return"
+    ),
+    user: User = Depends(get_current_user),
+    user_repo: UserRepository = Depends(get_user_repository),
+):
+    return await UserService(user_repo).get_user(
+        user_id=user_id, avatar_size=avatar_size
+    )
+
+
+@router.get("/{user_id}/avatar/")
+async def read_user_avatar(
+    user_id: str,
+    size: AvatarSize = Query(AvatarSize.ORIGINAL, description="Avatar size"),
+    if_none_match: Optional[str] = Header(None),
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).get_user(user_id=user_id)
+    avatar = await UserService(user_repo).get_avatar(user_id, if_none_match, size)
+    headers = {
+        "ETag": avatar.etag,
+        "Cache-Control": f"private, max-age={settings.AVATAR_CACHE_MAX_AGE_SECONDS}",
+    }
+    if avatar.not_modified:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if avatar.content_length is not None:
+        headers["Content-Length"] = str(avatar.content_length)
+    return StreamingResponse(
+        avatar.chunks, media_type=avatar.content_type, headers=headers
+    )
 
 
 @router.patch("/{user_id}/", response_model=UserData)
@@ -73,12 +157,11 @@ async def patch_user(
     user_patch_data: UserPatchDataAdvanced = Depends(),
     avatar: UploadFile = File(None),
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).patch_user(
-            user_id=user_id, user_patch_data=user_patch_data, avatar=avatar
-        )
+    return await UserService(user_repo).patch_user(
+        user_id=user_id, user_patch_data=user_patch_data, avatar=avatar
+    )
 
 
 @router.delete("/{user_id}/")
@@ -86,15 +169,15 @@ async def patch_user(
 async def delete_user(
     user_id: str,
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).delete_user(user_id=user_id)
+    return await UserService(user_repo).delete_user(user_id=user_id)
 
 
 @router.get("/", response_model=List[UserData])
 @has_any_permission([admin_permission, moderator_permission])
 async def get_users(
+    response: Response,
     user: User = Depends(get_current_user),
     page: Optional[int] = Query(1, description="Page number", gt=0),
     limit: Optional[int] = Query(
@@ -105,19 +188,45 @@ async def get_users(
     order_by: Optional[str] = Query(
         "asc", description="Sorting order ('asc' or 'desc')"
     ),
-    user_repo: UserRepository = Depends(create_user_repository),
+    cursor: Optional[str] = Query(
+        None,
+        description="X-Next-Cursor of the previous page; replaces 'page' when set",
+    ),
+    search: Optional[str] = Query(
+        None,
+        description="Search username, name, surname and email; results are "
+        "ranked by similarity and 'sort_by' is ignored",
+    ),
+    avatar_size: Optional[AvatarSize] = Query(
+        None, description="Avatar size to return; defaults to a thumbnail"
+    ),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).get_users(
-            page, limit, filter_by_name, sort_by, order_by, user
-        )
+    users, next_cursor = await UserService(user_repo).get_users(
+        page,
+        limit,
+        filter_by_name,
+        sort_by,
+        order_by,
+        user,
+        cursor,
+        search,
+        avatar_size,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
 
 
 @router.post("/list/", response_model=List[UserData])
 async def users_list(
     user_uuid_list: UserUUIDList,
+    avatar_size: Optional[AvatarSize] = Query(
+        None, description="Avatar size to return; defaults to a thumbnail"
+    ),
     user: User = Depends(get_current_user),
-    user_repo: UserRepository = Depends(create_user_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
 ):
-    async with user_repo as user_repository:
-        return await UserService(user_repository).get_users_by_uuid_list(user_uuid_list)
+    return await UserService(user_repo).get_users_by_uuid_list(
+        user_uuid_list, avatar_size
+    )
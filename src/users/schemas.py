@@ -26,6 +26,7 @@ class UserData(UserPatchData):
     role: str
     image_s3_path: Optional[str] = None
     image: Optional[bytes] = None
+    image_url: Optional[str] = None
     group_id: Optional[int] = None
 
 
@@ -41,3 +42,27 @@ class GroupInfo(BaseModel):
     id: int
     name: str
     created_at: datetime
+
+
+class ImportedUser(BaseModel):
+    username: str
+    email: EmailStr
+    password: str
+    name: Optional[str] = None
+    surname: Optional[str] = None
+    phone_number: Optional[str] = None
+
+
+class UserImportRowError(BaseModel):
+    line: int
+    field: Optional[str] = None
+    error: str
+
+
+class UserImportReport(BaseModel):
+    rows: int
+    imported: int
+    rejected: int
+    errors: List[UserImportRowError]
+    seconds: float
+    rows_per_second: float
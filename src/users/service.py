@@ -1,20 +1,38 @@
-from typing import List, Optional
+import asyncio
+from typing import List, Optional, Sequence, Tuple
 
-from fastapi import File, HTTPException, status
+from fastapi import File, HTTPException, UploadFile, status
 
 from logs.logs import configure_logger
-from src.aws.user_image_service import S3UserImageService
+from src.aws.user_image_service import AvatarObject, S3UserImageService
+from src.images import AvatarSize
 from src.models import User
-from src.users.repository import UserRepository
+from src.settings import Settings
+from src.users.bulk_import import (
+    ImportFormat,
+    InvalidImportFileError,
+    UnknownGroupError,
+    import_users,
+)
+from src.users.pagination import (
+    SORTABLE_COLUMNS,
+    decode_cursor,
+    decode_rank_cursor,
+    encode_cursor,
+    encode_rank_cursor,
+)
+from src.users.repository import SearchTimeoutError, UserRepository
 from src.users.schemas import (
     CreateGroup,
     GroupInfo,
     UserData,
+    UserImportReport,
     UserPatchDataAdvanced,
     UserUUIDList,
 )
 
 logger = configure_logger(__name__)
+settings = Settings()
 
 
 class UserService:
@@ -37,10 +55,12 @@ class UserService:
         await self.user_repo.delete_user(user_id)
         logger.debug(f"Successful patch user {user_id}")
 
-    async def get_user(self, user_id) -> UserData:
+    async def get_user(
+        self, user_id, avatar_size: AvatarSize = AvatarSize.ORIGINAL
+    ) -> UserData:
         logger.debug(f"Start getting user {user_id}")
         user = await self.user_repo.get_user_by_id(user_id)
-        user_data = await self.get_user_data_with_avatar(user)
+        user_data = await self.get_user_data_with_avatar(user, avatar_size)
         logger.debug(f"Successful get user {user_id}")
         return user_data
 
@@ -52,49 +72,130 @@ class UserService:
         sort_by: Optional[str],
         order_by: Optional[str],
         user: User,
-    ) -> List[UserData]:
+        cursor: Optional[str] = None,
+        search: Optional[str] = None,
+        avatar_size: Optional[AvatarSize] = None,
+    ) -> Tuple[List[UserData], Optional[str]]:
         logger.debug("Start getting users")
-        if not hasattr(User, str(sort_by)):
+        if search is not None:
+            users_data = await self.search_users(search, page, limit, user, avatar_size)
+            return users_data, None
+        if sort_by not in SORTABLE_COLUMNS:
             raise HTTPException(status_code=400, detail="Invalid query parameters")
-        group_id = None
-        if user.role == "MODERATOR":
-            group_id = user.group_id
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor, sort_by, order_by)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
         users = await self.user_repo.get_users(
-            page, limit, filter_by_name, sort_by, order_by, group_id
+            page,
+            limit,
+            filter_by_name,
+            sort_by,
+            order_by,
+            self.get_group_scope(user),
+            after,
         )
+        next_cursor = None
+        if len(users) == limit:
+            next_cursor = encode_cursor(sort_by, order_by, users[-1])
         logger.debug("Successful get user {user_id}")
-        return [await self.get_user_data_with_avatar(user) for user in users]
+        users_data = await self.get_users_data_with_avatars(users, avatar_size)
+        return users_data, next_cursor
+
+    async def search_users(
+        self,
+        search: str,
+        page: int,
+        limit: int,
+        user: User,
+        avatar_size: Optional[AvatarSize] = None,
+    ) -> List[UserData]:
+        logger.debug(f"Start searching users for '{search}'")
+        search = search.strip()
+        if len(search) < settings.USER_SEARCH_MIN_LENGTH:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Search term must be at least "
+                f"{settings.USER_SEARCH_MIN_LENGTH} characters long",
+            )
+        try:
+            users = await self.user_repo.search_users(
+                search, page, limit, self.get_group_scope(user)
+            )
+        except SearchTimeoutError:
+            logger.warning(f"Searching users for '{search}' timed out")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Search took too long, please use a more specific term",
+            )
+        logger.debug(f"Successful search users for '{search}'")
+        return await self.get_users_data_with_avatars(users, avatar_size)
+
+    async def full_text_search(
+        self,
+        search: str,
+        limit: int,
+        cursor: Optional[str],
+        user: User,
+        avatar_size: Optional[AvatarSize] = None,
+    ) -> Tuple[List[UserData], Optional[str]]:
+        logger.debug(f"Start full-text search of users for '{search}'")
+        search = search.strip()
+        if len(search) < settings.USER_SEARCH_MIN_LENGTH:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Search term must be at least "
+                f"{settings.USER_SEARCH_MIN_LENGTH} characters long",
+            )
+        after = None
+        if cursor:
+            try:
+                after = decode_rank_cursor(cursor, search)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        try:
+            results = await self.user_repo.full_text_search(
+                search, limit, self.get_group_scope(user), after
+            )
+        except SearchTimeoutError:
+            logger.warning(f"Full-text search of users for '{search}' timed out")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Search took too long, please use a more specific term",
+            )
+        next_cursor = None
+        if len(results) == limit:
+            last_user, last_rank = results[-1]
+            next_cursor = encode_rank_cursor(search, last_rank, last_user)
+        logger.debug(f"Successful full-text search of users for '{search}'")
+        users_data = await self.get_users_data_with_avatars(
+            [user for user, _ in results], avatar_size
+        )
+        return users_data, next_cursor
+
+    @staticmethod
+    def get_group_scope(user: User) -> Optional[int]:
+        # Moderators only see the users of their own group.
+        if user.role == "MODERATOR":
+            return user.group_id
+        return None
 
     async def check_duplicate_credentials(
         self, user_patch_data: UserPatchDataAdvanced, user: User
     ):
+        changed_values = {
+            field: getattr(user_patch_data, field)
+            for field in ("email", "username", "phone_number")
+            if getattr(user_patch_data, field)
+            and getattr(user_patch_data, field) != getattr(user, field)
+        }
+        taken_fields = await self.user_repo.find_taken_fields(changed_values)
         message = None
-        if user_patch_data.email and user_patch_data.email != user.email:
-            existing_user = await self.user_repo.get_user_by_email(
-                user_patch_data.email
-            )
-            if existing_user:
-                message = f"email {user_patch_data.email}"
-        if (
-            not message
-            and user_patch_data.username
-            and user_patch_data.username != user.username
-        ):
-            existing_user = await self.user_repo.get_user_by_username(
-                user_patch_data.username
-            )
-            if existing_user:
-                message = f"username {user_patch_data.username}"
-        if (
-            not message
-            and user_patch_data.phone_number
-            and user_patch_data.phone_number != user.phone_number
-        ):
-            existing_user = await self.user_repo.get_user_by_phone_number(
-                user_patch_data.phone_number
-            )
-            if existing_user:
-                message = f"phone number {user_patch_data.phone_number}"
+        if taken_fields:
+            field = taken_fields[0]
+            message = f"{field.replace('_', ' ')} {changed_values[field]}"
         if message:
             logger.debug(f"Patch user failed: user with {message} is already exists")
             raise HTTPException(
@@ -102,14 +203,67 @@ class UserService:
                 detail=f"User with {message} already exists",
             )
 
-    async def get_user_data_with_avatar(self, user: User):
+    async def get_user_data_with_avatar(
+        self, user: User, avatar_size: AvatarSize = AvatarSize.ORIGINAL
+    ):
         user_data = UserData(**user.to_dict())
         if user.image_s3_path:
-            user_data.image = await S3UserImageService().get_avatar(
-                str(user.image_s3_path)
-            )
+            if settings.AVATAR_RESPONSE_MODE == "inline":
+                user_data.image = await S3UserImageService().get_avatar(
+                    str(user.image_s3_path), user.image_hash, avatar_size
+                )
+            elif settings.AVATAR_RESPONSE_MODE == "presigned":
+                user_data.image_url = await S3UserImageService().get_avatar_url(
+                    str(user.image_s3_path), avatar_size
+                )
+            else:
+                user_data.image_url = f"/users/{user.id}/avatar/"
+                if avatar_size != AvatarSize.ORIGINAL:
+                    user_data.image_url += f"?size={avatar_size.value}"
         return user_data
 
+    async def get_users_data_with_avatars(
+        self, users: Sequence[User], avatar_size: Optional[AvatarSize] = None
+    ) -> List[UserData]:
+        """Resolve the avatars of a page of users concurrently.
+
+        At most ``AVATAR_FETCH_CONCURRENCY`` S3 calls run at once, and the
+        whole page shares ``AVATAR_FETCH_BUDGET_SECONDS``: users whose avatar
+        is not resolved by then are returned without one.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.AVATAR_FETCH_BUDGET_SECONDS
+        semaphore = asyncio.Semaphore(settings.AVATAR_FETCH_CONCURRENCY)
+        avatar_size = avatar_size or AvatarSize(settings.AVATAR_LIST_DEFAULT_SIZE)
+
+        async def fetch(user: User) -> UserData:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(
+                        self.get_user_data_with_avatar(user, avatar_size),
+                        timeout=deadline - loop.time(),
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"Fetching avatar of user {user.id} timed out")
+                    return UserData(**user.to_dict())
+
+        return list(await asyncio.gather(*(fetch(user) for user in users)))
+
+    async def get_avatar(
+        self,
+        user_id: str,
+        if_none_match: Optional[str] = None,
+        size: AvatarSize = AvatarSize.ORIGINAL,
+    ) -> AvatarObject:
+        user = await self.user_repo.get_user_by_id(user_id)
+        if user is None or not user.image_s3_path:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found"
+            )
+        return await S3UserImageService().open_avatar(
+            str(user.image_s3_path), if_none_match, user.image_hash, size
+        )
+
     async def create_group(self, create_group_data: CreateGroup) -> GroupInfo:
         logger.debug(f"Start creating group {create_group_data.name}")
         group = await self.user_repo.create_group(create_group_data)
@@ -123,6 +277,32 @@ class UserService:
     async def delete_group(self, group_id: int):
         await self.user_repo.delete_group_by_id(group_id)
 
-    async def get_users_by_uuid_list(self, uuid_list: UserUUIDList) -> List[UserData]:
+    async def import_users(
+        self,
+        file: UploadFile,
+        import_format: Optional[ImportFormat],
+        group_id: Optional[int],
+    ) -> UserImportReport:
+        import_format = import_format or ImportFormat.from_filename(file.filename)
+        if import_format is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Unknown file format, pass 'format'",
+            )
+        logger.debug(f"Start importing users from {file.filename}")
+        try:
+            stats = await import_users(file.file, import_format, group_id)
+        except UnknownGroupError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Group not found"
+            )
+        except InvalidImportFileError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        logger.debug(f"Successful import of {stats.imported} users")
+        return UserImportReport(**stats.report())
+
+    async def get_users_by_uuid_list(
+        self, uuid_list: UserUUIDList, avatar_size: Optional[AvatarSize] = None
+    ) -> List[UserData]:
         users = await self.user_repo.get_users_by_uuid_list(uuid_list)
-        return [await self.get_user_data_with_avatar(user) for user in users]
+        return await self.get_users_data_with_avatars(users, avatar_size)
@@ -1,13 +1,16 @@
 import inspect
+import uuid
 from functools import wraps
-from typing import List
+from typing import List, Optional
 
 import jwt
-from fastapi import Header, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
+from pydantic import ValidationError
 
 from logs.logs import configure_logger
+from src.auth.schemas import JwtRequest
 from src.models import User
-from src.repository import create_base_user_repository
+from src.repository import BaseUserRepository, get_base_user_repository
 from src.settings import Settings
 
 logger = configure_logger(__name__)
@@ -15,41 +18,113 @@ logger = configure_logger(__name__)
 settings = Settings()
 
 
-async def get_current_user(token: str = Header(), by="username") -> User:
-    async with create_base_user_repository() as user_repo:
-        is_blacklisted = await user_repo.check_if_token_is_blacklisted(token)
-        if is_blacklisted:
-            raise HTTPException(status_code=401, detail="Token is blacklisted")
-        try:
-            payload = jwt.decode(
-                token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-            )
-            sub: str = payload.get(by)
-        except jwt.exceptions.DecodeError:
-            logger.debug("JWT processing decode error: invalid token")
-            raise HTTPException(status_code=401, detail="Invalid token")
-        except jwt.exceptions.ExpiredSignatureError:
-            logger.debug("JWT processing error: expired token")
-            raise HTTPException(status_code=401, detail="Token has expired")
-        except jwt.exceptions.PyJWTError:
-            logger.debug("JWT processing error")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
-            )
-        user = (
-            await user_repo.get_user_by_username(username=sub)
-            if by == "username"
-            else await user_repo.get_user_by_email(email=sub)
+class TokenPrincipal:
+    """Authenticated user built from verified JWT claims.
+
+    Carries the fields permission checks need; the ORM ``User`` is only
+    loaded when an endpoint asks for it through ``get_user``.
+    """
+
+    def __init__(self, claims: JwtRequest, user_repo: BaseUserRepository):
+        self.id = uuid.UUID(claims.user_id)
+        self.username = claims.username
+        self.role = claims.role
+        self.is_blocked = claims.is_blocked
+        self.group_id = claims.group_id
+        self._user_repo = user_repo
+        self._user: Optional[User] = None
+
+    async def get_user(self) -> User:
+        if self._user is None:
+            self._user = await self._user_repo.get_user_by_id(self.id)
+            if self._user is None:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid credentials",
+                )
+        return self._user
+
+
+async def get_current_user(
+    token: str = Header(),
+    user_repo: BaseUserRepository = Depends(get_base_user_repository),
+) -> User | TokenPrincipal:
+    if settings.AUTH_STATELESS_MODE:
+        return await get_principal_from_token(token, user_repo)
+    return await get_user_from_token(token, user_repo)
+
+
+def decode_token(token: str) -> dict:
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except jwt.exceptions.DecodeError:
+        logger.debug("JWT processing decode error: invalid token")
+        raise HTTPException(status_code=401, detail="Invalid token")
+    except jwt.exceptions.ExpiredSignatureError:
+        logger.debug("JWT processing error: expired token")
+        raise HTTPException(status_code=401, detail="Token has expired")
+    except jwt.exceptions.PyJWTError:
+        logger.debug("JWT processing error")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
         )
-        if user is None:
-            logger.debug("JWT credentials error: user not found")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
-            )
-        return user
 
 
-def admin_permission(user_id: str, user: User):
+async def check_token_revocation(
+    token: str, payload: dict, user_repo: BaseUserRepository
+):
+    token_epoch = None
+    if "token_epoch" in payload and "user_id" in payload:
+        is_blacklisted, token_epoch = await user_repo.get_token_status(
+            token, payload, payload["user_id"]
+        )
+    else:
+        is_blacklisted = await user_repo.check_if_token_is_blacklisted(token, payload)
+    if is_blacklisted:
+        raise HTTPException(status_code=401, detail="Token is blacklisted")
+    if token_epoch is not None and payload["token_epoch"] != token_epoch:
+        logger.debug(f"JWT credentials error: stale epoch for {payload['user_id']}")
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+
+
+async def get_user_from_token(
+    token: str, user_repo: BaseUserRepository, by: str = "username"
+) -> User:
+    payload = decode_token(token)
+    await check_token_revocation(token, payload, user_repo)
+    sub: str = payload.get(by)
+    user = (
+        await user_repo.get_user_by_username(username=sub)
+        if by == "username"
+        else await user_repo.get_user_by_email(email=sub)
+    )
+    if user is None:
+        logger.debug("JWT credentials error: user not found")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
+        )
+    return user
+
+
+async def get_principal_from_token(
+    token: str, user_repo: BaseUserRepository
+) -> User | TokenPrincipal:
+    payload = decode_token(token)
+    if "token_epoch" not in payload:
+        # Issued before claims carried an epoch; validate against the database.
+        return await get_user_from_token(token, user_repo)
+    try:
+        claims = JwtRequest(**payload)
+    except ValidationError:
+        logger.debug("JWT credentials error: malformed claims")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
+        )
+    await check_token_revocation(token, payload, user_repo)
+    return TokenPrincipal(claims, user_repo)
+
+
+def admin_permission(user_id: str, user: User, user_repo: BaseUserRepository):
     if user.role != "ADMIN":
         raise HTTPException(
             status_code=401,
@@ -57,7 +132,7 @@ def admin_permission(user_id: str, user: User):
         )
 
 
-def moderator_permission(user_id: str, user: User):
+def moderator_permission(user_id: str, user: User, user_repo: BaseUserRepository):
     if user.role != "MODERATOR":
         raise HTTPException(
             status_code=401,
@@ -65,9 +140,10 @@ def moderator_permission(user_id: str, user: User):
         )
 
 
-async def moderator_group_permission(user_id: str, user: User):
-    async with create_base_user_repository() as user_repo:
-        user_info = await user_repo.get_user_by_id(user_id=user_id)
+async def moderator_group_permission(
+    user_id: str, user: User, user_repo: BaseUserRepository
+):
+    user_info = await user_repo.get_user_by_id(user_id=user_id)
 
     if (
         user.role != "MODERATOR"
@@ -85,15 +161,18 @@ def has_any_permission(permissions: List[callable]):
         @wraps(func)
         async def wrapper(*args, **kwargs):
             user_id, user = kwargs.get("user_id"), kwargs.get("user")
+            user_repo = kwargs.get("user_repo")
             for permission in permissions:
                 try:
                     if inspect.iscoroutinefunction(permission):
-                        await permission(user_id, user)
+                        await permission(user_id, user, user_repo)
                     else:
-                        permission(user_id, user)
-                    return await func(*args, **kwargs)
+                        permission(user_id, user, user_repo)
                 except HTTPException:
                     continue
+                # Outside the try, so the endpoint's own errors reach the
+                # client instead of turning into "Access denied".
+                return await func(*args, **kwargs)
 
             raise HTTPException(
                 status_code=403,
@@ -1,13 +1,28 @@
+import asyncio
+
 import pytest
 from httpx import AsyncClient
 
+from src import repository, utils
+from src.auth import blacklist
+from src.auth import service as auth_service
+from src.auth.blacklist import (
+    BLACKLIST_CHANNEL,
+    TOKEN_EPOCH_MESSAGE_PREFIX,
+    BlacklistCache,
+    blacklist_cache,
+    blacklist_key,
+)
+from src.database import get_redis
 from src.main import app
+from src.repository import create_base_user_repository
 from tests.fixtures import (
     LOGIN_URL,
     REFRESH_TOKEN_URL,
     SIGNUP_URL,
     client_base_url,
     create_user,
+    get_user_by_token,
     refresh_user,
     user_login_data,
     user_signup_data,
@@ -42,6 +57,39 @@ async def test_duplicate_identifiers_signup(
     assert response.status_code == 409
 
 
+@pytest.mark.asyncio
+async def test_concurrent_duplicate_signup(user_signup_data, truncate_tables):
+    await truncate_tables
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        responses = await asyncio.gather(
+            *(client.post(SIGNUP_URL, json=user_signup_data) for _ in range(2))
+        )
+    assert sorted(response.status_code for response in responses) == [200, 409]
+    conflict = next(response for response in responses if response.status_code == 409)
+    assert conflict.json()["message"] in (
+        f"User with username '{user_signup_data['username']}' already exists",
+        f"User with email '{user_signup_data['email']}' already exists",
+    )
+
+
+@pytest.mark.asyncio
+async def test_signup_without_availability_filters(
+    user_signup_data, truncate_tables, monkeypatch
+):
+    await truncate_tables
+
+    async def redis_is_down(*args, **kwargs):
+        raise ConnectionError("Redis is unavailable")
+
+    monkeypatch.setattr(repository, "might_be_taken", redis_is_down)
+    monkeypatch.setattr(repository, "mark_taken", redis_is_down)
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        created = await client.post(SIGNUP_URL, json=user_signup_data)
+        duplicate = await client.post(SIGNUP_URL, json=user_signup_data)
+    assert created.status_code == 200
+    assert duplicate.status_code == 409
+
+
 @pytest.mark.asyncio
 async def test_successful_user_login(user_login_data, truncate_tables, create_user):
     await truncate_tables
@@ -105,10 +153,147 @@ async def test_invalid_refresh_token(truncate_tables, create_user):
 @pytest.mark.asyncio
 async def test_blacklisted_refresh_token(truncate_tables, refresh_user):
     await truncate_tables
-    old_refresh_token = (await refresh_user)[1]
+    old_refresh_token = (await refresh_user)[0]
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.post(
             REFRESH_TOKEN_URL,
             headers={"token": old_refresh_token},
         )
     assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_stateless_mode_rejects_token_after_epoch_bump(
+    truncate_tables, create_user, monkeypatch
+):
+    await truncate_tables
+    access_token = (await create_user)[0]
+    monkeypatch.setattr(utils.settings, "AUTH_STATELESS_MODE", True)
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.get("/users/me/", headers={"token": access_token})
+        assert response.status_code == 200
+        user = await get_user_by_token(access_token)
+        async with create_base_user_repository() as user_repo:
+            await user_repo.bump_token_epoch(user.id)
+        response = await client.get("/users/me/", headers={"token": access_token})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_cached_epoch_follows_bumps_from_other_instances(
+    truncate_tables, create_user, monkeypatch
+):
+    await truncate_tables
+    access_token = (await create_user)[0]
+    user = await get_user_by_token(access_token)
+    monkeypatch.setattr(utils.settings, "AUTH_STATELESS_MODE", True)
+    blacklist_cache.start()
+    try:
+        while not blacklist_cache.ready:
+            await asyncio.sleep(0.05)
+        epoch_hits = blacklist_cache.epoch_hits
+        async with AsyncClient(app=app, base_url=client_base_url) as client:
+            for _ in range(2):
+                response = await client.get(
+                    "/users/me/", headers={"token": access_token}
+                )
+                assert response.status_code == 200
+            assert blacklist_cache.epoch_hits == epoch_hits + 1
+            # Bumped by another instance, so only the published message tells
+            # this one about it.
+            async with get_redis() as redis:
+                bump = redis.register_script(repository.BUMP_TOKEN_EPOCHS_SCRIPT)
+                await bump(
+                    keys=[repository.TOKEN_EPOCHS_KEY],
+                    args=[BLACKLIST_CHANNEL, TOKEN_EPOCH_MESSAGE_PREFIX, str(user.id)],
+                )
+            for _ in range(50):
+                response = await client.get(
+                    "/users/me/", headers={"token": access_token}
+                )
+                if response.status_code == 401:
+                    break
+                await asyncio.sleep(0.1)
+    finally:
+        await blacklist_cache.stop()
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_blacklist_cache_listens_while_rebuilding(monkeypatch):
+    monkeypatch.setattr(blacklist.settings, "BLACKLIST_CACHE_REBUILD_SECONDS", 0)
+    cache = BlacklistCache()
+    rebuilds = []
+    release = asyncio.Event()
+    rebuild = cache.rebuild
+
+    async def slow_rebuild():
+        rebuilds.append(1)
+        if len(rebuilds) > 1:
+            await release.wait()
+        await rebuild()
+
+    monkeypatch.setattr(cache, "rebuild", slow_rebuild)
+    key = blacklist_key("revoked during a rebuild")
+    cache.start()
+    try:
+        while len(rebuilds) < 2:
+            await asyncio.sleep(0.05)
+        async with get_redis() as redis:
+            await redis.publish(BLACKLIST_CHANNEL, key)
+        for _ in range(50):
+            if cache.might_contain([key]):
+                break
+            await asyncio.sleep(0.1)
+        assert cache.ready
+        assert cache.might_contain([key])
+    finally:
+        release.set()
+        await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_replay_revokes_family(truncate_tables, refresh_user):
+    await truncate_tables
+    old_refresh_token, new_refresh_token = await refresh_user
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        replay_response = await client.post(
+            REFRESH_TOKEN_URL, headers={"token": old_refresh_token}
+        )
+        family_response = await client.post(
+            REFRESH_TOKEN_URL, headers={"token": new_refresh_token}
+        )
+    assert replay_response.status_code == 401
+    assert family_response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_logout_all_revokes_issued_tokens(truncate_tables, create_user):
+    await truncate_tables
+    access_token, refresh_token = await create_user
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        logout_response = await client.post(
+            "/auth/logout-all/", headers={"token": access_token}
+        )
+        me_response = await client.get("/users/me/", headers={"token": access_token})
+        refresh_response = await client.post(
+            REFRESH_TOKEN_URL, headers={"token": refresh_token}
+        )
+    assert logout_response.status_code == 200
+    assert me_response.status_code == 401
+    assert refresh_response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_password_with_configured_cost(
+    user_login_data, truncate_tables, create_user, monkeypatch
+):
+    await truncate_tables
+    access_token = (await create_user)[0]
+    monkeypatch.setattr(auth_service.settings, "BCRYPT_ROUNDS", 4)
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.post(LOGIN_URL, data=user_login_data)
+    await asyncio.gather(*auth_service._background_tasks)
+    user = await get_user_by_token(access_token)
+    assert response.status_code == 200
+    assert user.hashed_password.startswith("$2b$04$")
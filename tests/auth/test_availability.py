@@ -0,0 +1,42 @@
+import pytest
+from httpx import AsyncClient
+
+from src.availability import rebuild_availability_filters
+from src.main import app
+from tests.fixtures import SIGNUP_URL, client_base_url, create_user, user_signup_data
+
+AVAILABILITY_URL = "/auth/availability/"
+
+
+@pytest.mark.asyncio
+async def test_availability_reports_taken_values(
+    user_signup_data, truncate_tables, create_user
+):
+    await truncate_tables
+    await create_user
+    await rebuild_availability_filters()
+    params = {"username": user_signup_data["username"], "email": "free@gmail.com"}
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.get(AVAILABILITY_URL, params=params)
+    assert response.status_code == 200
+    assert response.json() == {"username": False, "email": True}
+
+
+@pytest.mark.asyncio
+async def test_availability_tracks_new_signups(user_signup_data, truncate_tables):
+    await truncate_tables
+    await rebuild_availability_filters()
+    params = {"email": user_signup_data["email"]}
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        before = await client.get(AVAILABILITY_URL, params=params)
+        await client.post(SIGNUP_URL, json=user_signup_data)
+        after = await client.get(AVAILABILITY_URL, params=params)
+    assert before.json() == {"email": True}
+    assert after.json() == {"email": False}
+
+
+@pytest.mark.asyncio
+async def test_availability_requires_a_value():
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.get(AVAILABILITY_URL)
+    assert response.status_code == 400
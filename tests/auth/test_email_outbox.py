@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+
+from src.aws import email_outbox
+from src.aws.email_outbox import (
+    EMAIL_DEAD_LETTER_STREAM,
+    EMAIL_OUTBOX_GROUP,
+    EMAIL_OUTBOX_STREAM,
+    EmailOutboxWorker,
+    enqueue_email,
+)
+from src.database import get_redis
+from src.main import app
+from tests.fixtures import (
+    RESET_PASSWORD_REQUEST_URL,
+    FakeSESEmailService,
+    client_base_url,
+    create_user,
+    user_signup_data,
+)
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(email_outbox.settings, "EMAIL_OUTBOX_RETRY_BASE_SECONDS", 0)
+    monkeypatch.setattr(
+        email_outbox.settings, "EMAIL_OUTBOX_SEND_TIMEOUT_SECONDS", 0.05
+    )
+
+
+async def deliver_elsewhere(redis, count=None):
+    """Read new messages as another instance would, return their ids."""
+    response = await redis.xreadgroup(
+        EMAIL_OUTBOX_GROUP, "other", {EMAIL_OUTBOX_STREAM: ">"}, count=count
+    )
+    return [message_id for message_id, _ in response[0][1]]
+
+
+async def redeliver_elsewhere(redis, message_ids):
+    await redis.xclaim(
+        EMAIL_OUTBOX_STREAM,
+        EMAIL_OUTBOX_GROUP,
+        "other",
+        min_idle_time=0,
+        message_ids=message_ids,
+    )
+
+
+@pytest.fixture
+@pytest.mark.asyncio
+async def clear_email_outbox():
+    async with get_redis() as redis:
+        await redis.delete(EMAIL_OUTBOX_STREAM, EMAIL_DEAD_LETTER_STREAM)
+        await EmailOutboxWorker().ensure_group(redis)
+
+
+@pytest.mark.asyncio
+async def test_reset_password_request_only_enqueues_email(
+    truncate_tables, user_signup_data, create_user, clear_email_outbox
+):
+    await truncate_tables
+    await create_user
+    await clear_email_outbox
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.post(
+            RESET_PASSWORD_REQUEST_URL, json={"email": user_signup_data.get("email")}
+        )
+    assert response.status_code == 200
+    async with get_redis() as redis:
+        [(_, fields)] = await redis.xrange(EMAIL_OUTBOX_STREAM)
+    assert fields["recipient"] == user_signup_data.get("email")
+    assert fields["body"] == response.json()["reset_link"]
+
+
+@pytest.mark.asyncio
+async def test_worker_sends_batch_and_verifies_sender_once(clear_email_outbox):
+    await clear_email_outbox
+    async with get_redis() as redis:
+        for i in range(3):
+            await enqueue_email(
+                redis, "Subject", f"body {i}", "sender@example.com", f"{i}@gmail.com"
+            )
+        ses = FakeSESEmailService()
+        worker = EmailOutboxWorker(consumer_name="test")
+        assert await worker.process(redis, ses) == 3
+        assert ses.verified == ["sender@example.com"]
+        assert sorted(email["recipient"] for email in ses.sent) == [
+            "0@gmail.com",
+            "1@gmail.com",
+            "2@gmail.com",
+        ]
+        assert await redis.xlen(EMAIL_OUTBOX_STREAM) == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_then_dead_letters(
+    clear_email_outbox, fast_retries, monkeypatch
+):
+    monkeypatch.setattr(email_outbox.settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 3)
+    await clear_email_outbox
+    async with get_redis() as redis:
+        await enqueue_email(
+            redis, "Subject", "body", "sender@example.com", "a@gmail.com"
+        )
+        await enqueue_email(
+            redis, "Subject", "body", "sender@example.com", "b@gmail.com"
+        )
+        ses = FakeSESEmailService(failures=5)
+        worker = EmailOutboxWorker(consumer_name="test")
+        for _ in range(3):
+            await worker.process(redis, ses)
+            await asyncio.sleep(0.1)
+        assert [email["recipient"] for email in ses.sent] == ["b@gmail.com"]
+        await worker.process(redis, ses)
+        assert worker.dead_lettered == 1
+        [(_, fields)] = await redis.xrange(EMAIL_DEAD_LETTER_STREAM)
+        assert fields["recipient"] == "a@gmail.com"
+        assert await redis.xlen(EMAIL_OUTBOX_STREAM) == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_pages_through_pending_retries(
+    clear_email_outbox, fast_retries, monkeypatch
+):
+    monkeypatch.setattr(email_outbox.settings, "EMAIL_OUTBOX_BATCH_SIZE", 2)
+    await clear_email_outbox
+    async with get_redis() as redis:
+        for recipient in ("a", "b", "c", "d"):
+            await enqueue_email(
+                redis, "Subject", "body", "sender@example.com", f"{recipient}@gmail.com"
+            )
+        message_ids = await deliver_elsewhere(redis)
+        await asyncio.sleep(0.1)
+        # Another instance is still sending the first page.
+        await redeliver_elsewhere(redis, message_ids[:2])
+        ses = FakeSESEmailService()
+        worker = EmailOutboxWorker(consumer_name="test")
+        assert await worker.process(redis, ses) == 0
+        assert await worker.process(redis, ses) == 2
+        assert sorted(email["recipient"] for email in ses.sent) == [
+            "c@gmail.com",
+            "d@gmail.com",
+        ]
+
+
+@pytest.mark.asyncio
+async def test_worker_claims_each_retry_after_its_own_delay(
+    clear_email_outbox, fast_retries, monkeypatch
+):
+    monkeypatch.setattr(email_outbox.settings, "EMAIL_OUTBOX_RETRY_BASE_SECONDS", 0.2)
+    await clear_email_outbox
+    async with get_redis() as redis:
+        for recipient in ("a", "b"):
+            await enqueue_email(
+                redis, "Subject", "body", "sender@example.com", f"{recipient}@gmail.com"
+            )
+        message_ids = await deliver_elsewhere(redis)
+        for _ in range(2):
+            await redeliver_elsewhere(redis, message_ids[1:])
+        await asyncio.sleep(0.3)
+        ses = FakeSESEmailService()
+        worker = EmailOutboxWorker(consumer_name="test")
+        assert await worker.process(redis, ses) == 1
+        assert [email["recipient"] for email in ses.sent] == ["a@gmail.com"]
+
+
+@pytest.mark.asyncio
+async def test_worker_dead_letters_only_idle_messages(
+    clear_email_outbox, fast_retries, monkeypatch
+):
+    monkeypatch.setattr(email_outbox.settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 1)
+    await clear_email_outbox
+    async with get_redis() as redis:
+        await enqueue_email(
+            redis, "Subject", "body", "sender@example.com", "a@gmail.com"
+        )
+        await deliver_elsewhere(redis)
+        worker = EmailOutboxWorker(consumer_name="test")
+        await worker.process(redis, FakeSESEmailService())
+        assert worker.dead_lettered == 0
+        await asyncio.sleep(0.1)
+        await worker.process(redis, FakeSESEmailService())
+        assert worker.dead_lettered == 1
+        assert await redis.xlen(EMAIL_OUTBOX_STREAM) == 0
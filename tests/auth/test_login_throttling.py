@@ -0,0 +1,41 @@
+import pytest
+from httpx import AsyncClient
+
+from src.auth.rate_limit import check_rate_limit
+from src.main import app
+from src.settings import Settings
+from tests.fixtures import LOGIN_URL, client_base_url, user_login_data
+
+settings = Settings()
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_blocks_after_capacity(fake_rate_limit_redis):
+    limits = {"login_rl:user:adam_smith": (3, 60), "login_rl:ip:127.0.0.1": (10, 60)}
+    results = [await check_rate_limit(fake_rate_limit_redis, limits) for _ in range(4)]
+    assert results[:3] == [0, 0, 0]
+    assert 0 < results[3] <= 20000
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_rejected_attempt_consumes_nothing(fake_rate_limit_redis):
+    user_key, ip_key = "login_rl:user:adam_smith", "login_rl:ip:127.0.0.1"
+    assert await check_rate_limit(fake_rate_limit_redis, {user_key: (1, 60)}) == 0
+    assert await check_rate_limit(
+        fake_rate_limit_redis, {user_key: (1, 60), ip_key: (1, 60)}
+    )
+    assert await check_rate_limit(fake_rate_limit_redis, {ip_key: (1, 60)}) == 0
+
+
+@pytest.mark.asyncio
+async def test_login_throttled_before_authentication(truncate_tables, user_login_data):
+    await truncate_tables
+    attempts = settings.LOGIN_RATE_LIMIT_USERNAME_ATTEMPTS
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        responses = [
+            await client.post(LOGIN_URL, data=user_login_data)
+            for _ in range(attempts + 1)
+        ]
+    assert [response.status_code for response in responses[:-1]] == [401] * attempts
+    assert responses[-1].status_code == 429
+    assert "Retry-After" in responses[-1].headers
@@ -1,11 +1,14 @@
 import asyncio
 from typing import Generator
 
+import fakeredis.aioredis
 import pytest
 
+from src.auth.rate_limit import get_rate_limit_redis
 from src.aws.email_service import SESEmailService
 from src.aws.user_image_service import S3UserImageService
 from src.database import engine
+from src.main import app
 from src.models import Base
 
 
@@ -24,3 +27,11 @@ async def truncate_tables():
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
     await engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def fake_rate_limit_redis():
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    app.dependency_overrides[get_rate_limit_redis] = lambda: redis
+    yield redis
+    app.dependency_overrides.pop(get_rate_limit_redis, None)
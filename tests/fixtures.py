@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 import pytest
@@ -7,7 +8,8 @@ from src.auth.schemas import UserLogin, UserSignup
 from src.database import create_async_session
 from src.main import app
 from src.models import Group, User
-from src.utils import get_current_user
+from src.repository import create_base_user_repository
+from src.utils import get_user_from_token
 
 client_base_url = "http://test"
 
@@ -18,6 +20,35 @@ RESET_PASSWORD_REQUEST_URL = "/auth/reset-password-request/"
 RESET_PASSWORD_URL = "/auth/reset-password/"
 
 
+class FakeSESEmailService:
+    """In-memory stand-in for SESEmailService that fails the first sends."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.verified = []
+        self.sent = []
+
+    @asynccontextmanager
+    async def connect(self):
+        yield self
+
+    async def verify_email(self, email):
+        self.verified.append(email)
+
+    async def send_email(self, subject, body, sender, recipient):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("SES is unavailable")
+        self.sent.append(
+            {"subject": subject, "body": body, "sender": sender, "recipient": recipient}
+        )
+
+
+async def get_user_by_token(token: str) -> User:
+    async with create_base_user_repository() as user_repo:
+        return await get_user_from_token(token, user_repo)
+
+
 @pytest.fixture
 def user_signup_data():
     return UserSignup(
@@ -78,7 +109,7 @@ async def create_user_and_admin(create_user):
             ).model_dump(),
         )
     admin_access_token = response.json().get("access_token")
-    admin = await get_current_user(admin_access_token)
+    admin = await get_user_by_token(admin_access_token)
     async with create_async_session() as conn:
         admin = await conn.get(User, admin.id)
         admin.role = "ADMIN"
@@ -98,8 +129,8 @@ async def create_user_and_moderator_from_the_same_group(create_user):
             ).model_dump(),
         )
     access_token = response.json().get("access_token")
-    user = await get_current_user(user_access_token)
-    moderator = await get_current_user(access_token)
+    user = await get_user_by_token(user_access_token)
+    moderator = await get_user_by_token(access_token)
     async with create_async_session() as conn:
         group = Group(name="first_group", created_at=datetime.utcnow())
         conn.add(group)
@@ -122,7 +153,7 @@ async def create_user_and_moderator_from_diff_group(
         moderator_access_token,
         user_access_token,
     ) = await create_user_and_moderator_from_the_same_group
-    moderator = await get_current_user(moderator_access_token)
+    moderator = await get_user_by_token(moderator_access_token)
     async with create_async_session() as conn:
         group = Group(name="second_group", created_at=datetime.utcnow())
         conn.add(group)
@@ -0,0 +1,24 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from src.main import app
+from src.settings import Settings
+
+client = TestClient(app)
+settings = Settings()
+
+METRICS_URLS = [
+    "/metrics/redis-pool/",
+    "/metrics/blacklist-cache/",
+    "/metrics/email-outbox/",
+    "/metrics/avatar-cache/",
+    "/metrics/s3/",
+]
+
+
+@pytest.mark.parametrize("url", METRICS_URLS)
+def test_metrics_require_api_key(url):
+    assert client.get(url).status_code == 422
+    assert client.get(url, headers={"api-key": "wrong"}).status_code == 403
+    response = client.get(url, headers={"api-key": settings.INNOTTER_API_KEY})
+    assert response.status_code == 200
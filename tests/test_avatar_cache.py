@@ -0,0 +1,35 @@
+from src.aws.avatar_cache import AvatarLRUCache, etag_matches
+
+
+def test_avatar_lru_cache_evicts_by_size():
+    cache = AvatarLRUCache(max_bytes=10)
+    cache.put("a", b"1234", "image/png")
+    cache.put("b", b"5678", "image/png")
+    assert cache.get("a") == (b"1234", "image/png")
+    cache.put("c", b"90ab", "image/png")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.size == 8
+    assert cache.evictions == 1
+    cache.put("huge", b"x" * 11, "image/png")
+    assert cache.get("huge") is None
+    assert cache.size == 8
+
+
+def test_avatar_lru_cache_discard():
+    cache = AvatarLRUCache(max_bytes=10)
+    cache.put("a", b"1234", None)
+    cache.put("a", b"12", None)
+    assert cache.size == 2
+    cache.discard("a")
+    cache.discard("missing")
+    assert cache.size == 0
+    assert len(cache) == 0
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"x"', '"abc"')
+    assert not etag_matches(None, '"abc"')
@@ -0,0 +1,49 @@
+import pytest
+from httpx import AsyncClient
+
+from src.avatar_purge import sweep_orphan_avatars
+from src.aws.user_image_service import S3UserImageService, s3_client
+from src.main import app
+from tests.fixtures import client_base_url, create_user, user_signup_data
+
+USERS_ME_URL = "/users/me/"
+
+
+async def bucket_keys():
+    s3 = await s3_client.get()
+    response = await s3.list_objects_v2(Bucket=S3UserImageService.BUCKET)
+    return {obj["Key"] for obj in response.get("Contents", [])}
+
+
+@pytest.mark.asyncio
+async def test_sweep_deletes_only_unreferenced_avatars(truncate_tables, create_user):
+    await truncate_tables
+    access_token = (await create_user)[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.patch(
+            USERS_ME_URL,
+            headers={"token": access_token},
+            files={
+                "avatar": (
+                    "filename.jpg",
+                    open("tests/test_files/test_avatar.jpg", "rb"),
+                    "image/jpeg",
+                )
+            },
+        )
+    avatar_path = response.json()["image_s3_path"]
+    s3 = await s3_client.get()
+    for key in ("avatars/deleted-user/1/original", "avatars/deleted-user/1/64"):
+        await s3.put_object(Bucket=S3UserImageService.BUCKET, Key=key, Body=b"x")
+
+    stats = await sweep_orphan_avatars(grace_seconds=3600)
+    assert stats.deleted == 0
+
+    stats = await sweep_orphan_avatars(grace_seconds=0, dry_run=True)
+    assert stats.would_delete == 2
+    assert stats.deleted == 0
+
+    stats = await sweep_orphan_avatars(grace_seconds=0)
+    assert stats.deleted == 2
+    base = avatar_path.rpartition("/")[0]
+    assert await bucket_keys() == {f"{base}/original", f"{base}/256", f"{base}/64"}
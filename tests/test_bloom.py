@@ -0,0 +1,55 @@
+import fakeredis.aioredis
+import pytest
+
+from src.bloom import BloomFilter, RedisBloomFilter, bloom_parameters
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    values = [f"token-{i}" for i in range(1000)]
+    for value in values:
+        bloom.add(value)
+    assert all(value in bloom for value in values)
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"token-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_parameters():
+    size, hash_count = bloom_parameters(1_000_000, 0.001)
+    assert 14_000_000 < size < 15_000_000
+    assert hash_count == 10
+
+
+@pytest.mark.asyncio
+async def test_redis_bloom_filter_batches_on_a_pipeline():
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    bloom = RedisBloomFilter("bloom:test", capacity=1000, error_rate=0.01)
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(100):
+            await bloom.add(pipe, f"user-{i}")
+        await pipe.execute()
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(100):
+            await bloom.contains(pipe, f"user-{i}")
+        assert all(await pipe.execute())
+    assert not await bloom.contains(redis, "someone-else")
+
+
+@pytest.mark.asyncio
+async def test_redis_bloom_filter_only_writes_existing_extra_keys():
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    bloom = RedisBloomFilter("bloom:test", capacity=1000, error_rate=0.01)
+    await bloom.add(redis, "first", also_to=["bloom:building"])
+    assert not await redis.exists("bloom:building")
+    await redis.setbit("bloom:building", 0, 0)
+    await bloom.add(redis, "second", also_to=["bloom:building"])
+    building = RedisBloomFilter("bloom:building", capacity=1000, error_rate=0.01)
+    assert await building.contains(redis, "second")
+    assert not await building.contains(redis, "first")
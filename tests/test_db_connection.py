@@ -2,7 +2,7 @@ import pytest
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database import create_async_session, get_redis
+from src.database import create_async_session, get_redis, get_redis_pool
 
 
 @pytest.mark.asyncio
@@ -18,3 +18,14 @@ async def test_db_connection():
 async def test_redis_connection():
     async with get_redis() as redis:
         assert await redis.ping()
+
+
+@pytest.mark.asyncio
+async def test_redis_clients_share_pool():
+    async with get_redis() as first, get_redis() as second:
+        assert first.connection_pool is second.connection_pool
+        await first.ping()
+        await second.ping()
+    stats = get_redis_pool().stats()
+    assert stats["in_use"] == 0
+    assert stats["idle"] == stats["created"]
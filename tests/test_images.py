@@ -0,0 +1,57 @@
+import io
+
+import pytest
+from PIL import Image
+
+from src.images import AvatarSize, InvalidImageError, render_avatar, sized_avatar_path
+
+
+def image_bytes(mode, size, image_format):
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def image_file(tmp_path, content):
+    path = tmp_path / "avatar"
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_render_avatar_detects_type_and_renders_thumbnails(tmp_path):
+    content_type, thumbnails = render_avatar(
+        image_file(tmp_path, image_bytes("RGB", (1000, 500), "JPEG"))
+    )
+    assert content_type == "image/jpeg"
+    assert AvatarSize.ORIGINAL not in thumbnails
+    for size, expected in (
+        (AvatarSize.MEDIUM, (256, 128)),
+        (AvatarSize.SMALL, (64, 32)),
+    ):
+        data, thumbnail_type = thumbnails[size]
+        assert thumbnail_type == "image/webp"
+        assert Image.open(io.BytesIO(data)).size == expected
+
+
+def test_render_avatar_keeps_transparency(tmp_path):
+    _, thumbnails = render_avatar(
+        image_file(tmp_path, image_bytes("RGBA", (300, 300), "PNG"))
+    )
+    assert Image.open(io.BytesIO(thumbnails[AvatarSize.SMALL][0])).mode == "RGBA"
+
+
+@pytest.mark.parametrize(
+    "content",
+    [b"not an image", image_bytes("RGB", (10, 10), "BMP")],
+)
+def test_render_avatar_rejects_invalid_images(tmp_path, content):
+    with pytest.raises(InvalidImageError):
+        render_avatar(image_file(tmp_path, content))
+
+
+def test_sized_avatar_path():
+    assert sized_avatar_path("avatars/1/original", AvatarSize.SMALL) == "avatars/1/64"
+    assert sized_avatar_path("avatars/1/original", AvatarSize.ORIGINAL) == (
+        "avatars/1/original"
+    )
+    assert sized_avatar_path("avatars/1", AvatarSize.SMALL) == "avatars/1"
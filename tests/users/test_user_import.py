@@ -0,0 +1,109 @@
+import io
+
+import pytest
+from httpx import AsyncClient
+
+from src.main import app
+from src.users.bulk_import import ImportFormat, ImportStats, read_rows, validate_row
+from tests.fixtures import (
+    LOGIN_URL,
+    client_base_url,
+    create_user,
+    create_user_and_admin,
+    create_user_and_moderator_from_the_same_group,
+    get_user_by_token,
+    user_signup_data,
+)
+
+USERS_IMPORT_URL = "/users/import/"
+GROUPS_URL = "/groups/"
+
+USERS_CSV = (
+    "username,email,password,name,phone_number\n"
+    "jane,jane@example.com,secret,Jane,+100\n"
+    "adam_smith,other@example.com,secret,,\n"
+    "john,jane@example.com,secret,,\n"
+    "kate,not-an-email,secret,,\n"
+    "mike,mike@example.com,secret,Mike,\n"
+)
+
+
+def test_read_rows_numbers_lines():
+    rows = list(
+        read_rows(
+            io.BytesIO(b'{"username": "a"}\n\n[1]\nnot json\n'), ImportFormat.JSONL
+        )
+    )
+    assert rows == [(1, {"username": "a"}), (3, None), (4, None)]
+
+    stats = ImportStats()
+    assert validate_row(3, None, stats) is None
+    assert (
+        validate_row(1, {"username": "a", "email": "", "password": "p"}, stats) is None
+    )
+    assert [(error["line"], error["field"]) for error in stats.errors] == [
+        (3, None),
+        (1, "email"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_import_users_requires_admin(
+    truncate_tables, create_user_and_moderator_from_the_same_group
+):
+    await truncate_tables
+    moderator_access_token = (await create_user_and_moderator_from_the_same_group)[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.post(
+            USERS_IMPORT_URL,
+            headers={"token": moderator_access_token},
+            files={"file": ("users.csv", USERS_CSV, "text/csv")},
+        )
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_import_users_reports_conflicts(truncate_tables, create_user_and_admin):
+    await truncate_tables
+    admin_access_token = (await create_user_and_admin)[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        group = await client.post(
+            GROUPS_URL, headers={"token": admin_access_token}, json={"name": "tenant"}
+        )
+        response = await client.post(
+            USERS_IMPORT_URL,
+            headers={"token": admin_access_token},
+            params={"group_id": group.json()["id"]},
+            files={"file": ("users.csv", USERS_CSV, "text/csv")},
+        )
+        login = await client.post(
+            LOGIN_URL, data={"username": "jane", "password": "secret"}
+        )
+    assert response.status_code == 200
+    report = response.json()
+    assert report["rows"] == 5
+    assert report["imported"] == 2
+    assert report["rejected"] == 3
+    assert [(error["line"], error["field"]) for error in report["errors"]] == [
+        (5, "email"),
+        (3, "username"),
+        (4, "email"),
+    ]
+    assert login.status_code == 200
+    jane = await get_user_by_token(login.json()["access_token"])
+    assert (jane.name, jane.phone_number, jane.role) == ("Jane", "+100", "USER")
+    assert jane.group_id == group.json()["id"]
+
+
+@pytest.mark.asyncio
+async def test_import_users_into_unknown_group(truncate_tables, create_user_and_admin):
+    await truncate_tables
+    admin_access_token = (await create_user_and_admin)[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.post(
+            USERS_IMPORT_URL,
+            headers={"token": admin_access_token},
+            params={"group_id": 12345},
+            files={"file": ("users.csv", USERS_CSV, "text/csv")},
+        )
+    assert response.status_code == 404
@@ -1,15 +1,22 @@
+import asyncio
+import uuid
+from datetime import datetime
+
 import pytest
 from httpx import AsyncClient
 
 from src.main import app
+from src.models import User
+from src.users import service as users_service
 from src.users.schemas import UserData
-from src.utils import get_current_user
+from src.users.service import UserService
 from tests.fixtures import (
     client_base_url,
     create_user,
     create_user_and_admin,
     create_user_and_moderator_from_diff_group,
     create_user_and_moderator_from_the_same_group,
+    get_user_by_token,
     user_signup_data,
 )
 
@@ -26,7 +33,7 @@ async def test_successful_get_user(tokens_fixture, truncate_tables, request):
     admin_access_token, user_access_token = await request.getfixturevalue(
         tokens_fixture
     )
-    user = await get_current_user(user_access_token)
+    user = await get_user_by_token(user_access_token)
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.get(
             f"{USERS_URL}/{user.id}/", headers={"token": admin_access_token}
@@ -44,7 +51,7 @@ async def test_successful_get_user(tokens_fixture, truncate_tables, request):
 async def test_successful_patch_user(truncate_tables, create_user_and_admin):
     await truncate_tables
     admin_access_token, user_access_token = await create_user_and_admin
-    user = await get_current_user(user_access_token)
+    user = await get_user_by_token(user_access_token)
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.patch(
             f"{USERS_URL}/{user.id}/", headers={"token": admin_access_token}, params={}
@@ -72,7 +79,7 @@ async def test_no_permissions_patch_user(tokens_fixture, truncate_tables, reques
     admin_access_token, user_access_token = await request.getfixturevalue(
         tokens_fixture
     )
-    user = await get_current_user(user_access_token)
+    user = await get_user_by_token(user_access_token)
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.patch(
             f"{USERS_URL}/{user.id}/", headers={"token": admin_access_token}, params={}
@@ -84,7 +91,7 @@ async def test_no_permissions_patch_user(tokens_fixture, truncate_tables, reques
 async def test_successful_delete_user(truncate_tables, create_user_and_admin):
     await truncate_tables
     admin_access_token, user_access_token = await create_user_and_admin
-    user = await get_current_user(user_access_token)
+    user = await get_user_by_token(user_access_token)
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.delete(
             f"{USERS_URL}/{user.id}/", headers={"token": admin_access_token}
@@ -105,7 +112,7 @@ async def test_successful_delete_user(truncate_tables, create_user_and_admin):
 async def test_no_permissions_delete_user(tokens_fixture, truncate_tables, request):
     await truncate_tables
     access_token, user_access_token = await request.getfixturevalue(tokens_fixture)
-    user = await get_current_user(user_access_token)
+    user = await get_user_by_token(user_access_token)
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.delete(
             f"{USERS_URL}/{user.id}/", headers={"token": access_token}
@@ -121,8 +128,10 @@ async def test_no_permissions_delete_user(tokens_fixture, truncate_tables, reque
         ("?page=1&limit=30&sort_by=id&order_by=desc", 200),
         ("?page=-1&limit=30&sort_by=id&order_by=desc", 422),
         ("?page=1&limit=300&sort_by=id&order_by=desc", 422),
-        ("?page=1&limit=30&sort_by=invalid_field", 403),
-        ("?page=1&limit=30&order_by=invalid_order", 403),
+        ("?page=1&limit=30&sort_by=invalid_field", 400),
+        ("?page=1&limit=30&sort_by=hashed_password", 400),
+        ("?page=1&limit=30&sort_by=search_vector", 400),
+        ("?page=1&limit=30&order_by=invalid_order", 400),
     ],
 )
 @pytest.mark.asyncio
@@ -136,3 +145,148 @@ async def test_successful_get_users(
             f"{USERS_URL}/{query_params}/", headers={"token": admin_access_token}
         )
     assert response.status_code == expected_status
+
+
+@pytest.mark.parametrize(
+    "sort_by, order_by",
+    [("username", "asc"), ("username", "desc"), ("name", "asc"), ("name", "desc")],
+)
+@pytest.mark.asyncio
+async def test_cursor_pagination_visits_every_user_once(
+    truncate_tables, sort_by, order_by, create_user_and_admin
+):
+    await truncate_tables
+    admin_access_token = (await create_user_and_admin)[0]
+    params = {"limit": 1, "sort_by": sort_by, "order_by": order_by}
+    usernames = []
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        while True:
+            response = await client.get(
+                f"{USERS_URL}/", params=params, headers={"token": admin_access_token}
+            )
+            assert response.status_code == 200
+            usernames.extend(user["username"] for user in response.json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            params["cursor"] = response.headers["X-Next-Cursor"]
+    assert sorted(usernames) == ["adam_smith", "admin"]
+    if sort_by == "username":
+        assert usernames == sorted(usernames, reverse=order_by == "desc")
+
+
+@pytest.mark.parametrize(
+    "tokens_fixture, search, expected_usernames",
+    [
+        ("create_user_and_admin", "smith", ["adam_smith"]),
+        ("create_user_and_admin", "GMAIL.com", ["adam_smith", "admin"]),
+        ("create_user_and_admin", "nobody", []),
+        ("create_user_and_moderator_from_the_same_group", "adam", ["adam_smith"]),
+        ("create_user_and_moderator_from_diff_group", "adam", []),
+    ],
+)
+@pytest.mark.asyncio
+async def test_search_users(
+    tokens_fixture, search, expected_usernames, truncate_tables, request
+):
+    await truncate_tables
+    access_token = (await request.getfixturevalue(tokens_fixture))[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.get(
+            f"{USERS_URL}/", params={"search": search}, headers={"token": access_token}
+        )
+    assert response.status_code == 200
+    assert sorted(user["username"] for user in response.json()) == expected_usernames
+
+
+@pytest.mark.asyncio
+async def test_search_users_rejects_short_terms(truncate_tables, create_user_and_admin):
+    await truncate_tables
+    admin_access_token = (await create_user_and_admin)[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.get(
+            f"{USERS_URL}/",
+            params={"search": "ad"},
+            headers={"token": admin_access_token},
+        )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "tokens_fixture, q, expected_usernames",
+    [
+        ("create_user_and_admin", "adam smith", ["adam_smith"]),
+        ("create_user_and_admin", "gmail", ["adam_smith", "admin"]),
+        ("create_user_and_admin", "adam nobody", []),
+        ("create_user_and_moderator_from_the_same_group", "adam", ["adam_smith"]),
+        ("create_user_and_moderator_from_diff_group", "adam", []),
+    ],
+)
+@pytest.mark.asyncio
+async def test_full_text_search_users(
+    tokens_fixture, q, expected_usernames, truncate_tables, request
+):
+    await truncate_tables
+    access_token = (await request.getfixturevalue(tokens_fixture))[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.get(
+            f"{USERS_URL}/search/", params={"q": q}, headers={"token": access_token}
+        )
+    assert response.status_code == 200
+    assert sorted(user["username"] for user in response.json()) == expected_usernames
+
+
+@pytest.mark.asyncio
+async def test_full_text_search_pagination(truncate_tables, create_user_and_admin):
+    await truncate_tables
+    admin_access_token = (await create_user_and_admin)[0]
+    params = {"q": "gmail", "limit": 1}
+    usernames = []
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        while True:
+            response = await client.get(
+                f"{USERS_URL}/search/",
+                params=params,
+                headers={"token": admin_access_token},
+            )
+            usernames.extend(user["username"] for user in response.json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            params["cursor"] = response.headers["X-Next-Cursor"]
+    assert sorted(usernames) == ["adam_smith", "admin"]
+
+
+@pytest.mark.asyncio
+async def test_avatars_over_budget_are_returned_without_image(monkeypatch):
+    monkeypatch.setattr(users_service.settings, "AVATAR_FETCH_CONCURRENCY", 2)
+    monkeypatch.setattr(users_service.settings, "AVATAR_FETCH_BUDGET_SECONDS", 0.2)
+    users = [
+        User(
+            id=uuid.uuid4(),
+            username=username,
+            role="USER",
+            is_blocked=False,
+            created_at=datetime.now(),
+            modified_at=None,
+            image_s3_path=f"avatars/{username}",
+        )
+        for username in ("fast_1", "slow", "fast_2", "fast_3")
+    ]
+
+    class SlowS3UserService(UserService):
+        async def get_user_data_with_avatar(self, user, avatar_size=None):
+            await asyncio.sleep(1 if user.username == "slow" else 0.01)
+            return UserData(**user.to_dict(), image_url="url")
+
+    users_data = await SlowS3UserService(None).get_users_data_with_avatars(users)
+    assert [user_data.username for user_data in users_data] == [
+        "fast_1",
+        "slow",
+        "fast_2",
+        "fast_3",
+    ]
+    assert [user_data.image_url for user_data in users_data] == [
+        "url",
+        None,
+        "url",
+        "url",
+    ]
@@ -1,13 +1,19 @@
+import hashlib
+import io
+
 import pytest
 from httpx import AsyncClient
+from PIL import Image
 
+from src.aws import user_image_service
+from src.aws.user_image_service import S3UserImageService
 from src.main import app
 from src.users.schemas import UserData
-from src.utils import get_current_user
 from tests.fixtures import (
     client_base_url,
     create_user,
     create_user_and_admin,
+    get_user_by_token,
     user_signup_data,
 )
 
@@ -77,7 +83,7 @@ async def test_successful_patch_me(
 ):
     await truncate_tables
     access_token = (await create_user)[0]
-    user = await get_current_user(access_token)
+    user = await get_user_by_token(access_token)
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.patch(
             USERS_ME_URL,
@@ -95,13 +101,16 @@ async def test_successful_patch_me(
     user.modified_at = response_data.get("modified_at")
     patched_user = UserData(**response_data)
     if files:
-        user.image_s3_path = f"avatars/{user.id}"
+        with open("tests/test_files/test_avatar.jpg", "rb") as avatar:
+            avatar_hash = hashlib.sha256(avatar.read()).hexdigest()
+        user.image_s3_path = f"avatars/sha256/{avatar_hash}/original"
     assert (
-        UserData(**user.to_dict(), image=patched_user.image).model_dump()
+        UserData(**user.to_dict(), image_url=patched_user.image_url).model_dump()
         == patched_user.model_dump()
     )
     if files:
-        assert patched_user.image is not None
+        assert patched_user.image is None
+        assert patched_user.image_url == f"/users/{user.id}/avatar/"
 
 
 @pytest.mark.asyncio
@@ -162,3 +171,103 @@ async def test_invalid_token_delete_me(truncate_tables):
     async with AsyncClient(app=app, base_url=client_base_url) as client:
         response = await client.delete(USERS_ME_URL, headers={"token": access_token})
     assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_get_avatar(truncate_tables, create_user):
+    await truncate_tables
+    access_token = (await create_user)[0]
+    with open("tests/test_files/test_avatar.jpg", "rb") as avatar:
+        avatar_bytes = avatar.read()
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.patch(
+            USERS_ME_URL,
+            headers={"token": access_token},
+            files={"avatar": ("filename.jpg", avatar_bytes, "image/jpeg")},
+        )
+        avatar_url = response.json()["image_url"]
+        response = await client.get(avatar_url, headers={"token": access_token})
+        assert response.status_code == 200
+        assert response.content == avatar_bytes
+        assert response.headers["content-type"] == "image/jpeg"
+        assert response.headers["cache-control"].startswith("private")
+        assert (
+            response.headers["etag"] == f'"{hashlib.sha256(avatar_bytes).hexdigest()}"'
+        )
+
+        response = await client.get(
+            avatar_url,
+            headers={"token": access_token, "If-None-Match": response.headers["etag"]},
+        )
+        assert response.status_code == 304
+
+        response = await client.get(
+            avatar_url, params={"size": "64"}, headers={"token": access_token}
+        )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(response.content)).size == (64, 64)
+
+
+@pytest.mark.asyncio
+async def test_patch_me_rejects_invalid_avatar(truncate_tables, create_user):
+    await truncate_tables
+    access_token = (await create_user)[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.patch(
+            USERS_ME_URL,
+            headers={"token": access_token},
+            files={"avatar": ("filename.jpg", b"not an image", "image/jpeg")},
+        )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_patch_me_rejects_too_large_avatar(
+    truncate_tables, create_user, monkeypatch
+):
+    monkeypatch.setattr(user_image_service.settings, "AVATAR_MAX_UPLOAD_BYTES", 1024)
+    await truncate_tables
+    access_token = (await create_user)[0]
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        response = await client.patch(
+            USERS_ME_URL,
+            headers={"token": access_token},
+            files={
+                "avatar": (
+                    "filename.jpg",
+                    open("tests/test_files/test_avatar.jpg", "rb"),
+                    "image/jpeg",
+                )
+            },
+        )
+        assert response.status_code == 413
+        response = await client.get(USERS_ME_URL, headers={"token": access_token})
+    assert response.json()["image_s3_path"] is None
+
+
+@pytest.mark.asyncio
+async def test_identical_avatars_are_stored_once(
+    truncate_tables, create_user_and_admin
+):
+    await truncate_tables
+    access_tokens = await create_user_and_admin
+    with open("tests/test_files/test_avatar.jpg", "rb") as avatar:
+        avatar_bytes = avatar.read()
+    async with AsyncClient(app=app, base_url=client_base_url) as client:
+        paths = []
+        for access_token in access_tokens:
+            response = await client.patch(
+                USERS_ME_URL,
+                headers={"token": access_token},
+                files={"avatar": ("filename.jpg", avatar_bytes, "image/jpeg")},
+            )
+            paths.append(response.json()["image_s3_path"])
+        assert paths[0] == paths[1]
+        avatar_service = S3UserImageService()
+
+        await client.delete(USERS_ME_URL, headers={"token": access_tokens[0]})
+        assert await avatar_service.avatar_exists(paths[0])
+
+        await client.delete(USERS_ME_URL, headers={"token": access_tokens[1]})
+    assert not await avatar_service.avatar_exists(paths[0])